@@ -11,26 +11,52 @@ B. RMSE for each gsps form the last forecast
 """
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, Optional
 import sentry_sdk
+from sentry_sdk.tracing import Span
 
 import click
 from nowcasting_datamodel import N_GSP
 from nowcasting_datamodel.connection import DatabaseConnection
 from nowcasting_datamodel.models.base import Base_Forecast
-from nowcasting_datamodel.models.metric import DatetimeInterval
-from nowcasting_datamodel.read.read_metric import get_datetime_interval
+from nowcasting_datamodel.models.forecast import ForecastValueSQL
+from nowcasting_datamodel.models.metric import DatetimeInterval, DatetimeIntervalSQL
 
 import nowcasting_metrics
-from nowcasting_metrics.database.forecast import get_all_forecast_values
-from nowcasting_metrics.database.gsp_yield import get_gsp_yield
+from nowcasting_metrics.database.data_plan import iterate_data_plan, load_data_plan
+from nowcasting_metrics.database.forecast import (
+    get_all_forecast_values,
+    get_gsp_errors,
+    get_gsp_forecast_values,
+)
+from nowcasting_metrics.database.gsp_yield import (
+    get_all_gsp_yields,
+    get_gsp_yield,
+    get_pvlive_yields,
+    select_day_after_gsp_yields,
+    select_pvlive_yields,
+)
+from nowcasting_metrics.database.lookup import get_datetime_interval
+from nowcasting_metrics.metrics.backfill import make_backfill_metrics
+from nowcasting_metrics.metrics.gsp_horizons import make_gsp_horizon_metrics
 from nowcasting_metrics.metrics.mae import make_mae
 from nowcasting_metrics.metrics.me import make_me
 from nowcasting_metrics.metrics.metrics import check_metrics_in_database
 from nowcasting_metrics.metrics.rmse import make_rmse
 from nowcasting_metrics.metrics.ramp_rate import make_ramp_rate
 from nowcasting_metrics.metrics.probablistic import make_probabilistic
+from nowcasting_metrics.metrics.utils import (
+    default_gsp_models,
+    default_max_forecast_horizon_minutes,
+    default_national_models,
+    default_probabilistic_models,
+    get_all_aligned_forecast_values,
+    get_forecast_value_columns,
+)
+from nowcasting_metrics.profiling import StageProfiler, count_queries
+from nowcasting_metrics.utils import MetricValueWriter
 
 logging.basicConfig(
     level=getattr(logging, os.getenv("LOGLEVEL", "DEBUG")),
@@ -48,7 +74,243 @@ sentry_sdk.init(
 sentry_sdk.set_tag("app_name", "nowcasting_metrics")
 sentry_sdk.set_tag("version", nowcasting_metrics.__version__)
 
-@click.command()
+
+# the metric tasks that can be split into one task for each model, and their models.
+# make_mae and make_rmse also make gsp metrics, which are not split by model
+metric_task_model_names = {
+    make_me: default_national_models,
+    make_ramp_rate: default_national_models,
+    make_probabilistic: default_probabilistic_models,
+}
+
+
+def split_metric_tasks_by_model(metric_tasks: list[tuple[Callable, dict]]) -> list:
+    """
+    Split metric tasks that run over all models into one task for each model
+
+    Each task only gets the forecast values of its model, and only runs for that model.
+    Models without forecast values do not get a task.
+
+    :param metric_tasks: list of (metric function, keyword arguments)
+    :return: list of (metric function, keyword arguments)
+    """
+    split_metric_tasks = []
+    for function, kwargs in metric_tasks:
+        if function not in metric_task_model_names:
+            split_metric_tasks.append((function, kwargs))
+            continue
+
+        all_forecast_values = kwargs["all_forecast_values"]
+        for model_name in kwargs.get("model_names") or metric_task_model_names[function]:
+            if model_name not in all_forecast_values:
+                continue
+
+            split_metric_tasks.append(
+                (
+                    function,
+                    {
+                        **kwargs,
+                        "all_forecast_values": {model_name: all_forecast_values[model_name]},
+                        "model_names": [model_name],
+                    },
+                )
+            )
+
+    return split_metric_tasks
+
+
+def get_worker_kwargs(kwargs: dict) -> dict:
+    """
+    Get the keyword arguments of a metric task, to run it in a worker thread
+
+    A DatetimeIntervalSQL belongs to the main session, so it is changed to a DatetimeInterval.
+    The worker then looks up the datetime interval in its own session.
+
+    :param kwargs: keyword arguments of the metric function
+    :return: keyword arguments
+    """
+    datetime_interval = kwargs.get("datetime_interval")
+    if isinstance(datetime_interval, DatetimeIntervalSQL):
+        datetime_interval = DatetimeInterval(
+            start_datetime_utc=datetime_interval.start_datetime_utc,
+            end_datetime_utc=datetime_interval.end_datetime_utc,
+        )
+        kwargs = {**kwargs, "datetime_interval": datetime_interval}
+
+    return kwargs
+
+
+def run_metric_tasks(
+    connection: DatabaseConnection,
+    session,
+    metric_tasks: list[tuple[Callable, dict]],
+    metric_value_writer: MetricValueWriter,
+    workers: int = 1,
+    profiler: Optional[StageProfiler] = None,
+):
+    """
+    Run metric tasks, either one after another or in a thread pool
+
+    With more than one worker, each task gets its own session from the connection pool and its own
+    metric value writer. The metric values are then moved to 'metric_value_writer', so they are
+    all saved in one transaction at the end.
+
+    :param connection: database connection, used to make a session for each worker
+    :param session: the main database session, used when there is one worker
+    :param metric_tasks: list of (metric function, keyword arguments). The function is also
+        given 'session' and 'metric_value_writer'
+    :param metric_value_writer: the writer to collect all the metric values in
+    :param workers: the number of threads to use
+    :param profiler: optional profiler, each task is profiled as one stage
+    """
+    if profiler is None:
+        profiler = StageProfiler()
+
+    if workers <= 1:
+        for function, kwargs in metric_tasks:
+            run_profiled_metric_task(
+                profiler=profiler,
+                function=function,
+                kwargs=kwargs,
+                session=session,
+                metric_value_writer=metric_value_writer,
+            )
+        return
+
+    # the sentry scope is not passed to the worker threads, so the stages are given the span of
+    # the run as their parent
+    parent_span = sentry_sdk.get_current_span()
+
+    def run_metric_task(function: Callable, kwargs: dict) -> MetricValueWriter:
+        with connection.get_session() as worker_session:
+            worker_metric_value_writer = MetricValueWriter(session=worker_session)
+            run_profiled_metric_task(
+                profiler=profiler,
+                function=function,
+                kwargs=kwargs,
+                session=worker_session,
+                metric_value_writer=worker_metric_value_writer,
+                parent_span=parent_span,
+            )
+            # save any locations or models made by the worker, so the main session can use them
+            worker_session.commit()
+        return worker_metric_value_writer
+
+    # the workers only get plain values, not objects from the main session
+    metric_tasks = [
+        (function, get_worker_kwargs(kwargs))
+        for function, kwargs in split_metric_tasks_by_model(metric_tasks)
+    ]
+    logger.info(f"Running {len(metric_tasks)} metric tasks with {workers} workers")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_metric_task, function, kwargs) for function, kwargs in metric_tasks
+        ]
+        for future in futures:
+            metric_value_writer.extend(future.result())
+
+
+def run_profiled_metric_task(
+    profiler: StageProfiler,
+    function: Callable,
+    kwargs: dict,
+    session,
+    metric_value_writer: MetricValueWriter,
+    parent_span: Optional[Span] = None,
+):
+    """
+    Run one metric task as a profiled stage
+
+    The rows in are the forecast values given to the task, and the rows out are the metric values
+
+    :param profiler: the stage profiler
+    :param function: the metric function
+    :param kwargs: the keyword arguments of the metric function
+    :param session: database session
+    :param metric_value_writer: the writer to collect the metric values in
+    :param parent_span: optional parent span of the stage, see 'StageProfiler.stage'
+    """
+    all_forecast_values = kwargs.get("all_forecast_values", {})
+    tags = {}
+    if len(all_forecast_values) == 1:
+        tags["model_name"] = list(all_forecast_values)[0]
+
+    with profiler.stage(function.__name__, parent_span=parent_span, **tags) as stage:
+        stage["rows_in"] = sum(len(v) for v in all_forecast_values.values())
+        number_of_metric_values = len(metric_value_writer)
+
+        function(session=session, metric_value_writer=metric_value_writer, **kwargs)
+
+        stage["rows_out"] = len(metric_value_writer) - number_of_metric_values
+
+
+def load_data_plan_and_make_me(
+    connection: DatabaseConnection,
+    session,
+    data_plan: dict,
+    me_kwargs: dict,
+    metric_value_writer: MetricValueWriter,
+    workers: int = 1,
+    profiler: Optional[StageProfiler] = None,
+    **kwargs,
+) -> dict:
+    """
+    Load the data plan one model at a time, and make the ME of each model before the next is loaded
+
+    The "me" part of the plan has the longest datetime interval, so only one model's forecast
+    values for it are in memory at once. The other parts of the plan, e.g. "daily", are copied out
+    of each model's data, so they do not keep the rest of the model's data in memory.
+
+    :param connection: database connection, see 'run_metric_tasks'
+    :param session: the main database session
+    :param data_plan: {name: (datetime_interval, forecast_created_utc)}, see 'load_data_plan'
+    :param me_kwargs: keyword arguments of 'make_me', apart from the forecast values and gsp yields
+    :param metric_value_writer: the writer to collect the metric values in
+    :param workers: the number of threads to run the ME in, see 'run_metric_tasks'
+    :param profiler: optional profiler
+    :param kwargs: other keyword arguments of 'iterate_data_plan'
+    :return: {name: (all_forecast_values, gsp_yields)} for the parts of the plan apart from "me"
+    """
+    data = {name: ({}, None) for name in data_plan if name != "me"}
+    for model_name, model_data in iterate_data_plan(
+        session=session, data_plan=data_plan, profiler=profiler, **kwargs
+    ):
+        for name in data:
+            all_forecast_values, gsp_yields = model_data[name]
+            if model_name in all_forecast_values:
+                data[name][0][model_name] = all_forecast_values[model_name].copy()
+            data[name] = (data[name][0], gsp_yields)
+
+        all_forecast_values, gsp_yields = model_data.get("me", ({}, None))
+        if model_name in all_forecast_values and model_name in metric_task_model_names[make_me]:
+            run_metric_tasks(connection=connection,
+                             session=session,
+                             metric_tasks=[(make_me, dict(**me_kwargs,
+                                                          all_forecast_values=all_forecast_values,
+                                                          gsp_yields=gsp_yields,
+                                                          model_names=[model_name]))],
+                             metric_value_writer=metric_value_writer,
+                             workers=workers,
+                             profiler=profiler)
+
+        # let go of this model before the next one is loaded
+        del model_data, all_forecast_values
+
+    return data
+
+
+@click.group()
+def cli():
+    """
+    Make the nowcasting metrics
+
+    'app' makes the daily metrics and the ME for one run, and 'backfill' makes the daily metrics
+    for a range of days
+    """
+
+
+@cli.command()
 @click.option(
     "--db-url",
     default=None,
@@ -71,10 +333,62 @@ sentry_sdk.set_tag("version", nowcasting_metrics.__version__)
     help="Number of gsps data to pull",
     type=click.STRING,
 )
+@click.option(
+    "--statistics-dir",
+    default=None,
+    envvar="STATISTICS_DIR",
+    help="Optional directory to keep daily error statistics in. If given, the weekly ME "
+    "only works out the new days, and adds up the statistics of the other days",
+    type=click.STRING,
+)
+@click.option(
+    "--workers",
+    default=1,
+    envvar="WORKERS",
+    help="Number of threads to run the metrics in. Default is 1, which runs them one after another",
+    type=click.INT,
+)
+@click.option(
+    "--profile-report",
+    default=None,
+    envvar="PROFILE_REPORT",
+    help="Optional JSON file to save the time, rows, queries and memory of each stage to",
+    type=click.STRING,
+)
+@click.option(
+    "--gsp-array-dir",
+    default=None,
+    envvar="GSP_ARRAY_DIR",
+    help="Optional directory to memory map the forecast arrays of the gsp horizon metrics in",
+    type=click.STRING,
+)
+@click.option(
+    "--cache-dir",
+    default=None,
+    envvar="CACHE_DIR",
+    help="Optional directory to cache the forecast values and gsp yields in, so each run only "
+    "loads the new ones from the database",
+    type=click.STRING,
+)
+@click.option(
+    "--chunksize",
+    default=None,
+    envvar="CHUNKSIZE",
+    help="Optional number of forecast values rows to read from the database at once. If given, "
+    "the forecast values are also loaded one model at a time, and the ME of each model is made "
+    "before the next is loaded",
+    type=click.INT,
+)
 def app(
     db_url: str,
     datetime_now: Optional[str] = None,
     n_gsps: Optional[int] = N_GSP,
+    statistics_dir: Optional[str] = None,
+    workers: int = 1,
+    profile_report: Optional[str] = None,
+    gsp_array_dir: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    chunksize: Optional[int] = None,
 ):
     """
     Main App for making metircs
@@ -82,10 +396,17 @@ def app(
     :param db_url: the database url
     :param datetime_now: the datetime now, for making metris
     :param n_gsps: the number of gsps we should use
+    :param statistics_dir: optional directory to keep daily error statistics in
+    :param workers: the number of threads to run the metrics in
+    :param profile_report: optional JSON file to save the profiling report to
+    :param gsp_array_dir: optional directory to memory map the gsp forecast arrays in
+    :param cache_dir: optional directory to cache the forecast values and gsp yields in
+    :param chunksize: optional number of forecast values rows to read from the database at once
     """
     # Get the environment variables to determine which metrics to run
     run_metrics = os.getenv("RUN_METRICS", "true").lower() == "true"
     run_me = os.getenv("RUN_ME", "true").lower() == "true"
+    run_gsp_horizon_metrics = os.getenv("RUN_GSP_HORIZON_METRICS", "false").lower() == "true"
 
     logger.info(f"Running Metrics app ({nowcasting_metrics.__version__})")
     n_gsps = int(n_gsps)
@@ -98,8 +419,13 @@ def app(
 
     logger.debug(f"datetime_now is {datetime_now}")
 
+    # each stage of the run is profiled, and is a span in the sentry transaction
+    profiler = StageProfiler()
+
     connection = DatabaseConnection(url=db_url, base=Base_Forecast, echo=False)
-    with connection.get_session() as session:
+    count_queries(connection.engine)
+    with sentry_sdk.start_transaction(op="metrics", name="nowcasting_metrics"), \
+            connection.get_session() as session:
         # check metrics are in the database
         check_metrics_in_database(session=session)
 
@@ -112,56 +438,171 @@ def app(
         )
         logger.debug(f"Will be running metrics for {start_datetime} to {end_datetime}")
 
+        # the forecast values and gsp yields are loaded once for both the daily metrics and the ME,
+        # and each gets a slice of them
+        data_plan = {}
+        metric_names = []
+        if run_metrics:
+            data_plan["daily"] = (datetime_interval, start_datetime)
+            metric_names += ["mae", "rmse", "ramp_rate", "probabilistic"]
+        if run_me:
+            # get start and end datetime for 1 week ago
+            me_start_datetime = datetime_now - timedelta(days=7)
+            me_start_datetime = datetime.combine(me_start_datetime, datetime.min.time())
+            me_end_datetime = me_start_datetime + timedelta(days=7)
+            me_datetime_interval = get_datetime_interval(
+                start_datetime_utc=me_start_datetime,
+                end_datetime_utc=me_end_datetime,
+                session=session,
+            )
+            logger.debug(f"Will be running ME metrics for {me_start_datetime} to {me_end_datetime}")
+            data_plan["me"] = (me_datetime_interval, None)
+            metric_names += ["me"]
+        # collect all the metric values, so they can be saved in one bulk insert
+        metric_value_writer = MetricValueWriter(session=session)
+
+        # the metrics to run, these are (metric function, keyword arguments)
+        metric_tasks = []
 
         try:
+            data = {}
+            if len(data_plan) > 0:
+                # only load the columns the metrics use, and the plevels for the probabilistic
+                # models
+                load_kwargs = dict(session=session,
+                                   data_plan=data_plan,
+                                   profiler=profiler,
+                                   cache_dir=cache_dir,
+                                   columns=get_forecast_value_columns(metric_names),
+                                   properties_model_names=default_probabilistic_models,
+                                   datetime_now=datetime.combine(datetime_now,
+                                                                 datetime.min.time(),
+                                                                 tzinfo=timezone.utc),
+                                   chunksize=chunksize)
+                if chunksize is None:
+                    data = load_data_plan(**load_kwargs)
+                else:
+                    # one model at a time, so the ME is made as each model is loaded
+                    data = load_data_plan_and_make_me(
+                        connection=connection,
+                        me_kwargs=dict(datetime_interval=me_datetime_interval if run_me else None,
+                                       statistics_dir=statistics_dir),
+                        metric_value_writer=metric_value_writer,
+                        workers=workers,
+                        **load_kwargs)
+
             # Check if RUN_METRICS is enabled (default: true). If true, run standard forecast evaluation metrics
             if run_metrics:
 
                 # get data
-                all_forecast_values = get_all_forecast_values(session=session, forecast_created_utc=start_datetime)
-                gsp_yields_df = get_gsp_yield(session=session, gsp_id=0, start_datetime=start_datetime)
+                all_forecast_values, gsp_yields_df = data["daily"]
+
+                # get the latest forecast errors for all gsps and models in one query
+                with profiler.stage("get_gsp_errors") as stage:
+                    gsp_errors_df = get_gsp_errors(session=session,
+                                                   datetime_interval=datetime_interval,
+                                                   model_names=default_gsp_models,
+                                                   n_gsps=n_gsps)
+                    stage["rows_out"] = len(gsp_errors_df)
+
+                # get the PVLive in-day and day-after yields for all gsps in one query
+                with profiler.stage("get_all_gsp_yields") as stage:
+                    all_gsp_yields_df = get_all_gsp_yields(session=session,
+                                                           datetime_interval=datetime_interval,
+                                                           n_gsps=n_gsps)
+                    pvlive_yields_df = select_pvlive_yields(all_gsp_yields_df,
+                                                            datetime_interval=datetime_interval)
+                    stage["rows_out"] = len(all_gsp_yields_df)
+
+                # get the latest forecast for each target time and forecast horizon, with the truth,
+                # once for each model. This is shared by the MAE, RMSE and probabilistic metrics
+                with profiler.stage("get_all_aligned_forecast_values") as stage:
+                    all_aligned_forecast_values = get_all_aligned_forecast_values(
+                        datetime_interval=datetime_interval,
+                        all_forecast_values=all_forecast_values,
+                        gsp_yields=gsp_yields_df)
+                    stage["rows_in"] = sum(len(v) for v in all_forecast_values.values())
+                    stage["rows_out"] = sum(len(v) for v in all_aligned_forecast_values.values())
 
                 # run daily MAE
-                make_mae(session=session,
-                         datetime_interval=datetime_interval,
-                         n_gsps=n_gsps,
-                         all_forecast_values=all_forecast_values,
-                         gsp_yields=gsp_yields_df)
+                metric_tasks.append((make_mae, dict(datetime_interval=datetime_interval,
+                                                    n_gsps=n_gsps,
+                                                    all_forecast_values=all_forecast_values,
+                                                    gsp_yields=gsp_yields_df,
+                                                    gsp_errors=gsp_errors_df,
+                                                    pvlive_yields=pvlive_yields_df,
+                                                    all_aligned_forecast_values=all_aligned_forecast_values)))
 
                 # run daily RMSE
-                # make_rmse(session=session, datetime_interval=datetime_interval, n_gsps=n_gsps)
+                metric_tasks.append((make_rmse, dict(datetime_interval=datetime_interval,
+                                                     n_gsps=n_gsps,
+                                                     all_forecast_values=all_forecast_values,
+                                                     gsp_yields=gsp_yields_df,
+                                                     gsp_errors=gsp_errors_df,
+                                                     pvlive_yields=pvlive_yields_df,
+                                                     all_aligned_forecast_values=all_aligned_forecast_values)))
 
                 # run ramp rate
-                make_ramp_rate(session=session,
-                               datetime_interval=datetime_interval,
-                               all_forecast_values=all_forecast_values,
-                               gsp_yields=gsp_yields_df)
+                metric_tasks.append((make_ramp_rate, dict(datetime_interval=datetime_interval,
+                                                          all_forecast_values=all_forecast_values,
+                                                          gsp_yields=gsp_yields_df)))
 
                 # run probabilistic metrics
-                make_probabilistic(session=session,
-                                   datetime_interval=datetime_interval,
-                                   all_forecast_values=all_forecast_values,
-                                   gsp_yields=gsp_yields_df)
+                metric_tasks.append((make_probabilistic, dict(datetime_interval=datetime_interval,
+                                                              all_forecast_values=all_forecast_values,
+                                                              gsp_yields=gsp_yields_df,
+                                                              all_aligned_forecast_values=all_aligned_forecast_values)))
 
-            # Check if RUN_ME is enabled (default: true). If true, compute the Mean Error (ME) metric separately
-            if run_me:
-                # get start and end datetime for 1 week ago
-                start_datetime = datetime_now - timedelta(days=7)
-                start_datetime = datetime.combine(start_datetime, datetime.min.time())
-                end_datetime = start_datetime + timedelta(days=7)
-                datetime_interval = get_datetime_interval(
-                    start_datetime_utc=start_datetime, end_datetime_utc=end_datetime, session=session
-                )
-                logger.debug(f"Will be running metrics for {start_datetime} to {end_datetime}")
+            # Check if RUN_GSP_HORIZON_METRICS is enabled (default: false). If true, run the MAE for
+            # each gsp and forecast horizon
+            if run_gsp_horizon_metrics:
+                all_gsp_forecast_values = {}
+                for model_name in default_gsp_models:
+                    with profiler.stage("get_gsp_forecast_values", model_name=model_name) as stage:
+                        all_gsp_forecast_values[model_name] = get_gsp_forecast_values(
+                            session=session,
+                            model_name=model_name,
+                            datetime_interval=datetime_interval,
+                            n_gsps=n_gsps)
+                        stage["rows_out"] = len(all_gsp_forecast_values[model_name])
+                if not run_metrics:
+                    with profiler.stage("get_all_gsp_yields") as stage:
+                        all_gsp_yields_df = get_all_gsp_yields(session=session,
+                                                               datetime_interval=datetime_interval,
+                                                               n_gsps=n_gsps)
+                        stage["rows_out"] = len(all_gsp_yields_df)
+                gsp_horizon_yields_df = select_day_after_gsp_yields(all_gsp_yields_df)
 
-                all_forecast_values = get_all_forecast_values(session=session)
-                gsp_yields_df = get_gsp_yield(session=session, gsp_id=0)
+                metric_tasks.append((make_gsp_horizon_metrics,
+                                     dict(datetime_interval=datetime_interval,
+                                          all_gsp_forecast_values=all_gsp_forecast_values,
+                                          gsp_yields=gsp_horizon_yields_df,
+                                          n_gsps=n_gsps,
+                                          array_dir=gsp_array_dir)))
+
+            # Check if RUN_ME is enabled (default: true). If true, compute the Mean Error (ME) metric separately
+            # with a chunksize, the ME has already been made as each model was loaded
+            if run_me and chunksize is None:
+                # get data
+                all_forecast_values, gsp_yields_df = data["me"]
 
                 # getting half hour metrics
-                make_me(session=session, datetime_interval=datetime_interval,all_forecast_values=all_forecast_values, gsp_yields=gsp_yields_df)
+                metric_tasks.append((make_me, dict(datetime_interval=me_datetime_interval,
+                                                   all_forecast_values=all_forecast_values,
+                                                   gsp_yields=gsp_yields_df,
+                                                   statistics_dir=statistics_dir)))
+
+            run_metric_tasks(connection=connection,
+                             session=session,
+                             metric_tasks=metric_tasks,
+                             metric_value_writer=metric_value_writer,
+                             workers=workers,
+                             profiler=profiler)
 
             # save values to database
-            session.commit()
+            with profiler.stage("save_metric_values") as stage:
+                stage["rows_out"] = metric_value_writer.flush()
+                session.commit()
 
             # Logging that service has finished.
             logger.info("Metrics service has finished processing.")
@@ -170,10 +611,100 @@ def app(
             logger.error("Metrics service stopped due to memory issues.")
         except Exception as e:
             raise e
+        finally:
+            # save the report of the stages that ran, even if the run failed
+            profiler.save_report(profile_report)
 
         logger.info("Metrics app service finished")
 
 
+@cli.command()
+@click.option(
+    "--db-url",
+    default=None,
+    envvar="DB_URL",
+    help="The Database URL where forecasts will be saved",
+    type=click.STRING,
+)
+@click.option(
+    "--start",
+    required=True,
+    help="The first day to make metrics for. Must be in the format YYYY-MM-DD",
+    type=click.STRING,
+)
+@click.option(
+    "--end",
+    required=True,
+    help="The day after the last day to make metrics for. Must be in the format YYYY-MM-DD",
+    type=click.STRING,
+)
+@click.option(
+    "--n-gsps",
+    default=N_GSP,
+    envvar="N_GSPS",
+    help="Number of gsps data to pull",
+    type=click.STRING,
+)
+def backfill(db_url: str, start: str, end: str, n_gsps: Optional[int] = N_GSP):
+    """
+    Backfill the daily metrics for a range of days
+
+    The data is loaded once for the whole range, and then split into days,
+    see 'nowcasting_metrics.metrics.backfill'. The forecast values are loaded from the full
+    history table, so any range can be backfilled. All the days are saved in one bulk insert.
+
+    :param db_url: the database url
+    :param start: the first day, YYYY-MM-DD
+    :param end: the day after the last day, YYYY-MM-DD
+    :param n_gsps: the number of gsps we should use
+    """
+    logger.info(f"Running Metrics backfill ({nowcasting_metrics.__version__})")
+    n_gsps = int(n_gsps)
+
+    start_datetime = datetime.strptime(start, "%Y-%m-%d")
+    end_datetime = datetime.strptime(end, "%Y-%m-%d")
+    datetime_interval = DatetimeInterval(
+        start_datetime_utc=start_datetime, end_datetime_utc=end_datetime
+    )
+    logger.debug(f"Will be backfilling metrics for {start_datetime} to {end_datetime}")
+
+    connection = DatabaseConnection(url=db_url, base=Base_Forecast, echo=False)
+    with connection.get_session() as session:
+        # check metrics are in the database
+        check_metrics_in_database(session=session)
+
+        # get data for the whole range, from the full history forecast values table
+        all_forecast_values = get_all_forecast_values(
+            session=session,
+            forecast_created_utc=start_datetime,
+            expand_plevels=False,
+            datetime_interval=datetime_interval,
+            max_forecast_horizon_minutes=default_max_forecast_horizon_minutes,
+            model=ForecastValueSQL)
+        gsp_yields_df = get_gsp_yield(session=session,
+                                      gsp_id=0,
+                                      start_datetime=start_datetime,
+                                      end_datetime=end_datetime)
+        pvlive_yields_df = get_pvlive_yields(session=session,
+                                             datetime_interval=datetime_interval,
+                                             n_gsps=n_gsps)
+
+        metric_value_writer = MetricValueWriter(session=session)
+        make_backfill_metrics(session=session,
+                              start_datetime=start_datetime,
+                              end_datetime=end_datetime,
+                              all_forecast_values=all_forecast_values,
+                              gsp_yields=gsp_yields_df,
+                              pvlive_yields=pvlive_yields_df,
+                              metric_value_writer=metric_value_writer)
+
+        # save values to database
+        metric_value_writer.flush()
+        session.commit()
+
+        logger.info("Metrics backfill finished")
+
+
 
 if __name__ == "__main__":
-    app()
+    cli()
@@ -0,0 +1,442 @@
+""" Benchmark the metrics on synthetic data, without a database
+
+1. Make synthetic forecast values for some models, and synthetic national gsp yields.
+The number of models, days of lookback, forecast runs per hour, forecast horizons and
+p levels can all be changed, so the data can be made as big as production.
+
+2. Run the metrics on the data in memory. The locations, metrics, models and datetime intervals
+are put in the lookup cache of a session without a database, so no queries are made.
+The metric values are collected in a metric value writer, which is never flushed.
+
+3. Report the time and peak memory of each metric
+
+Run with
+```
+python nowcasting_metrics/benchmark.py --days=7 --runs-per-hour=2 --report=benchmark.json
+```
+"""
+import json
+import logging
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from statistics import NormalDist
+from typing import Optional
+
+import click
+import numpy as np
+import pandas as pd
+from nowcasting_datamodel.models.gsp import LocationSQL
+from nowcasting_datamodel.models.metric import DatetimeInterval, DatetimeIntervalSQL, MetricSQL
+from nowcasting_datamodel.models.models import MLModelSQL
+from sqlalchemy.orm.session import Session
+
+from nowcasting_metrics.database.lookup import add_to_lookup_cache
+from nowcasting_metrics.database.schema import to_compact_forecast_values, to_compact_gsp_yields
+from nowcasting_metrics.metrics.mae import make_mae_values_for_forecast_horizons
+from nowcasting_metrics.metrics.me import make_me
+from nowcasting_metrics.metrics.metrics import all_metrics
+from nowcasting_metrics.metrics.probablistic import make_probabilistic
+from nowcasting_metrics.metrics.ramp_rate import make_ramp_rate
+from nowcasting_metrics.metrics.rmse import make_rmse_values_for_forecast_horizons
+from nowcasting_metrics.metrics.utils import (
+    default_max_forecast_horizon_minutes,
+    default_national_models,
+    get_all_aligned_forecast_values,
+    get_forecast_range,
+)
+from nowcasting_metrics.profiling import StageProfiler
+from nowcasting_metrics.utils import MetricValueWriter
+
+logger = logging.getLogger(__name__)
+
+# the peak of the synthetic national solar generation
+capacity_mw = 10_000
+
+
+def get_synthetic_solar_generation_mw(datetimes: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Get a synthetic national solar generation, which is zero at night and peaks at midday
+
+    :param datetimes: the datetimes
+    :return: array of the solar generation in MW
+    """
+    hours = datetimes.hour + datetimes.minute / 60
+    daylight = np.clip(np.sin(np.pi * (hours - 6) / 12), 0, None)
+    return capacity_mw * np.asarray(daylight) ** 1.5
+
+
+def make_synthetic_gsp_yields(
+    start_datetime: datetime, end_datetime: datetime, seed: int = 0
+) -> pd.DataFrame:
+    """
+    Make synthetic national gsp yields, every half hour
+
+    :param start_datetime: the start
+    :param end_datetime: the end, this is included
+    :param seed: the random seed
+    :return: dataframe with index datetime_utc and column solar_generation_kw,
+        in the same format as 'get_gsp_yield'
+    """
+    rng = np.random.default_rng(seed)
+
+    datetimes = pd.date_range(
+        start_datetime.replace(tzinfo=None), end_datetime.replace(tzinfo=None), freq="30min"
+    ).tz_localize("UTC")
+    solar_generation_mw = get_synthetic_solar_generation_mw(datetimes)
+    solar_generation_mw = solar_generation_mw * rng.normal(1, 0.05, len(datetimes))
+
+    gsp_yields = pd.DataFrame(
+        {"solar_generation_kw": np.clip(solar_generation_mw, 0, None) * 1000},
+        index=pd.Index(datetimes, name="datetime_utc"),
+    )
+    return to_compact_gsp_yields(gsp_yields)
+
+
+def make_synthetic_forecast_values(
+    start_datetime: datetime,
+    end_datetime: datetime,
+    runs_per_hour: int = 2,
+    max_forecast_horizon_minutes: int = 480,
+    plevels: Optional[list[str]] = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Make synthetic national forecast values for one model
+
+    A forecast run is made every 60 / runs_per_hour minutes. Each run forecasts every half hour
+    from when it was made, up to the maximum forecast horizon. The error of the forecast gets
+    bigger with the forecast horizon, and the p levels are spread around the forecast.
+
+    :param start_datetime: the time of the first forecast run
+    :param end_datetime: the forecast runs are made before this
+    :param runs_per_hour: the number of forecast runs each hour
+    :param max_forecast_horizon_minutes: the maximum forecast horizon
+    :param plevels: the p levels, e.g. ['10', '90']
+    :param seed: the random seed
+    :return: dataframe with index target_time and columns expected_power_generation_megawatts,
+        adjust_mw, created_utc and the p levels, in the same format as 'get_forecast_values'
+    """
+    if plevels is None:
+        plevels = []
+    rng = np.random.default_rng(seed)
+
+    # the times are in UTC, without a timezone until the end
+    created_utc = pd.date_range(
+        start_datetime.replace(tzinfo=None),
+        end_datetime.replace(tzinfo=None),
+        freq=f"{60 // runs_per_hour}min",
+        inclusive="left",
+    )
+    forecast_horizons = np.arange(0, max_forecast_horizon_minutes, 30).astype("timedelta64[m]")
+
+    # one row for each forecast run and forecast horizon
+    target_times = created_utc.ceil("30min").to_numpy()[:, None] + forecast_horizons
+    created_utc = np.repeat(created_utc.to_numpy(), len(forecast_horizons))
+    target_times = target_times.ravel().astype("datetime64[ns]")
+    lead_minutes = (target_times - created_utc) / np.timedelta64(1, "m")
+    target_times = pd.DatetimeIndex(target_times).tz_localize("UTC")
+
+    # the forecast error is 2% of the capacity, going up to 10% at 8 hours
+    sigma = capacity_mw * (0.02 + 0.08 * np.clip(lead_minutes / 480, 0, 1))
+    truth = get_synthetic_solar_generation_mw(target_times)
+    daylight = truth > 0
+    forecast = np.clip(truth + rng.normal(0, 1, len(truth)) * sigma, 0, None)
+    forecast = np.where(daylight, forecast, 0)
+
+    forecast_values = pd.DataFrame(
+        {
+            "expected_power_generation_megawatts": forecast,
+            "adjust_mw": np.where(daylight, rng.normal(0, 0.01 * capacity_mw, len(truth)), 0),
+            "created_utc": pd.DatetimeIndex(created_utc).tz_localize("UTC"),
+        },
+        index=pd.Index(target_times, name="target_time"),
+    )
+    for plevel in plevels:
+        z = NormalDist().inv_cdf(float(plevel) / 100)
+        forecast_values[plevel] = np.where(daylight, np.clip(forecast + z * sigma, 0, None), 0)
+
+    # the same order as the database, by target time and then the latest forecast first
+    order = np.lexsort((-created_utc.astype("int64"), target_times.asi8))
+    forecast_values = forecast_values.iloc[order]
+
+    return to_compact_forecast_values(forecast_values, plevels=plevels)
+
+
+def make_synthetic_data(
+    end_datetime: datetime,
+    model_names: Optional[list[str]] = None,
+    days: int = 7,
+    runs_per_hour: int = 2,
+    max_forecast_horizon_minutes: Optional[int] = None,
+    plevels: Optional[list[str]] = None,
+    seed: int = 0,
+) -> tuple[dict, pd.DataFrame]:
+    """
+    Make synthetic forecast values for several models, and synthetic gsp yields
+
+    :param end_datetime: the end of the data
+    :param model_names: the model names, default is the national models
+    :param days: the number of days of lookback
+    :param runs_per_hour: the number of forecast runs each hour
+    :param max_forecast_horizon_minutes: the maximum forecast horizon for all the models.
+        If None, the default for each model is used
+    :param plevels: the p levels, default is 10 and 90
+    :param seed: the random seed
+    :return: 1. all forecast values {model_name: forecast_values}, 2. the gsp yields
+    """
+    if model_names is None:
+        model_names = default_national_models
+    if plevels is None:
+        plevels = ["10", "90"]
+
+    start_datetime = end_datetime - timedelta(days=days)
+
+    all_forecast_values = {}
+    for i, model_name in enumerate(model_names):
+        model_max_forecast_horizon_minutes = max_forecast_horizon_minutes
+        if model_max_forecast_horizon_minutes is None:
+            model_max_forecast_horizon_minutes = default_max_forecast_horizon_minutes.get(
+                model_name, 480
+            )
+
+        all_forecast_values[model_name] = make_synthetic_forecast_values(
+            start_datetime=start_datetime,
+            end_datetime=end_datetime,
+            runs_per_hour=runs_per_hour,
+            max_forecast_horizon_minutes=model_max_forecast_horizon_minutes,
+            plevels=plevels,
+            seed=seed + i,
+        )
+
+    gsp_yields = make_synthetic_gsp_yields(
+        start_datetime=start_datetime, end_datetime=end_datetime, seed=seed
+    )
+
+    return all_forecast_values, gsp_yields
+
+
+def make_offline_session(
+    model_names: list[str], datetime_intervals: list[DatetimeInterval]
+) -> Session:
+    """
+    Make a session without a database, with the lookups needed by the metrics in its cache
+
+    :param model_names: the model names
+    :param datetime_intervals: the datetime intervals
+    :return: session. Any query on this session raises an error
+    """
+    session = Session()
+
+    add_to_lookup_cache(session, LocationSQL(id=1, gsp_id=0, label="National"))
+    for i, metric in enumerate(all_metrics):
+        add_to_lookup_cache(
+            session, MetricSQL(id=i + 1, name=metric.name, description=metric.description)
+        )
+    for i, model_name in enumerate(model_names):
+        add_to_lookup_cache(session, MLModelSQL(id=i + 1, name=model_name))
+    for i, datetime_interval in enumerate(datetime_intervals):
+        add_to_lookup_cache(
+            session,
+            DatetimeIntervalSQL(
+                id=i + 1,
+                start_datetime_utc=datetime_interval.start_datetime_utc,
+                end_datetime_utc=datetime_interval.end_datetime_utc,
+            ),
+        )
+
+    return session
+
+
+def run_benchmark(
+    all_forecast_values: dict,
+    gsp_yields: pd.DataFrame,
+    end_datetime: datetime,
+    days: int = 7,
+) -> list[dict]:
+    """
+    Run the metrics on the data in memory, and get the time and peak memory of each one
+
+    Like the app, the daily metrics are for the last day and the ME is for the whole lookback.
+    The peak memory is measured with tracemalloc, which makes the metrics a bit slower.
+
+    :param all_forecast_values: all forecast values, from 'make_synthetic_data'
+    :param gsp_yields: the gsp yields, from 'make_synthetic_data'
+    :param end_datetime: the end of the data
+    :param days: the number of days of lookback
+    :return: list of the stages, each with the metric name, seconds, peak_memory_mb,
+        rows_in and rows_out (the number of metric values)
+    """
+    end_datetime = end_datetime.replace(tzinfo=timezone.utc)
+    datetime_interval = DatetimeInterval(
+        start_datetime_utc=end_datetime - timedelta(days=1), end_datetime_utc=end_datetime
+    )
+    me_datetime_interval = DatetimeInterval(
+        start_datetime_utc=end_datetime - timedelta(days=days), end_datetime_utc=end_datetime
+    )
+
+    session = make_offline_session(
+        model_names=list(all_forecast_values),
+        datetime_intervals=[datetime_interval, me_datetime_interval],
+    )
+    metric_value_writer = MetricValueWriter(session=session)
+    rows_in = sum(len(forecast_values) for forecast_values in all_forecast_values.values())
+
+    aligned = {}
+
+    def make_aligned():
+        aligned.update(
+            get_all_aligned_forecast_values(
+                datetime_interval=datetime_interval,
+                all_forecast_values=all_forecast_values,
+                gsp_yields=gsp_yields,
+            )
+        )
+
+    def make_values_for_forecast_horizons(function):
+        for model_name, aligned_forecast_values in aligned.items():
+            function(
+                session=session,
+                datetime_interval=datetime_interval,
+                forecast_values=all_forecast_values[model_name],
+                gsp_yields=gsp_yields,
+                forecast_horizons_minutes=[None]
+                + get_forecast_range(default_max_forecast_horizon_minutes.get(model_name, 480)),
+                model_name=model_name,
+                metric_value_writer=metric_value_writer,
+                aligned_forecast_values=aligned_forecast_values,
+            )
+
+    kwargs = dict(
+        session=session,
+        all_forecast_values=all_forecast_values,
+        gsp_yields=gsp_yields,
+        metric_value_writer=metric_value_writer,
+    )
+    benchmarks = {
+        "get_all_aligned_forecast_values": make_aligned,
+        "make_mae": lambda: make_values_for_forecast_horizons(
+            make_mae_values_for_forecast_horizons
+        ),
+        "make_rmse": lambda: make_values_for_forecast_horizons(
+            make_rmse_values_for_forecast_horizons
+        ),
+        "make_me": lambda: make_me(datetime_interval=me_datetime_interval, **kwargs),
+        "make_ramp_rate": lambda: make_ramp_rate(datetime_interval=datetime_interval, **kwargs),
+        "make_probabilistic": lambda: make_probabilistic(
+            datetime_interval=datetime_interval, all_aligned_forecast_values=aligned, **kwargs
+        ),
+    }
+
+    profiler = StageProfiler()
+    tracemalloc.start()
+    try:
+        for name, benchmark in benchmarks.items():
+            tracemalloc.reset_peak()
+            with profiler.stage(name) as stage:
+                stage["rows_in"] = rows_in
+                benchmark()
+                stage["rows_out"] = len(metric_value_writer)
+                stage["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 1024**2
+
+            # the metric values are not saved
+            metric_value_writer.metric_values = []
+    finally:
+        tracemalloc.stop()
+
+    for stage in profiler.stages:
+        logger.info(
+            f"{stage['name']} took {stage['seconds']:.3f} seconds, "
+            f"peak memory {stage['peak_memory_mb']:.1f} MB, {stage['rows_out']} metric values"
+        )
+
+    return profiler.stages
+
+
+@click.command()
+@click.option(
+    "--models",
+    default=",".join(default_national_models),
+    help="Comma separated model names",
+    type=click.STRING,
+)
+@click.option("--days", default=7, help="Number of days of lookback", type=click.INT)
+@click.option(
+    "--runs-per-hour", default=2, help="Number of forecast runs each hour", type=click.INT
+)
+@click.option(
+    "--max-forecast-horizon-minutes",
+    default=None,
+    help="Maximum forecast horizon for all models. Default is the default for each model",
+    type=click.INT,
+)
+@click.option("--plevels", default="10,90", help="Comma separated p levels", type=click.STRING)
+@click.option("--seed", default=0, help="Random seed", type=click.INT)
+@click.option(
+    "--report",
+    default=None,
+    help="Optional JSON file to save the benchmark results to",
+    type=click.STRING,
+)
+def main(
+    models: str,
+    days: int,
+    runs_per_hour: int,
+    max_forecast_horizon_minutes: Optional[int],
+    plevels: str,
+    seed: int,
+    report: Optional[str],
+):
+    """
+    Benchmark the metrics on synthetic data
+
+    :param models: comma separated model names
+    :param days: number of days of lookback
+    :param runs_per_hour: number of forecast runs each hour
+    :param max_forecast_horizon_minutes: maximum forecast horizon for all models
+    :param plevels: comma separated p levels
+    :param seed: random seed
+    :param report: optional JSON file to save the results to
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    end_datetime = datetime(2024, 7, 1)
+    all_forecast_values, gsp_yields = make_synthetic_data(
+        end_datetime=end_datetime,
+        model_names=models.split(","),
+        days=days,
+        runs_per_hour=runs_per_hour,
+        max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+        plevels=[plevel for plevel in plevels.split(",") if plevel != ""],
+        seed=seed,
+    )
+    logger.info(
+        f"Made {sum(len(f) for f in all_forecast_values.values())} forecast values "
+        f"for {len(all_forecast_values)} models"
+    )
+
+    stages = run_benchmark(
+        all_forecast_values=all_forecast_values,
+        gsp_yields=gsp_yields,
+        end_datetime=end_datetime,
+        days=days,
+    )
+
+    if report is not None:
+        with open(report, "w") as f:
+            json.dump(
+                {
+                    "models": models.split(","),
+                    "days": days,
+                    "runs_per_hour": runs_per_hour,
+                    "max_forecast_horizon_minutes": max_forecast_horizon_minutes,
+                    "plevels": plevels.split(","),
+                    "stages": stages,
+                },
+                f,
+                indent=2,
+                default=str,
+            )
+
+
+if __name__ == "__main__":
+    main()
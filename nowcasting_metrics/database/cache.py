@@ -0,0 +1,334 @@
+""" Incremental on-disk cache of the forecast values and gsp yields
+
+Each run of the app loads 3 weeks of forecast values and 8 days of gsp yields, but only about one
+day of these is new since the last run. With a cache directory, the loaders
+1. find the high-water mark of the cache, the latest created_utc of the rows in it
+2. only get rows made at or after the high-water mark from the database
+3. merge these into the cache, keeping the latest row for each key
+4. evict partitions that are older than the lookback, from the reference time of the run
+
+The cache is partitioned by day, with one csv file for each day. Forecast values are partitioned
+on the day they were made, and are kept for each set of columns, e.g.
+'<cache_dir>/forecast_values/pvnet_v2/adjust_mw-created_utc/2022-01-01.csv'.
+Gsp yields are partitioned on the day of their datetime_utc.
+"""
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import pandas as pd
+from nowcasting_datamodel.models.metric import DatetimeInterval
+from sqlalchemy.orm.session import Session
+
+from nowcasting_metrics.database.forecast import forecast_value_columns, get_forecast_values
+from nowcasting_metrics.database.gsp_yield import get_gsp_yield
+from nowcasting_metrics.database.schema import (
+    to_compact_forecast_values,
+    to_compact_gsp_yields,
+    to_compact_timestamps,
+)
+from nowcasting_metrics.metrics.utils import get_forecast_created_utc_start
+
+logger = logging.getLogger(__name__)
+
+high_water_mark_filename = "high_water_mark.txt"
+
+
+def to_utc_timestamp(value: datetime) -> pd.Timestamp:
+    """Get a datetime as a timestamp in UTC, naive datetimes are taken to be in UTC"""
+    value = pd.Timestamp(value)
+    if value.tzinfo is None:
+        return value.tz_localize("UTC")
+    return value.tz_convert("UTC")
+
+
+def get_cache_columns(columns: Optional[list[str]] = None) -> list[str]:
+    """
+    Get the forecast value columns to cache, in the order of 'forecast_value_columns'
+
+    created_utc is always cached, as the high-water mark is made from it.
+
+    :param columns: optional columns, from 'forecast_value_columns'. Default is all
+    :return: list of columns
+    """
+    if columns is None:
+        columns = forecast_value_columns
+
+    return [c for c in forecast_value_columns if c in columns or c == "created_utc"]
+
+
+def get_high_water_mark(partition_dir: str) -> Optional[pd.Timestamp]:
+    """
+    Get the latest created_utc of the rows in a cache
+
+    :param partition_dir: the directory of the partitions
+    :return: the high-water mark in UTC, or None if nothing is cached
+    """
+    filename = os.path.join(partition_dir, high_water_mark_filename)
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename) as f:
+        return pd.Timestamp(f.read().strip())
+
+
+def read_partition(filename: str, timestamp_columns: list[str]) -> pd.DataFrame:
+    """
+    Read one partition of a cache
+
+    :param filename: the csv file of the partition
+    :param timestamp_columns: the columns to parse as timestamps
+    :return: the rows of the partition
+    """
+    df = pd.read_csv(filename)
+    for column in timestamp_columns:
+        df[column] = to_compact_timestamps(pd.to_datetime(df[column], utc=True, format="ISO8601"))
+
+    return df
+
+
+def read_partitions(partition_dir: str, timestamp_columns: list[str]) -> pd.DataFrame:
+    """
+    Read all the partitions of a cache
+
+    :param partition_dir: the directory of the partitions
+    :param timestamp_columns: the columns to parse as timestamps
+    :return: the rows of all the partitions, or an empty dataframe
+    """
+    if not os.path.exists(partition_dir):
+        return pd.DataFrame()
+
+    filenames = sorted(f for f in os.listdir(partition_dir) if f.endswith(".csv"))
+    if len(filenames) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(
+        [
+            read_partition(os.path.join(partition_dir, filename), timestamp_columns)
+            for filename in filenames
+        ],
+        ignore_index=True,
+    )
+
+
+def update_partitions(
+    partition_dir: str,
+    new_rows: pd.DataFrame,
+    partition_column: str,
+    key_columns: list[str],
+    timestamp_columns: list[str],
+    lookback_start: datetime,
+):
+    """
+    Merge new rows into the partitions of a cache, and evict old partitions
+
+    Only the partitions with new rows are written. For each key the row with the latest
+    created_utc is kept.
+
+    :param partition_dir: the directory of the partitions
+    :param new_rows: the new rows, with a created_utc column
+    :param partition_column: the timestamp column to partition the rows on, by day
+    :param key_columns: the columns that make a row unique
+    :param timestamp_columns: the timestamp columns, including created_utc
+    :param lookback_start: partitions before the day of this are removed
+    """
+    os.makedirs(partition_dir, exist_ok=True)
+    lookback_day = pd.Timestamp(lookback_start).date()
+
+    if len(new_rows) > 0:
+        days = new_rows[partition_column].dt.date
+        for day, day_rows in new_rows.groupby(days):
+            if day < lookback_day:
+                continue
+
+            filename = os.path.join(partition_dir, f"{day.isoformat()}.csv")
+            if os.path.exists(filename):
+                cached_rows = read_partition(filename, timestamp_columns)
+                day_rows = pd.concat([cached_rows, day_rows], ignore_index=True)
+
+            day_rows = day_rows.sort_values("created_utc", kind="stable")
+            day_rows = day_rows.drop_duplicates(subset=key_columns, keep="last")
+            day_rows.to_csv(filename, index=False)
+
+        high_water_mark = new_rows.created_utc.max()
+        previous_high_water_mark = get_high_water_mark(partition_dir)
+        if previous_high_water_mark is None or high_water_mark > previous_high_water_mark:
+            with open(os.path.join(partition_dir, high_water_mark_filename), "w") as f:
+                f.write(high_water_mark.isoformat())
+
+    # evict old partitions
+    for filename in os.listdir(partition_dir):
+        if not filename.endswith(".csv"):
+            continue
+        if datetime.strptime(filename[: -len(".csv")], "%Y-%m-%d").date() < lookback_day:
+            logger.debug(f"Evicting cache partition {filename} from {partition_dir}")
+            os.remove(os.path.join(partition_dir, filename))
+
+
+def get_cached_forecast_values(
+    session: Session,
+    model_name: str,
+    cache_dir: str,
+    lookback_days: int = 21,
+    columns: Optional[list[str]] = None,
+    datetime_interval: Optional[DatetimeInterval] = None,
+    max_forecast_horizon_minutes: Optional[int] = None,
+    datetime_now: Optional[datetime] = None,
+) -> pd.DataFrame:
+    """
+    Get the forecast values for a model, only getting the new ones from the database
+
+    The plevels are always expanded into float32 columns, see 'get_forecast_values'.
+    The cache only has the rows made after the start of the lookback, and the datetime interval
+    and maximum forecast horizon select the rows from it, the same as 'get_forecast_values'.
+
+    :param session: database session
+    :param model_name: the model name
+    :param cache_dir: the cache directory
+    :param lookback_days: the number of days of forecast values to keep
+    :param columns: optional columns to load, from 'forecast_value_columns'. Default is all.
+        The cache is kept for each set of columns
+    :param datetime_interval: optional datetime interval, to only get these target times
+    :param max_forecast_horizon_minutes: optional maximum forecast horizon of the model, to only
+        get forecast values that can reach the datetime interval
+    :param datetime_now: optional reference time of the run, the lookback is from this.
+        Default is now
+    :return: forecast values, in the same format as 'get_forecast_values'
+    """
+    columns = get_cache_columns(columns)
+    partition_dir = os.path.join(cache_dir, "forecast_values", model_name, "-".join(columns))
+
+    if datetime_now is None:
+        datetime_now = datetime.now(tz=timezone.utc)
+    lookback_start = to_utc_timestamp(datetime_now) - timedelta(days=lookback_days)
+
+    high_water_mark = get_high_water_mark(partition_dir)
+    logger.debug(f"Forecast values cache for {model_name} has high-water mark {high_water_mark}")
+
+    if high_water_mark is None:
+        created_utc_start = lookback_start
+    else:
+        created_utc_start = high_water_mark
+    new_forecast_values = get_forecast_values(
+        session=session,
+        model_name=model_name,
+        expand_plevels=True,
+        created_utc_start=created_utc_start.to_pydatetime(),
+        columns=columns,
+    )
+    logger.info(f"Got {len(new_forecast_values)} new forecast values for {model_name}")
+
+    update_partitions(
+        partition_dir=partition_dir,
+        new_rows=new_forecast_values.reset_index(),
+        partition_column="created_utc",
+        key_columns=["target_time", "created_utc"],
+        timestamp_columns=["target_time", "created_utc"],
+        lookback_start=lookback_start,
+    )
+
+    forecast_values = read_partitions(
+        partition_dir, timestamp_columns=["target_time", "created_utc"]
+    )
+    if len(forecast_values) == 0:
+        forecast_values = new_forecast_values.reset_index()
+
+    forecast_values = forecast_values[forecast_values.created_utc >= lookback_start]
+    if datetime_interval is not None:
+        start_datetime = to_utc_timestamp(datetime_interval.start_datetime_utc)
+        end_datetime = to_utc_timestamp(datetime_interval.end_datetime_utc)
+        forecast_values = forecast_values[
+            (forecast_values.target_time >= start_datetime)
+            & (forecast_values.target_time <= end_datetime)
+        ]
+        if max_forecast_horizon_minutes is not None:
+            forecast_created_utc_start = get_forecast_created_utc_start(
+                datetime_interval=datetime_interval,
+                max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+            )
+            forecast_values = forecast_values[
+                forecast_values.created_utc >= to_utc_timestamp(forecast_created_utc_start)
+            ]
+    forecast_values = forecast_values.sort_values(
+        ["target_time", "created_utc"], ascending=[True, False], kind="stable"
+    )
+    forecast_values = forecast_values.set_index("target_time")
+    plevels = [c for c in forecast_values.columns if is_plevel(c)]
+
+    return to_compact_forecast_values(forecast_values, plevels=plevels)
+
+
+def get_cached_gsp_yield(
+    session: Session,
+    gsp_id: int,
+    cache_dir: str,
+    start_datetime: Optional[datetime] = None,
+    lookback_days: int = 8,
+    datetime_now: Optional[datetime] = None,
+) -> pd.DataFrame:
+    """
+    Get the gsp yields for a gsp, only getting the new ones from the database
+
+    :param session: database session
+    :param gsp_id: the gsp id
+    :param cache_dir: the cache directory
+    :param start_datetime: optional start datetime to filter the yields from,
+        the default is the start of the lookback
+    :param lookback_days: the number of days of gsp yields to keep
+    :param datetime_now: optional reference time of the run, the lookback is from this.
+        Default is now
+    :return: gsp yields, in the same format as 'get_gsp_yield'
+    """
+    partition_dir = os.path.join(cache_dir, "gsp_yields", str(gsp_id))
+
+    if datetime_now is None:
+        datetime_now = datetime.now(tz=timezone.utc)
+    lookback_start = to_utc_timestamp(datetime_now) - timedelta(days=lookback_days)
+    if start_datetime is not None:
+        lookback_start = min(lookback_start, to_utc_timestamp(start_datetime))
+
+    high_water_mark = get_high_water_mark(partition_dir)
+    logger.debug(f"Gsp yields cache for {gsp_id=} has high-water mark {high_water_mark}")
+
+    new_gsp_yields = get_gsp_yield(
+        session=session,
+        gsp_id=gsp_id,
+        # the gsp yield datetimes are naive UTC in the database
+        start_datetime=lookback_start.tz_localize(None).to_pydatetime(),
+        created_utc_start=None if high_water_mark is None else high_water_mark.to_pydatetime(),
+        include_created_utc=True,
+    )
+    logger.info(f"Got {len(new_gsp_yields)} new gsp yields for {gsp_id=}")
+
+    update_partitions(
+        partition_dir=partition_dir,
+        new_rows=new_gsp_yields.reset_index(),
+        partition_column="datetime_utc",
+        key_columns=["datetime_utc"],
+        timestamp_columns=["datetime_utc", "created_utc"],
+        lookback_start=lookback_start,
+    )
+
+    gsp_yields = read_partitions(partition_dir, timestamp_columns=["datetime_utc", "created_utc"])
+    if len(gsp_yields) == 0:
+        return new_gsp_yields.drop(columns="created_utc")
+
+    if start_datetime is None:
+        start_datetime = lookback_start
+    start_datetime = to_utc_timestamp(start_datetime)
+
+    gsp_yields = gsp_yields[gsp_yields.datetime_utc >= start_datetime]
+    gsp_yields = gsp_yields.sort_values("datetime_utc", kind="stable")
+    gsp_yields = gsp_yields.set_index("datetime_utc")[["solar_generation_kw"]]
+
+    return to_compact_gsp_yields(gsp_yields)
+
+
+def is_plevel(column: str) -> bool:
+    """Check if a column is a plevel, e.g. '10'"""
+    try:
+        float(column)
+    except ValueError:
+        return False
+    return True
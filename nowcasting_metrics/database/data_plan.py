@@ -0,0 +1,360 @@
+""" Load the data for all the metrics of a run once
+
+The daily metrics and the weekly ME use the same forecast values and national gsp yields, only for
+different datetime intervals and models. Rather than each loading these from the database, the
+data plan
+1. works out the models and the union of the datetime intervals that are needed
+2. loads the forecast values for each model, and the gsp yields, once. Only the target times in
+the union, and forecasts made recently enough to reach it, are loaded
+3. gives each part of the run a slice of these for its datetime interval and models
+
+The slices are positional, so the rows are not copied. With a cache directory, only the new
+forecast values and gsp yields are loaded from the database,
+see 'nowcasting_metrics.database.cache'.
+
+'iterate_data_plan' loads the same data one model at a time, so only one model's forecast values
+need to be in memory at once.
+"""
+import logging
+from datetime import datetime
+from typing import Iterator, Optional
+
+from nowcasting_datamodel.models.metric import DatetimeInterval
+from sqlalchemy.orm.session import Session
+
+from nowcasting_metrics.database.cache import get_cached_forecast_values, get_cached_gsp_yield
+from nowcasting_metrics.database.forecast import (
+    get_all_forecast_values,
+    get_forecast_model_names,
+    get_model_columns,
+)
+from nowcasting_metrics.database.gsp_yield import get_gsp_yield
+from nowcasting_metrics.metrics.utils import (
+    default_max_forecast_horizon_minutes,
+    slice_on_datetime_interval,
+)
+from nowcasting_metrics.profiling import StageProfiler
+
+logger = logging.getLogger(__name__)
+
+
+def get_union_datetime_interval(datetime_intervals: list[DatetimeInterval]) -> DatetimeInterval:
+    """
+    Get the datetime interval that covers all the datetime intervals
+
+    :param datetime_intervals: list of datetime intervals
+    :return: datetime interval from the earliest start to the latest end
+    """
+    return DatetimeInterval(
+        start_datetime_utc=min(d.start_datetime_utc for d in datetime_intervals),
+        end_datetime_utc=max(d.end_datetime_utc for d in datetime_intervals),
+    )
+
+
+def load_data_plan(
+    session: Session,
+    data_plan: dict,
+    expand_plevels: bool = True,
+    profiler: Optional[StageProfiler] = None,
+    cache_dir: Optional[str] = None,
+    columns: Optional[list[str]] = None,
+    properties_model_names: Optional[list[str]] = None,
+    datetime_now: Optional[datetime] = None,
+    chunksize: Optional[int] = None,
+) -> dict:
+    """
+    Load the forecast values and national gsp yields once for all the parts of a run
+
+    The data plan is a dictionary of {name: (datetime_interval, forecast_created_utc)}, e.g.
+
+        {
+            "daily": (daily_datetime_interval, start_datetime),
+            "me": (weekly_datetime_interval, None),
+        }
+
+    where forecast_created_utc selects the models with forecasts made after it,
+    see 'get_forecast_model_names'.
+
+    :param session: database session
+    :param data_plan: {name: (datetime_interval, forecast_created_utc)}
+    :param expand_plevels: if True, decode the 'properties' plevels into float32 columns
+    :param profiler: optional profiler, each load is profiled as one stage
+    :param cache_dir: optional directory to cache the forecast values and gsp yields in,
+        the plevels are then always expanded
+    :param columns: optional forecast value columns to load, see 'get_forecast_value_columns'.
+        Default is all. The cache is kept for each set of columns
+    :param properties_model_names: optional model names to load the 'properties' for,
+        if None they are loaded for all models
+    :param datetime_now: optional reference time of the run, the cache lookback is from this
+    :param chunksize: optional number of forecast values rows to read from the database at once,
+        see 'get_forecast_values_chunks'
+    :return: {name: (all_forecast_values, gsp_yields)}, where all_forecast_values is
+        {model_name: forecast values} and the forecast values and gsp yields only have the
+        target times in the datetime interval of that name
+    """
+    if profiler is None:
+        profiler = StageProfiler()
+
+    # 1. the models for each part, and the union of the datetime intervals
+    model_names, union_datetime_interval = get_data_plan_models(
+        session=session, data_plan=data_plan
+    )
+    all_model_names = list(dict.fromkeys(m for names in model_names.values() for m in names))
+
+    # 2. load the data once
+    if cache_dir is None:
+        all_forecast_values = get_all_forecast_values(
+            session=session,
+            expand_plevels=expand_plevels,
+            profiler=profiler,
+            model_names=all_model_names,
+            columns=columns,
+            properties_model_names=properties_model_names,
+            datetime_interval=union_datetime_interval,
+            max_forecast_horizon_minutes=default_max_forecast_horizon_minutes,
+            chunksize=chunksize,
+        )
+    else:
+        all_forecast_values = {}
+        for model_name in all_model_names:
+            all_forecast_values[model_name] = load_cached_forecast_values(
+                session=session,
+                model_name=model_name,
+                cache_dir=cache_dir,
+                datetime_interval=union_datetime_interval,
+                profiler=profiler,
+                columns=columns,
+                properties_model_names=properties_model_names,
+                datetime_now=datetime_now,
+            )
+
+    gsp_yields = load_gsp_yields(
+        session=session,
+        datetime_interval=union_datetime_interval,
+        profiler=profiler,
+        cache_dir=cache_dir,
+        datetime_now=datetime_now,
+    )
+
+    all_forecast_values = {
+        model_name: sort_on_index(forecast_values)
+        for model_name, forecast_values in all_forecast_values.items()
+    }
+
+    # 3. a slice for each part
+    data = {}
+    for name, (datetime_interval, _) in data_plan.items():
+        data[name] = (
+            {
+                model_name: slice_on_datetime_interval(
+                    df=all_forecast_values[model_name], datetime_interval=datetime_interval
+                )
+                for model_name in model_names[name]
+            },
+            slice_on_datetime_interval(df=gsp_yields, datetime_interval=datetime_interval),
+        )
+
+    return data
+
+
+def iterate_data_plan(
+    session: Session,
+    data_plan: dict,
+    expand_plevels: bool = True,
+    profiler: Optional[StageProfiler] = None,
+    cache_dir: Optional[str] = None,
+    columns: Optional[list[str]] = None,
+    properties_model_names: Optional[list[str]] = None,
+    datetime_now: Optional[datetime] = None,
+    chunksize: Optional[int] = None,
+) -> Iterator[tuple[str, dict]]:
+    """
+    Load the forecast values and national gsp yields for all the parts of a run, one model at a time
+
+    This is the same as 'load_data_plan', but the forecast values of each model are only loaded
+    when the next model is asked for. So if each model is used and then let go before the next,
+    only one model's forecast values are in memory at once. The gsp yields are loaded once.
+
+    :param session: database session
+    :param data_plan: {name: (datetime_interval, forecast_created_utc)}, see 'load_data_plan'
+    :param expand_plevels: if True, decode the 'properties' plevels into float32 columns
+    :param profiler: optional profiler, each load is profiled as one stage
+    :param cache_dir: optional directory to cache the forecast values and gsp yields in
+    :param columns: optional forecast value columns to load, see 'get_forecast_value_columns'
+    :param properties_model_names: optional model names to load the 'properties' for,
+        if None they are loaded for all models
+    :param datetime_now: optional reference time of the run, the cache lookback is from this
+    :param chunksize: optional number of forecast values rows to read from the database at once,
+        see 'get_forecast_values_chunks'
+    :return: iterator of (model_name, data), where data is {name: (all_forecast_values,
+        gsp_yields)} as from 'load_data_plan', with only this model in all_forecast_values.
+        Names that do not use the model have an empty all_forecast_values
+    """
+    if profiler is None:
+        profiler = StageProfiler()
+
+    model_names, union_datetime_interval = get_data_plan_models(
+        session=session, data_plan=data_plan
+    )
+    all_model_names = list(dict.fromkeys(m for names in model_names.values() for m in names))
+
+    gsp_yields = load_gsp_yields(
+        session=session,
+        datetime_interval=union_datetime_interval,
+        profiler=profiler,
+        cache_dir=cache_dir,
+        datetime_now=datetime_now,
+    )
+    gsp_yields_slices = {
+        name: slice_on_datetime_interval(df=gsp_yields, datetime_interval=datetime_interval)
+        for name, (datetime_interval, _) in data_plan.items()
+    }
+
+    for model_name in all_model_names:
+        if cache_dir is None:
+            forecast_values = get_all_forecast_values(
+                session=session,
+                expand_plevels=expand_plevels,
+                profiler=profiler,
+                model_names=[model_name],
+                columns=columns,
+                properties_model_names=properties_model_names,
+                datetime_interval=union_datetime_interval,
+                max_forecast_horizon_minutes=default_max_forecast_horizon_minutes,
+                chunksize=chunksize,
+            )[model_name]
+        else:
+            forecast_values = load_cached_forecast_values(
+                session=session,
+                model_name=model_name,
+                cache_dir=cache_dir,
+                datetime_interval=union_datetime_interval,
+                profiler=profiler,
+                columns=columns,
+                properties_model_names=properties_model_names,
+                datetime_now=datetime_now,
+            )
+        forecast_values = sort_on_index(forecast_values)
+
+        data = {}
+        for name, (datetime_interval, _) in data_plan.items():
+            all_forecast_values = {}
+            if model_name in model_names[name]:
+                all_forecast_values[model_name] = slice_on_datetime_interval(
+                    df=forecast_values, datetime_interval=datetime_interval
+                )
+            data[name] = (all_forecast_values, gsp_yields_slices[name])
+
+        yield model_name, data
+
+        # let go of this model before the next one is loaded
+        del forecast_values, data
+
+
+def get_data_plan_models(session: Session, data_plan: dict) -> tuple[dict, DatetimeInterval]:
+    """
+    Get the models for each part of a data plan, and the union of the datetime intervals
+
+    :param session: database session
+    :param data_plan: {name: (datetime_interval, forecast_created_utc)}, see 'load_data_plan'
+    :return: {name: model names}, and the union of the datetime intervals
+    """
+    model_names = {}
+    for name, (datetime_interval, forecast_created_utc) in data_plan.items():
+        model_names[name] = get_forecast_model_names(
+            session=session, forecast_created_utc=forecast_created_utc
+        )
+
+    union_datetime_interval = get_union_datetime_interval(
+        [datetime_interval for datetime_interval, _ in data_plan.values()]
+    )
+    logger.debug(
+        f"Loading data for {list(data_plan)} once, for models {model_names} from "
+        f"{union_datetime_interval.start_datetime_utc} to "
+        f"{union_datetime_interval.end_datetime_utc}"
+    )
+
+    return model_names, union_datetime_interval
+
+
+def load_cached_forecast_values(
+    session: Session,
+    model_name: str,
+    cache_dir: str,
+    datetime_interval: DatetimeInterval,
+    profiler: StageProfiler,
+    columns: Optional[list[str]] = None,
+    properties_model_names: Optional[list[str]] = None,
+    datetime_now: Optional[datetime] = None,
+):
+    """
+    Load the forecast values for one model through the cache, as one profiled stage
+
+    :param session: database session
+    :param model_name: the model name
+    :param cache_dir: the directory of the cache
+    :param datetime_interval: the datetime interval of the target times
+    :param profiler: the stage profiler
+    :param columns: optional forecast value columns to load
+    :param properties_model_names: optional model names to load the 'properties' for
+    :param datetime_now: optional reference time of the run, the cache lookback is from this
+    :return: forecast values
+    """
+    with profiler.stage("get_forecast_values", model_name=model_name) as stage:
+        forecast_values = get_cached_forecast_values(
+            session=session,
+            model_name=model_name,
+            cache_dir=cache_dir,
+            columns=get_model_columns(
+                model_name=model_name,
+                columns=columns,
+                properties_model_names=properties_model_names,
+            ),
+            datetime_interval=datetime_interval,
+            max_forecast_horizon_minutes=default_max_forecast_horizon_minutes.get(model_name),
+            datetime_now=datetime_now,
+        )
+        stage["rows_out"] = len(forecast_values)
+
+    return forecast_values
+
+
+def load_gsp_yields(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    profiler: StageProfiler,
+    cache_dir: Optional[str] = None,
+    datetime_now: Optional[datetime] = None,
+):
+    """
+    Load the national gsp yields from the start of the datetime interval, as one profiled stage
+
+    :param session: database session
+    :param datetime_interval: the datetime interval
+    :param profiler: the stage profiler
+    :param cache_dir: optional directory to cache the gsp yields in
+    :param datetime_now: optional reference time of the run, the cache lookback is from this
+    :return: gsp yields, sorted on datetime_utc
+    """
+    start_datetime = datetime_interval.start_datetime_utc.replace(tzinfo=None)
+    with profiler.stage("get_gsp_yield") as stage:
+        if cache_dir is None:
+            gsp_yields = get_gsp_yield(session=session, gsp_id=0, start_datetime=start_datetime)
+        else:
+            gsp_yields = get_cached_gsp_yield(
+                session=session,
+                gsp_id=0,
+                cache_dir=cache_dir,
+                start_datetime=start_datetime,
+                datetime_now=datetime_now,
+            )
+        stage["rows_out"] = len(gsp_yields)
+
+    return sort_on_index(gsp_yields)
+
+
+def sort_on_index(df):
+    """Sort a dataframe on its index, if it is not already sorted"""
+    if df.index.is_monotonic_increasing:
+        return df
+    return df.sort_index(kind="stable")
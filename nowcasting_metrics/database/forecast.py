@@ -4,81 +4,436 @@ import logging
 import os
 import pandas as pd
 from sqlalchemy.orm.session import Session
-from typing import Optional
+from typing import Iterator, Optional
 
-from nowcasting_datamodel.models.gsp import LocationSQL
-from nowcasting_datamodel.models.forecast import ForecastSQL, ForecastValueSevenDaysSQL
+from nowcasting_datamodel.models.gsp import GSPYieldSQL, LocationSQL
+from nowcasting_datamodel.models.forecast import (
+    ForecastSQL,
+    ForecastValueLatestSQL,
+    ForecastValueSevenDaysSQL,
+)
+from nowcasting_datamodel.models.metric import DatetimeInterval
 from nowcasting_datamodel.models.models import MLModelSQL
 from nowcasting_datamodel.read.read_models import get_models
 
+from nowcasting_metrics.database.schema import to_compact_forecast_values
+from nowcasting_metrics.metrics.utils import get_forecast_created_utc_start
+from nowcasting_metrics.profiling import StageProfiler
+
 use_pvnet_gsp_sum = os.getenv("USE_PVNET_GSP_SUM", "False").lower() == "true"
 
-from sqlalchemy import select
+from sqlalchemy import and_, func, select
 
 logger = logging.getLogger(__name__)
 
+# the forecast value columns that can be loaded, as well as target_time.
+# 'properties' is the json of the plevels
+forecast_value_columns = [
+    "expected_power_generation_megawatts",
+    "adjust_mw",
+    "created_utc",
+    "properties",
+]
+
 
-def get_forecast_values(session: Session, model_name: str) -> pd.DataFrame:
+def get_forecast_values(
+    session: Session,
+    model_name: str,
+    expand_plevels: bool = True,
+    plevels: Optional[list[str]] = None,
+    created_utc_start: Optional[datetime] = None,
+    columns: Optional[list[str]] = None,
+    datetime_interval: Optional[DatetimeInterval] = None,
+    max_forecast_horizon_minutes: Optional[int] = None,
+    model=ForecastValueSevenDaysSQL,
+    chunksize: Optional[int] = None,
+) -> pd.DataFrame:
     """
     Get all forecast values for the last seven days for a given model name.
 
     :param session:
     :param model_name:
-    :return:
+    :param expand_plevels: if True, the json 'properties' column is decoded in the database
+        into one float32 column for each plevel, e.g. '10' and '90', and 'properties' is dropped
+    :param plevels: the plevels to expand. If None, the plevels are found from the
+        forecast values 'properties'
+    :param created_utc_start: optional datetime, to only get forecast values made at or after it
+    :param columns: optional columns to load, from 'forecast_value_columns'. Default is all
+    :param datetime_interval: optional datetime interval, to only get these target times
+    :param max_forecast_horizon_minutes: optional maximum forecast horizon of the model, to only
+        get forecast values that can reach the datetime interval
+    :param model: the forecast values table, either ForecastValueSevenDaysSQL or ForecastValueSQL
+        for the full history
+    :param chunksize: optional number of rows to read from the database at once,
+        see 'get_forecast_values_chunks'. Default is all the rows at once
+    :return: forecast values, in the compact schema, see 'nowcasting_metrics.database.schema'
     """
     logger.info(f"Getting forecast values for model {model_name} from the database")
-    logger.debug("getting forecast ids")
-    query = session.query(ForecastSQL.id)
-    query = query.join(MLModelSQL)
-    query = query.join(LocationSQL)
-    query = query.where(LocationSQL.gsp_id == 0)
+
+    if chunksize is not None:
+        forecast_values_df = pd.concat(
+            get_forecast_values_chunks(
+                session=session,
+                model_name=model_name,
+                chunksize=chunksize,
+                expand_plevels=expand_plevels,
+                plevels=plevels,
+                created_utc_start=created_utc_start,
+                columns=columns,
+                datetime_interval=datetime_interval,
+                max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+                model=model,
+            )
+        )
+        logger.debug(
+            f"got forecast values, {model.__tablename__} table, "
+            f"found {len(forecast_values_df)} forecast values"
+        )
+        return forecast_values_df
+
+    query, plevels = make_forecast_values_query(
+        session=session,
+        model_name=model_name,
+        expand_plevels=expand_plevels,
+        plevels=plevels,
+        created_utc_start=created_utc_start,
+        columns=columns,
+        datetime_interval=datetime_interval,
+        max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+        model=model,
+    )
+
+    forecast_values_df = pd.read_sql_query(
+        query, session.bind, index_col="target_time", parse_dates=["target_time", "created_utc"]
+    )
+    logger.debug(
+        f"got forecast values, {model.__tablename__} table, "
+        f"found {len(forecast_values_df)} forecast values"
+    )
+
+    forecast_values_df = to_compact_forecast_values(forecast_values_df, plevels=plevels)
+
+    return forecast_values_df
+
+
+def get_forecast_values_chunks(
+    session: Session,
+    model_name: str,
+    chunksize: int,
+    expand_plevels: bool = True,
+    plevels: Optional[list[str]] = None,
+    created_utc_start: Optional[datetime] = None,
+    columns: Optional[list[str]] = None,
+    datetime_interval: Optional[DatetimeInterval] = None,
+    max_forecast_horizon_minutes: Optional[int] = None,
+    model=ForecastValueSevenDaysSQL,
+) -> Iterator[pd.DataFrame]:
+    """
+    Get the forecast values for a given model name, in chunks of at most 'chunksize' rows
+
+    The rows are streamed from the database with a server side cursor, in the session's
+    transaction, and each chunk is changed to the compact schema before the next is read.
+    So only one chunk of database rows is in memory at once, rather than all of them.
+    The chunks are ordered by target_time and created_utc desc, and a target time can carry
+    on into the next chunk.
+
+    :param session: database session
+    :param model_name: the model name
+    :param chunksize: the number of rows to read from the database at once
+    :param expand_plevels: if True, decode the 'properties' plevels into float32 columns
+    :param plevels: the plevels to expand. If None, the plevels are found from the
+        forecast values 'properties'
+    :param created_utc_start: optional datetime, to only get forecast values made at or after it
+    :param columns: optional columns to load, from 'forecast_value_columns'. Default is all
+    :param datetime_interval: optional datetime interval, to only get these target times
+    :param max_forecast_horizon_minutes: optional maximum forecast horizon of the model, to only
+        get forecast values that can reach the datetime interval
+    :param model: the forecast values table, either ForecastValueSevenDaysSQL or ForecastValueSQL
+        for the full history
+    :return: iterator of forecast values, in the same format as 'get_forecast_values'
+    """
+    query, plevels = make_forecast_values_query(
+        session=session,
+        model_name=model_name,
+        expand_plevels=expand_plevels,
+        plevels=plevels,
+        created_utc_start=created_utc_start,
+        columns=columns,
+        datetime_interval=datetime_interval,
+        max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+        model=model,
+    )
+
+    connection = session.connection(execution_options={"stream_results": True})
+    for chunk in pd.read_sql_query(
+        query,
+        connection,
+        index_col="target_time",
+        parse_dates=["target_time", "created_utc"],
+        chunksize=chunksize,
+    ):
+        logger.debug(f"Got chunk of {len(chunk)} forecast values for model {model_name}")
+        yield to_compact_forecast_values(chunk, plevels=plevels)
+
+
+def make_forecast_values_query(
+    session: Session,
+    model_name: str,
+    expand_plevels: bool = False,
+    plevels: Optional[list[str]] = None,
+    created_utc_start: Optional[datetime] = None,
+    columns: Optional[list[str]] = None,
+    datetime_interval: Optional[DatetimeInterval] = None,
+    max_forecast_horizon_minutes: Optional[int] = None,
+    model=ForecastValueSevenDaysSQL,
+):
+    """
+    Make the query for the forecast values for the last seven days for a given model name
+
+    Only the columns that are needed are selected. In particular the json 'properties' is
+    large to transfer, so should only be selected for the metrics that use the plevels.
+
+    :param session: database session
+    :param model_name: the model name
+    :param expand_plevels: if True, decode the 'properties' plevels into columns
+    :param plevels: the plevels to expand. If None, the plevels are found from the
+        forecast values 'properties'
+    :param created_utc_start: optional datetime, to only get forecast values made at or after it
+    :param columns: optional columns to select, from 'forecast_value_columns'. Default is all.
+        target_time is always selected
+    :param datetime_interval: optional datetime interval, to only get these target times.
+        The start and end are both included
+    :param max_forecast_horizon_minutes: optional maximum forecast horizon of the model. With the
+        datetime interval, this bounds the created_utc, see 'get_forecast_created_utc_start'
+    :param model: the forecast values table, either ForecastValueSevenDaysSQL or ForecastValueSQL
+        for the full history
+    :return: the query, ordered by target_time and created_utc desc, and the plevels
+    """
+    if columns is None:
+        columns = forecast_value_columns
+
+    select_columns = [model.target_time] + [
+        getattr(model, column)
+        for column in forecast_value_columns
+        if column in columns and column != "properties"
+    ]
+    if "properties" not in columns:
+        plevels = []
+    elif expand_plevels:
+        if plevels is None:
+            plevels = get_plevels(
+                session=session,
+                model_name=model_name,
+                created_utc_start=created_utc_start,
+                model=model,
+                datetime_interval=datetime_interval,
+                max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+            )
+
+        # decode each plevel from the json in the database, rather than row by row in python
+        select_columns += [
+            model.properties[plevel].as_float().label(plevel) for plevel in plevels
+        ]
+    else:
+        select_columns.append(model.properties)
+
+    query = select(*select_columns)
+    query = filter_forecast_values_on_model(query=query, model_name=model_name, model=model)
+    query = filter_forecast_values_on_datetimes(
+        query=query,
+        model=model,
+        created_utc_start=created_utc_start,
+        datetime_interval=datetime_interval,
+        max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+    )
+
+    # order by target_time and created_utc desc
+    query = query.order_by(model.target_time, model.created_utc.desc())
+
+    return query, plevels
+
+
+def filter_forecast_values_on_datetimes(
+    query,
+    model=ForecastValueSevenDaysSQL,
+    created_utc_start: Optional[datetime] = None,
+    datetime_interval: Optional[DatetimeInterval] = None,
+    max_forecast_horizon_minutes: Optional[int] = None,
+):
+    """
+    Filter a forecast values query on the created_utc and target_time
+
+    :param query: query on the forecast values table
+    :param model: the forecast values table, either ForecastValueSevenDaysSQL or ForecastValueSQL
+    :param created_utc_start: optional datetime, to only get forecast values made at or after it
+    :param datetime_interval: optional datetime interval, to only get these target times.
+        The start and end are both included
+    :param max_forecast_horizon_minutes: optional maximum forecast horizon of the model. With the
+        datetime interval, this bounds the created_utc, see 'get_forecast_created_utc_start'
+    :return: query
+    """
+    if created_utc_start is not None:
+        query = query.where(model.created_utc >= created_utc_start)
+    if datetime_interval is not None:
+        query = query.where(model.target_time >= datetime_interval.start_datetime_utc)
+        query = query.where(model.target_time <= datetime_interval.end_datetime_utc)
+        if max_forecast_horizon_minutes is not None:
+            forecast_created_utc_start = get_forecast_created_utc_start(
+                datetime_interval=datetime_interval,
+                max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+            )
+            query = query.where(model.created_utc >= forecast_created_utc_start)
+
+    return query
+
+
+def filter_forecast_values_on_model(
+    query, model_name: str, gsp_ids: Optional[list[int]] = None, model=ForecastValueSevenDaysSQL
+):
+    """
+    Filter a forecast values query on the model name, for national forecasts from the last 3 weeks
+
+    This joins to the forecasts in the database, rather than getting the forecast ids first,
+    so the created_utc filter is done in the same query. The full history table,
+    ForecastValueSQL, is not filtered on the last 3 weeks.
+
+    :param query: query on the forecast values table
+    :param model_name: the model name
+    :param gsp_ids: optional gsp ids to get the forecasts for, default is national only
+    :param model: the forecast values table, either ForecastValueSevenDaysSQL or ForecastValueSQL
+    :return: query
+    """
+    query = query.join(ForecastSQL, model.forecast_id == ForecastSQL.id)
+    query = query.join(MLModelSQL, ForecastSQL.model_id == MLModelSQL.id)
+    query = query.join(LocationSQL, ForecastSQL.location_id == LocationSQL.id)
+    if gsp_ids is None:
+        query = query.where(LocationSQL.gsp_id == 0)
+    else:
+        query = query.where(LocationSQL.gsp_id.in_(gsp_ids))
     query = query.where(MLModelSQL.name == model_name)
 
-    # fitler on created uct last 2 weeks
-    start_date = datetime.now() - timedelta(days=21)
-    query = query.where(ForecastSQL.created_utc >= start_date)
+    # fitler on created uct last 3 weeks
+    if model == ForecastValueSevenDaysSQL:
+        start_date = datetime.now() - timedelta(days=21)
+        query = query.where(ForecastSQL.created_utc >= start_date)
 
-    forecasts_ids = query.all()
-    forecasts_ids = [m.id for m in forecasts_ids]
-    logger.debug(f"got {len(forecasts_ids)} forecast ids")
+    return query
+
+
+def get_gsp_forecast_values(
+    session: Session,
+    model_name: str,
+    datetime_interval: DatetimeInterval,
+    n_gsps: int,
+) -> pd.DataFrame:
+    """
+    Get the forecast values for every gsp for a model, in one query
+
+    National is not included, see 'get_forecast_values'. Only the target times in the
+    datetime interval are loaded, as there are many more forecast values for all the gsps
+    than for national.
+
+    :param session: database session
+    :param model_name: the model name
+    :param datetime_interval: datetime interval, the start and end are both included
+    :param n_gsps: the number of gsps, gsp ids 1 to n_gsps are used
+    :return: forecast values with index target_time and columns gsp_id,
+        expected_power_generation_megawatts and created_utc, in the compact schema
+    """
+    logger.info(f"Getting forecast values for model {model_name} for {n_gsps} gsps")
 
     query = select(
         ForecastValueSevenDaysSQL.target_time,
+        LocationSQL.gsp_id,
         ForecastValueSevenDaysSQL.expected_power_generation_megawatts,
-        ForecastValueSevenDaysSQL.adjust_mw,
         ForecastValueSevenDaysSQL.created_utc,
-        ForecastValueSevenDaysSQL.properties,
     )
-
-    # filter forecast is
-    query = query.filter(ForecastValueSevenDaysSQL.forecast_id.in_(forecasts_ids))
-
-    # order by target_time and created_utc desc
+    query = filter_forecast_values_on_model(
+        query=query, model_name=model_name, gsp_ids=list(range(1, n_gsps + 1))
+    )
+    query = query.where(
+        ForecastValueSevenDaysSQL.target_time >= datetime_interval.start_datetime_utc
+    )
+    query = query.where(ForecastValueSevenDaysSQL.target_time <= datetime_interval.end_datetime_utc)
     query = query.order_by(
-        ForecastValueSevenDaysSQL.target_time, ForecastValueSevenDaysSQL.created_utc.desc()
+        LocationSQL.gsp_id,
+        ForecastValueSevenDaysSQL.target_time,
+        ForecastValueSevenDaysSQL.created_utc.desc(),
     )
 
     forecast_values_df = pd.read_sql_query(
         query, session.bind, index_col="target_time", parse_dates=["target_time", "created_utc"]
     )
-    logger.debug(
-        f"got forecast values, last seven day table, found {len(forecast_values_df)} forecast values"
-    )
+    logger.debug(f"got gsp forecast values, found {len(forecast_values_df)} forecast values")
+
+    forecast_values_df = to_compact_forecast_values(forecast_values_df)
 
     return forecast_values_df
 
 
-def get_all_forecast_values(session: Session, forecast_created_utc: Optional[datetime] = None) -> dict:
+def get_plevels(
+    session: Session,
+    model_name: str,
+    created_utc_start: Optional[datetime] = None,
+    model=ForecastValueSevenDaysSQL,
+    datetime_interval: Optional[DatetimeInterval] = None,
+    max_forecast_horizon_minutes: Optional[int] = None,
+) -> list[str]:
     """
-    Get all forecast values for the last seven days for a given model name.
+    Get the plevels in the 'properties' of the forecast values, for a model
+
+    The forecast values are filtered in the same way as 'make_forecast_values_query', so only the
+    forecast values that are loaded have their 'properties' keys scanned.
 
     :param session: database session
-    :param forecast_created_utc: the datetime to filter forecasts by
-    :return: dictionary of dataframes for each model
+    :param model_name: the model name
+    :param created_utc_start: optional datetime, to only look at forecast values made at or
+        after it
+    :param model: the forecast values table, either ForecastValueSevenDaysSQL or ForecastValueSQL
+    :param datetime_interval: optional datetime interval, to only look at these target times
+    :param max_forecast_horizon_minutes: optional maximum forecast horizon of the model, to only
+        look at forecast values that can reach the datetime interval
+    :return: sorted list of plevels, e.g. ['10', '90']
     """
-    logger.info(f"Getting forecast values from the database")
-    logger.debug("getting forecast ids")
+    keys = func.json_object_keys(model.properties)
+
+    query = select(keys).distinct()
+    query = filter_forecast_values_on_model(query=query, model_name=model_name, model=model)
+    query = filter_forecast_values_on_datetimes(
+        query=query,
+        model=model,
+        created_utc_start=created_utc_start,
+        datetime_interval=datetime_interval,
+        max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+    )
+    # 'properties' can be json null, which has no keys
+    query = query.where(func.json_typeof(model.properties) == "object")
+
+    keys = [key for (key,) in session.execute(query).all()]
 
+    # only keep keys that are numbers, these are the plevels
+    plevels = []
+    for key in keys:
+        try:
+            float(key)
+        except ValueError:
+            logger.debug(f"Forecast property {key} is not a plevel, so not expanding it")
+            continue
+        plevels.append(key)
+
+    return sorted(plevels, key=float)
+
+
+def get_forecast_model_names(
+    session: Session, forecast_created_utc: Optional[datetime] = None
+) -> list[str]:
+    """
+    Get the names of the models with forecasts
+
+    :param session: database session
+    :param forecast_created_utc: only use models with forecasts made after this datetime
+    :return: list of model names
+    """
     # this gets all the models used in the last week
     models = get_models(
         session=session,
@@ -90,9 +445,162 @@ def get_all_forecast_values(session: Session, forecast_created_utc: Optional[dat
     if use_pvnet_gsp_sum and "pvnet_gsp_sum" not in models:
         models.append("pvnet_gsp_sum")
 
+    return models
+
+
+def get_all_forecast_values(
+    session: Session,
+    forecast_created_utc: Optional[datetime] = None,
+    expand_plevels: bool = True,
+    profiler: Optional[StageProfiler] = None,
+    model_names: Optional[list[str]] = None,
+    columns: Optional[list[str]] = None,
+    properties_model_names: Optional[list[str]] = None,
+    datetime_interval: Optional[DatetimeInterval] = None,
+    max_forecast_horizon_minutes: Optional[dict] = None,
+    model=ForecastValueSevenDaysSQL,
+    chunksize: Optional[int] = None,
+) -> dict:
+    """
+    Get all forecast values for the last seven days for a given model name.
+
+    :param session: database session
+    :param forecast_created_utc: the datetime to filter forecasts by
+    :param expand_plevels: if True, decode the 'properties' plevels into float32 columns
+    :param profiler: optional profiler, loading each model is profiled as one stage
+    :param model_names: optional model names to load, if None the models with forecasts
+        made after forecast_created_utc are used
+    :param columns: optional columns to load, from 'forecast_value_columns'. Default is all
+    :param properties_model_names: optional model names to load the 'properties' for,
+        if None they are loaded for all models
+    :param datetime_interval: optional datetime interval, to only get these target times
+    :param max_forecast_horizon_minutes: optional maximum forecast horizon for each model,
+        to only get the forecast values that can reach the datetime interval
+    :param model: the forecast values table, either ForecastValueSevenDaysSQL or ForecastValueSQL
+        for the full history
+    :param chunksize: optional number of rows to read from the database at once,
+        see 'get_forecast_values_chunks'
+    :return: dictionary of dataframes for each model
+    """
+    logger.info(f"Getting forecast values from the database")
+
+    if model_names is None:
+        models = get_forecast_model_names(
+            session=session, forecast_created_utc=forecast_created_utc
+        )
+    else:
+        models = list(model_names)
+
+    if profiler is None:
+        profiler = StageProfiler()
+
     # get all forecast values
     forecast_values = {}
-    for model in models:
-        forecast_values[model] = get_forecast_values(session, model)
+    for model_name in models:
+        with profiler.stage("get_forecast_values", model_name=model_name) as stage:
+            forecast_values[model_name] = get_forecast_values(
+                session,
+                model_name,
+                expand_plevels=expand_plevels,
+                columns=get_model_columns(
+                    model_name=model_name,
+                    columns=columns,
+                    properties_model_names=properties_model_names,
+                ),
+                datetime_interval=datetime_interval,
+                max_forecast_horizon_minutes=(max_forecast_horizon_minutes or {}).get(model_name),
+                model=model,
+                chunksize=chunksize,
+            )
+            stage["rows_out"] = len(forecast_values[model_name])
 
     return forecast_values
+
+
+def get_model_columns(
+    model_name: str,
+    columns: Optional[list[str]] = None,
+    properties_model_names: Optional[list[str]] = None,
+) -> list[str]:
+    """
+    Get the forecast value columns to load for a model
+
+    :param model_name: the model name
+    :param columns: optional columns, from 'forecast_value_columns'. Default is all
+    :param properties_model_names: optional model names to load the 'properties' for,
+        if None they are loaded for all models
+    :return: list of columns
+    """
+    if columns is None:
+        columns = forecast_value_columns
+
+    if properties_model_names is not None and model_name not in properties_model_names:
+        columns = [column for column in columns if column != "properties"]
+
+    return list(columns)
+
+
+def get_gsp_errors(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    model_names: list[str],
+    n_gsps: int,
+) -> pd.DataFrame:
+    """
+    Get the errors of the latest forecast for every GSP and model in one query
+
+    The latest forecast values are compared with the PVLive 'day-after' values, and
+    grouped by gsp_id and model name in the database.
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param model_names: the model names to get errors for
+    :param n_gsps: the number of gsps, gsp ids 0 to n_gsps are used
+    :return: dataframe with columns gsp_id, model_name, mae, mae_adjuster, rmse,
+        rmse_adjuster and number_of_data_points. There is one row for each gsp and model
+    """
+    logger.info(f"Getting latest forecast errors for {n_gsps} gsps and models {model_names}")
+
+    forecast = ForecastValueLatestSQL.expected_power_generation_megawatts
+    forecast_adjuster = forecast - ForecastValueLatestSQL.adjust_mw
+    truth = GSPYieldSQL.solar_generation_kw / 1000
+
+    query = select(
+        LocationSQL.gsp_id,
+        MLModelSQL.name.label("model_name"),
+        func.avg(func.abs(forecast - truth)).label("mae"),
+        func.avg(func.abs(forecast_adjuster - truth)).label("mae_adjuster"),
+        func.sqrt(func.avg(func.pow(forecast - truth, 2))).label("rmse"),
+        func.sqrt(func.avg(func.pow(forecast_adjuster - truth, 2))).label("rmse_adjuster"),
+        func.count(forecast).label("number_of_data_points"),
+    )
+    query = query.select_from(ForecastValueLatestSQL)
+    query = query.join(MLModelSQL, ForecastValueLatestSQL.model_id == MLModelSQL.id)
+    query = query.join(GSPYieldSQL, GSPYieldSQL.datetime_utc == ForecastValueLatestSQL.target_time)
+    query = query.join(
+        LocationSQL,
+        and_(
+            GSPYieldSQL.location_id == LocationSQL.id,
+            LocationSQL.gsp_id == ForecastValueLatestSQL.gsp_id,
+        ),
+    )
+
+    # filter on models and gsps
+    query = query.where(MLModelSQL.name.in_(model_names))
+    query = query.where(ForecastValueLatestSQL.gsp_id <= n_gsps)
+
+    # filter on target time
+    query = query.where(ForecastValueLatestSQL.target_time > datetime_interval.start_datetime_utc)
+    query = query.where(ForecastValueLatestSQL.target_time <= datetime_interval.end_datetime_utc)
+
+    # filter on gsp regime
+    query = query.where(GSPYieldSQL.regime == "day-after")
+
+    query = query.group_by(LocationSQL.gsp_id, MLModelSQL.name)
+    query = query.order_by(MLModelSQL.name, LocationSQL.gsp_id)
+
+    gsp_errors_df = pd.read_sql_query(query, session.bind)
+    gsp_errors_df["model_name"] = gsp_errors_df["model_name"].astype("category")
+    logger.debug(f"got latest forecast errors, found {len(gsp_errors_df)} gsp and model pairs")
+
+    return gsp_errors_df
@@ -4,22 +4,35 @@ import logging
 import pandas as pd
 
 from nowcasting_datamodel.models.gsp import LocationSQL, GSPYieldSQL
+from nowcasting_datamodel.models.metric import DatetimeInterval
 from typing import Optional
 
-from sqlalchemy import select
+from sqlalchemy import case, func, select
+
+from nowcasting_metrics.database.schema import to_compact_gsp_yields, to_compact_timestamps
 
 logger = logging.getLogger(__name__)
 
 
-def get_gsp_yield(session, gsp_id: int, start_datetime: Optional[datetime] = None) -> pd.DataFrame:
+def get_gsp_yield(
+    session,
+    gsp_id: int,
+    start_datetime: Optional[datetime] = None,
+    created_utc_start: Optional[datetime] = None,
+    include_created_utc: bool = False,
+    end_datetime: Optional[datetime] = None,
+) -> pd.DataFrame:
     """
     Get all forecast values for the last seven days for a given model name.
 
     :param session: database session
     :param gsp_id: the gsp id
     :param start_datetime: optional start datetime to filter the yields from
-    :return: gsp_yield_df: dataframe of gsp yields with columns
-        datetime_utc and solar_generation_kw
+    :param created_utc_start: optional datetime, to only get yields made at or after it
+    :param include_created_utc: if True, also return the created_utc of each yield
+    :param end_datetime: optional end datetime to filter the yields to, this is included
+    :return: gsp_yield_df: dataframe of gsp yields with index datetime_utc and column
+        solar_generation_kw, in the compact schema, see 'nowcasting_metrics.database.schema'
     """
     logger.info(f"Getting gsp yields for model {gsp_id} from the database")
 
@@ -33,7 +46,10 @@ def get_gsp_yield(session, gsp_id: int, start_datetime: Optional[datetime] = Non
     locations_ids = query.all()
     locations_ids = [m.id for m in locations_ids]
     logger.debug("got location ids")
-    query = select(GSPYieldSQL.datetime_utc, GSPYieldSQL.solar_generation_kw)
+    columns = [GSPYieldSQL.datetime_utc, GSPYieldSQL.solar_generation_kw]
+    if include_created_utc:
+        columns.append(GSPYieldSQL.created_utc)
+    query = select(*columns)
 
     # distinct on datetime_utc
     query = query.distinct(GSPYieldSQL.datetime_utc)
@@ -41,7 +57,11 @@ def get_gsp_yield(session, gsp_id: int, start_datetime: Optional[datetime] = Non
     # filter forecast is
     query = query.filter(GSPYieldSQL.location_id.in_(locations_ids))
     query = query.filter(GSPYieldSQL.datetime_utc >= start_datetime)
+    if end_datetime is not None:
+        query = query.filter(GSPYieldSQL.datetime_utc <= end_datetime)
     query = query.filter(GSPYieldSQL.regime == "day-after")
+    if created_utc_start is not None:
+        query = query.filter(GSPYieldSQL.created_utc >= created_utc_start)
 
     # order by datetime_utc and created_utc desc
     query = query.order_by(GSPYieldSQL.datetime_utc, GSPYieldSQL.created_utc.desc())
@@ -49,9 +69,158 @@ def get_gsp_yield(session, gsp_id: int, start_datetime: Optional[datetime] = Non
     gsp_yield_df = pd.read_sql_query(
         query, session.bind, index_col="datetime_utc", parse_dates=["datetime_utc"]
     )
+    if include_created_utc:
+        gsp_yield_df["created_utc"] = to_compact_timestamps(gsp_yield_df["created_utc"])
     logger.debug(f"got gsp yields, last seven day table, found {len(gsp_yield_df)}.")
 
     # add tz info to datetime_utc
-    gsp_yield_df.index = gsp_yield_df.index.tz_localize("UTC")
+    gsp_yield_df = to_compact_gsp_yields(gsp_yield_df)
 
     return gsp_yield_df
+
+
+def get_all_gsp_yields(
+    session, datetime_interval: DatetimeInterval, n_gsps: int
+) -> pd.DataFrame:
+    """
+    Get the in-day and day-after yields for all gsps, with one column for each regime, in one query
+
+    For each gsp, datetime and regime, only the latest yield (by created_utc) is used. This is done
+    in a sub query, and then the regimes are pivoted into columns in the database.
+
+    :param session: database session
+    :param datetime_interval: datetime interval, the start and end are both included
+    :param n_gsps: the number of gsps, gsp ids 0 to n_gsps are used
+    :return: dataframe with index (datetime_utc, gsp_id) and columns in_day and day_after,
+        in the compact schema. in_day and day_after are the solar generation in kw,
+        and are nan if that regime is missing
+    """
+    logger.info(f"Getting in-day and day-after yields for {n_gsps} gsps from the database")
+
+    latest_yields = select(
+        LocationSQL.gsp_id,
+        GSPYieldSQL.datetime_utc,
+        GSPYieldSQL.regime,
+        GSPYieldSQL.solar_generation_kw,
+    )
+    latest_yields = latest_yields.join(LocationSQL, GSPYieldSQL.location_id == LocationSQL.id)
+
+    # distinct on gsp, regime and datetime_utc
+    latest_yields = latest_yields.distinct(
+        LocationSQL.gsp_id, GSPYieldSQL.regime, GSPYieldSQL.datetime_utc
+    )
+
+    latest_yields = latest_yields.where(LocationSQL.gsp_id <= n_gsps)
+    latest_yields = latest_yields.where(
+        GSPYieldSQL.datetime_utc >= datetime_interval.start_datetime_utc
+    )
+    latest_yields = latest_yields.where(
+        GSPYieldSQL.datetime_utc <= datetime_interval.end_datetime_utc
+    )
+    latest_yields = latest_yields.where(GSPYieldSQL.regime.in_(["in-day", "day-after"]))
+
+    # order by created_utc desc, so we get the latest yield
+    latest_yields = latest_yields.order_by(
+        LocationSQL.gsp_id,
+        GSPYieldSQL.regime,
+        GSPYieldSQL.datetime_utc,
+        GSPYieldSQL.created_utc.desc(),
+    )
+    latest_yields = latest_yields.subquery()
+
+    # one column for each regime
+    query = select(
+        latest_yields.c.datetime_utc,
+        latest_yields.c.gsp_id,
+        func.max(
+            case((latest_yields.c.regime == "in-day", latest_yields.c.solar_generation_kw))
+        ).label("in_day"),
+        func.max(
+            case((latest_yields.c.regime == "day-after", latest_yields.c.solar_generation_kw))
+        ).label("day_after"),
+    )
+    query = query.group_by(latest_yields.c.datetime_utc, latest_yields.c.gsp_id)
+    query = query.order_by(latest_yields.c.datetime_utc, latest_yields.c.gsp_id)
+
+    gsp_yield_df = pd.read_sql_query(query, session.bind, parse_dates=["datetime_utc"])
+    logger.debug(f"got in-day and day-after yields, found {len(gsp_yield_df)}.")
+
+    gsp_yield_df = to_compact_gsp_yields(gsp_yield_df)
+
+    return gsp_yield_df.set_index(["datetime_utc", "gsp_id"])
+
+
+def select_pvlive_yields(
+    all_gsp_yields: pd.DataFrame, datetime_interval: DatetimeInterval
+) -> pd.DataFrame:
+    """
+    Select the PVLive yields, the gsps and datetimes where both regimes are available
+
+    :param all_gsp_yields: yields for all gsps, from 'get_all_gsp_yields'
+    :param datetime_interval: datetime interval, the end is not included
+    :return: dataframe with columns gsp_id, datetime_utc, in_day and day_after,
+        ordered by gsp_id and datetime_utc
+    """
+    end_datetime_utc = pd.Timestamp(datetime_interval.end_datetime_utc)
+    if end_datetime_utc.tzinfo is None:
+        end_datetime_utc = end_datetime_utc.tz_localize("UTC")
+
+    pvlive_yields = all_gsp_yields.dropna(how="any").reset_index()
+    pvlive_yields = pvlive_yields[pvlive_yields.datetime_utc < end_datetime_utc]
+    pvlive_yields = pvlive_yields.sort_values(["gsp_id", "datetime_utc"], kind="stable")
+
+    return pvlive_yields[["gsp_id", "datetime_utc", "in_day", "day_after"]].reset_index(drop=True)
+
+
+def select_day_after_gsp_yields(all_gsp_yields: pd.DataFrame) -> pd.DataFrame:
+    """
+    Select the day-after yields of the gsps, not national
+
+    :param all_gsp_yields: yields for all gsps, from 'get_all_gsp_yields'
+    :return: dataframe with columns gsp_id, datetime_utc and solar_generation_kw,
+        ordered by gsp_id and datetime_utc
+    """
+    gsp_yields = all_gsp_yields[["day_after"]].dropna().reset_index()
+    gsp_yields = gsp_yields[gsp_yields.gsp_id != 0]
+    gsp_yields = gsp_yields.sort_values(["gsp_id", "datetime_utc"], kind="stable")
+    gsp_yields = gsp_yields.rename(columns={"day_after": "solar_generation_kw"})
+
+    return gsp_yields[["gsp_id", "datetime_utc", "solar_generation_kw"]].reset_index(drop=True)
+
+
+def get_pvlive_yields(session, datetime_interval: DatetimeInterval, n_gsps: int) -> pd.DataFrame:
+    """
+    Get the PVLive in-day and day-after yields for all gsps in one query
+
+    For each gsp, datetime and regime, only the latest yield (by created_utc) is used.
+
+    :param session: database session
+    :param datetime_interval: datetime interval to get the yields for
+    :param n_gsps: the number of gsps, gsp ids 0 to n_gsps are used
+    :return: dataframe with columns gsp_id, datetime_utc, in_day and day_after.
+        in_day and day_after are the solar generation in kw. There is one row for each
+        gsp and datetime where both regimes are available
+    """
+    all_gsp_yields = get_all_gsp_yields(
+        session=session, datetime_interval=datetime_interval, n_gsps=n_gsps
+    )
+    return select_pvlive_yields(all_gsp_yields, datetime_interval=datetime_interval)
+
+
+def get_gsp_yields(session, datetime_interval: DatetimeInterval, n_gsps: int) -> pd.DataFrame:
+    """
+    Get the PVLive day-after yields for all gsps in one query
+
+    For each gsp and datetime, only the latest yield (by created_utc) is used.
+    National is not included, see 'get_gsp_yield'.
+
+    :param session: database session
+    :param datetime_interval: datetime interval, the start and end are both included
+    :param n_gsps: the number of gsps, gsp ids 1 to n_gsps are used
+    :return: dataframe with columns gsp_id, datetime_utc and solar_generation_kw,
+        in the compact schema
+    """
+    all_gsp_yields = get_all_gsp_yields(
+        session=session, datetime_interval=datetime_interval, n_gsps=n_gsps
+    )
+    return select_day_after_gsp_yields(all_gsp_yields)
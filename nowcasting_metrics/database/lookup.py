@@ -0,0 +1,188 @@
+""" Cached lookups of metrics, models, locations and datetime intervals
+
+The metrics look up the same few rows many times in one run, for example the national location
+for every forecast horizon. These functions have the same arguments as the
+'nowcasting_datamodel.read' functions, but each row is only looked up once for each session.
+
+The cache is kept in 'session.info', so each session (and each worker thread) has its own.
+It is cleared when the session is rolled back, as rows made in the transaction are then gone.
+"""
+import logging
+from datetime import datetime
+
+from nowcasting_datamodel.models.gsp import LocationSQL
+from nowcasting_datamodel.models.metric import DatetimeIntervalSQL, MetricSQL
+from nowcasting_datamodel.models.models import MLModelSQL
+from nowcasting_datamodel.read import read, read_metric, read_models
+from sqlalchemy import event
+from sqlalchemy.orm.session import Session
+
+logger = logging.getLogger(__name__)
+
+lookup_cache_key = "nowcasting_metrics_lookup_cache"
+
+
+def get_lookup_cache(session: Session) -> dict:
+    """
+    Get the lookup cache of a session, making it if needed
+
+    :param session: database session
+    :return: dictionary of {(kind, key): orm object}
+    """
+    lookup_cache = session.info.get(lookup_cache_key)
+    if lookup_cache is None:
+        lookup_cache = {}
+        session.info[lookup_cache_key] = lookup_cache
+        event.listen(session, "after_soft_rollback", clear_lookup_cache_after_rollback)
+
+    return lookup_cache
+
+
+def clear_lookup_cache(session: Session):
+    """
+    Clear the lookup cache of a session
+
+    :param session: database session
+    """
+    lookup_cache = session.info.get(lookup_cache_key)
+    if lookup_cache is not None:
+        logger.debug(f"Clearing {len(lookup_cache)} cached lookups")
+        lookup_cache.clear()
+
+
+def clear_lookup_cache_after_rollback(session: Session, previous_transaction):
+    """Session event, to clear the lookup cache when the session is rolled back"""
+    clear_lookup_cache(session)
+
+
+def add_to_lookup_cache(session: Session, orm_object):
+    """
+    Add a location, metric, model or datetime interval object to the lookup cache
+
+    This can be used to give the lookups objects that are not from the database
+
+    :param session: database session
+    :param orm_object: LocationSQL, MetricSQL, MLModelSQL or DatetimeIntervalSQL object
+    """
+    if isinstance(orm_object, LocationSQL):
+        key = ("location", int(orm_object.gsp_id))
+    elif isinstance(orm_object, MetricSQL):
+        key = ("metric", orm_object.name)
+    elif isinstance(orm_object, MLModelSQL):
+        key = ("model", orm_object.name)
+    elif isinstance(orm_object, DatetimeIntervalSQL):
+        key = ("datetime_interval", orm_object.start_datetime_utc, orm_object.end_datetime_utc)
+    else:
+        raise ValueError(f"Can not add {type(orm_object)} to the lookup cache")
+
+    get_lookup_cache(session)[key] = orm_object
+
+
+def get_object_id(session: Session, orm_object) -> int:
+    """
+    Get the id of a location, metric, model or datetime interval object
+
+    The lookups in this module always give objects that are in the database. An object that is
+    not, e.g. a MetricSQL made by hand, is added to the session and flushed, so it gets an id.
+
+    :param session: database session
+    :param orm_object: LocationSQL, MetricSQL, MLModelSQL or DatetimeIntervalSQL object
+    :return: the id of the object
+    """
+    if orm_object.id is None:
+        logger.debug(f"Adding {type(orm_object).__name__} to the database to get its id")
+        session.add(orm_object)
+        session.flush()
+    return orm_object.id
+
+
+def get_location(session: Session, gsp_id: int) -> LocationSQL:
+    """
+    Get the location object of a gsp, see 'nowcasting_datamodel.read.read.get_location'
+
+    :param session: database session
+    :param gsp_id: the gsp id
+    :return: location object
+    """
+    lookup_cache = get_lookup_cache(session)
+    key = ("location", int(gsp_id))
+    if key not in lookup_cache:
+        lookup_cache[key] = read.get_location(session=session, gsp_id=int(gsp_id))
+    return lookup_cache[key]
+
+
+def get_locations(session: Session, gsp_ids: list[int]) -> dict:
+    """
+    Get the location objects for several gsp ids, the ones not in the cache are got in one query
+
+    Gsp ids without a location in the database are made, the same as 'get_location'.
+
+    :param session: database session
+    :param gsp_ids: the gsp ids
+    :return: dictionary of {gsp_id: location}
+    """
+    lookup_cache = get_lookup_cache(session)
+    gsp_ids = [int(gsp_id) for gsp_id in gsp_ids]
+
+    missing_gsp_ids = [gsp_id for gsp_id in gsp_ids if ("location", gsp_id) not in lookup_cache]
+    if len(missing_gsp_ids) > 0:
+        query = session.query(LocationSQL)
+        query = query.filter(LocationSQL.gsp_id.in_(missing_gsp_ids))
+        for location in query.all():
+            lookup_cache.setdefault(("location", location.gsp_id), location)
+
+    return {gsp_id: get_location(session=session, gsp_id=gsp_id) for gsp_id in gsp_ids}
+
+
+def get_metric(session: Session, name: str) -> MetricSQL:
+    """
+    Get the metric object, see 'nowcasting_datamodel.read.read_metric.get_metric'
+
+    :param session: database session
+    :param name: the name of the metric
+    :return: metric object
+    """
+    lookup_cache = get_lookup_cache(session)
+    key = ("metric", name)
+    if key not in lookup_cache:
+        lookup_cache[key] = read_metric.get_metric(session=session, name=name)
+    return lookup_cache[key]
+
+
+def get_model(session: Session, name: str) -> MLModelSQL:
+    """
+    Get the latest model object for a name, see 'nowcasting_datamodel.read.read_models.get_model'
+
+    :param session: database session
+    :param name: the name of the model
+    :return: model object
+    """
+    lookup_cache = get_lookup_cache(session)
+    key = ("model", name)
+    if key not in lookup_cache:
+        lookup_cache[key] = read_models.get_model(session=session, name=name)
+    return lookup_cache[key]
+
+
+def get_datetime_interval(
+    session: Session, start_datetime_utc: datetime, end_datetime_utc: datetime
+) -> DatetimeIntervalSQL:
+    """
+    Get the datetime interval object
+
+    See 'nowcasting_datamodel.read.read_metric.get_datetime_interval'.
+
+    :param session: database session
+    :param start_datetime_utc: the start of the interval
+    :param end_datetime_utc: the end of the interval
+    :return: datetime interval object
+    """
+    lookup_cache = get_lookup_cache(session)
+    key = ("datetime_interval", start_datetime_utc, end_datetime_utc)
+    if key not in lookup_cache:
+        lookup_cache[key] = read_metric.get_datetime_interval(
+            session=session,
+            start_datetime_utc=start_datetime_utc,
+            end_datetime_utc=end_datetime_utc,
+        )
+    return lookup_cache[key]
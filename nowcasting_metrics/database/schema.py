@@ -0,0 +1,82 @@
+""" Compact in-memory schema for the data loaded from the database
+
+The forecast values and gsp yields are copied several times inside each metric, so the loaders
+return them with small dtypes
+- power values are float32
+- timestamps are datetime64[ns, UTC]
+- model names are categorical
+- gsp ids are int16
+- forecast plevels are float32 columns, e.g '10' and '90', rather than json dicts
+"""
+from typing import Optional
+
+import pandas as pd
+
+power_dtype = "float32"
+timestamp_dtype = "datetime64[ns, UTC]"
+gsp_id_dtype = "int16"
+
+forecast_values_power_columns = ["expected_power_generation_megawatts", "adjust_mw"]
+gsp_yields_power_columns = ["solar_generation_kw", "in_day", "day_after"]
+
+
+def to_compact_timestamps(timestamps):
+    """
+    Change timestamps to datetime64[ns, UTC]
+
+    :param timestamps: series or index of timestamps, with or without a timezone
+    :return: series or index of timestamps
+    """
+    timestamps = pd.to_datetime(timestamps)
+    if getattr(timestamps, "dt", None) is not None:
+        if timestamps.dt.tz is None:
+            timestamps = timestamps.dt.tz_localize("UTC")
+    elif timestamps.tz is None:
+        timestamps = timestamps.tz_localize("UTC")
+
+    return timestamps.astype(timestamp_dtype)
+
+
+def to_compact_forecast_values(
+    forecast_values: pd.DataFrame, plevels: Optional[list[str]] = None
+) -> pd.DataFrame:
+    """
+    Change forecast values to the compact schema
+
+    :param forecast_values: forecast values with index target_time
+    :param plevels: the plevel columns
+    :return: forecast values
+    """
+    if plevels is None:
+        plevels = []
+
+    columns = [c for c in forecast_values_power_columns + plevels if c in forecast_values.columns]
+    forecast_values = forecast_values.astype({column: power_dtype for column in columns})
+
+    forecast_values.index = to_compact_timestamps(forecast_values.index)
+    if "created_utc" in forecast_values.columns:
+        forecast_values["created_utc"] = to_compact_timestamps(forecast_values["created_utc"])
+    if "model_name" in forecast_values.columns:
+        forecast_values["model_name"] = forecast_values["model_name"].astype("category")
+
+    return forecast_values
+
+
+def to_compact_gsp_yields(gsp_yields: pd.DataFrame) -> pd.DataFrame:
+    """
+    Change gsp yields to the compact schema
+
+    :param gsp_yields: gsp yields, either with index datetime_utc or a datetime_utc column
+    :return: gsp yields
+    """
+    columns = [c for c in gsp_yields_power_columns if c in gsp_yields.columns]
+    gsp_yields = gsp_yields.astype({column: power_dtype for column in columns})
+    if "gsp_id" in gsp_yields.columns:
+        gsp_yields["gsp_id"] = gsp_yields["gsp_id"].astype(gsp_id_dtype)
+
+    if "datetime_utc" in gsp_yields.columns:
+        gsp_yields["datetime_utc"] = to_compact_timestamps(gsp_yields["datetime_utc"])
+    else:
+        gsp_yields.index = to_compact_timestamps(gsp_yields.index)
+
+    return gsp_yields
@@ -0,0 +1,172 @@
+""" Backfill daily metrics for a range of days
+
+The forecast values, gsp yields and PVLive yields are loaded once for the whole range, and the
+latest forecast for each target time and forecast horizon is found once for each model. Each day
+is then a slice of these, rather than loading the data from the database for each day.
+
+For each day the following metrics are made
+1. MAE and RMSE for the national forecast, for each model and forecast horizon
+2. MAE and RMSE for the PVLive initial and updated estimates, for each gsp
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import pandas as pd
+from nowcasting_datamodel.models.metric import DatetimeInterval
+from sqlalchemy.orm.session import Session
+
+from nowcasting_metrics.metrics.mae import (
+    make_mae_values_for_forecast_horizons,
+    make_pvlive_mae_gsps,
+)
+from nowcasting_metrics.metrics.rmse import (
+    make_pvlive_rmse_gsps,
+    make_rmse_values_for_forecast_horizons,
+)
+from nowcasting_metrics.metrics.utils import (
+    default_max_forecast_horizon_minutes,
+    get_all_aligned_forecast_values,
+    get_forecast_range,
+    slice_on_datetime_interval,
+)
+from nowcasting_metrics.utils import MetricValueWriter
+
+logger = logging.getLogger(__name__)
+
+
+def get_daily_datetime_intervals(
+    start_datetime: datetime, end_datetime: datetime
+) -> list[DatetimeInterval]:
+    """
+    Get one datetime interval for each day from the start to the end
+
+    :param start_datetime: the start, this is rounded down to the start of the day
+    :param end_datetime: the end, this is not included
+    :return: list of datetime intervals, each one day long
+    """
+    start_datetime = datetime.combine(start_datetime.date(), datetime.min.time())
+
+    datetime_intervals = []
+    while start_datetime < end_datetime:
+        datetime_intervals.append(
+            DatetimeInterval(
+                start_datetime_utc=start_datetime,
+                end_datetime_utc=start_datetime + timedelta(days=1),
+            )
+        )
+        start_datetime = start_datetime + timedelta(days=1)
+
+    return datetime_intervals
+
+
+def make_backfill_metrics(
+    session: Session,
+    start_datetime: datetime,
+    end_datetime: datetime,
+    all_forecast_values: dict,
+    gsp_yields: pd.DataFrame,
+    pvlive_yields: pd.DataFrame,
+    metric_value_writer: MetricValueWriter,
+    max_forecast_horizon_minutes: Optional[dict] = None,
+) -> list[DatetimeInterval]:
+    """
+    Make the daily metrics for each day from the start to the end
+
+    :param session: database session
+    :param start_datetime: the start of the first day
+    :param end_datetime: the end of the range, this is not included
+    :param all_forecast_values: all forecast values for the range, {model_name: forecast_values}
+    :param gsp_yields: the national gsp yields for the range
+    :param pvlive_yields: the PVLive yields for all gsps for the range, from 'get_pvlive_yields'
+    :param metric_value_writer: writer to collect the metric values in, so all the days
+        are saved in one bulk insert
+    :param max_forecast_horizon_minutes: the maximum forecast horizon for each model
+    :return: the datetime intervals of the days
+    """
+    if max_forecast_horizon_minutes is None:
+        max_forecast_horizon_minutes = default_max_forecast_horizon_minutes
+
+    datetime_intervals = get_daily_datetime_intervals(
+        start_datetime=start_datetime, end_datetime=end_datetime
+    )
+    if len(datetime_intervals) == 0:
+        logger.warning(f"No days to backfill from {start_datetime} to {end_datetime}")
+        return datetime_intervals
+
+    logger.info(f"Backfilling metrics for {len(datetime_intervals)} days")
+
+    # the latest forecast for each target time and forecast horizon, for the whole range
+    forecast_horizons_minutes = {
+        model_name: [None] + get_forecast_range(max_forecast_horizon_minutes.get(model_name, 480))
+        for model_name in all_forecast_values
+    }
+    all_aligned_forecast_values = get_all_aligned_forecast_values(
+        datetime_interval=DatetimeInterval(
+            start_datetime_utc=datetime_intervals[0].start_datetime_utc,
+            end_datetime_utc=datetime_intervals[-1].end_datetime_utc,
+        ),
+        all_forecast_values=all_forecast_values,
+        gsp_yields=gsp_yields,
+        forecast_horizons_minutes=forecast_horizons_minutes,
+    )
+    all_aligned_forecast_values = {
+        model_name: aligned_forecast_values.sort_index(kind="stable")
+        for model_name, aligned_forecast_values in all_aligned_forecast_values.items()
+    }
+
+    # the PVLive yields for each day
+    pvlive_days = pvlive_yields.datetime_utc.dt.floor("D")
+    pvlive_yields_per_day = dict(list(pvlive_yields.groupby(pvlive_days)))
+
+    for datetime_interval in datetime_intervals:
+        logger.debug(f"Backfilling metrics for {datetime_interval.start_datetime_utc}")
+
+        # 1. national forecast for each model
+        for model_name, aligned_forecast_values in all_aligned_forecast_values.items():
+            aligned_forecast_values = slice_on_datetime_interval(
+                df=aligned_forecast_values, datetime_interval=datetime_interval
+            )
+            if len(aligned_forecast_values) == 0:
+                continue
+
+            make_mae_values_for_forecast_horizons(
+                session=session,
+                datetime_interval=datetime_interval,
+                forecast_values=all_forecast_values[model_name],
+                gsp_yields=gsp_yields,
+                forecast_horizons_minutes=forecast_horizons_minutes[model_name],
+                model_name=model_name,
+                metric_value_writer=metric_value_writer,
+                aligned_forecast_values=aligned_forecast_values,
+            )
+            make_rmse_values_for_forecast_horizons(
+                session=session,
+                datetime_interval=datetime_interval,
+                forecast_values=all_forecast_values[model_name],
+                gsp_yields=gsp_yields,
+                forecast_horizons_minutes=forecast_horizons_minutes[model_name],
+                model_name=model_name,
+                metric_value_writer=metric_value_writer,
+                aligned_forecast_values=aligned_forecast_values,
+            )
+
+        # 2. PVLive for each gsp
+        pvlive_yields_day = pvlive_yields_per_day.get(
+            pd.Timestamp(datetime_interval.start_datetime_utc.replace(tzinfo=timezone.utc))
+        )
+        if pvlive_yields_day is not None:
+            make_pvlive_mae_gsps(
+                session=session,
+                datetime_interval=datetime_interval,
+                pvlive_yields=pvlive_yields_day,
+                metric_value_writer=metric_value_writer,
+            )
+            make_pvlive_rmse_gsps(
+                session=session,
+                datetime_interval=datetime_interval,
+                pvlive_yields=pvlive_yields_day,
+                metric_value_writer=metric_value_writer,
+            )
+
+    return datetime_intervals
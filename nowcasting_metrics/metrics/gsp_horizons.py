@@ -0,0 +1,324 @@
+""" Horizon resolved metrics for each gsp
+
+The national metrics find the latest forecast for each target time and forecast horizon with an
+as-of merge, see 'get_latest_forecast_values_for_forecast_horizons'. For ~317 gsps this makes a
+long dataframe with one row for each gsp, target time and forecast horizon.
+
+Here the forecasts are kept in a dense float32 array of shape (gsp, target_time, forecast_horizon)
+instead, which can optionally be memory mapped from a file. The array is filled in one pass
+1. the lead time (target_time - created_utc) of each forecast value is put into a forecast horizon
+slot, the largest forecast horizon below the lead time
+2. in each slot only the latest forecast value (smallest lead time) is kept
+3. each forecast horizon then uses the first filled slot at or above it,
+by filling backwards along the forecast horizon axis
+
+The MAE and ME for each gsp and forecast horizon then come from one reduction over the
+target time axis.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import timezone
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from nowcasting_datamodel.models.metric import DatetimeInterval
+from sqlalchemy.orm.session import Session
+
+from nowcasting_metrics.database.lookup import get_locations
+from nowcasting_metrics.metrics.mae import latest_mae
+from nowcasting_metrics.metrics.utils import (
+    default_max_forecast_horizon_minutes,
+    get_forecast_range,
+)
+from nowcasting_metrics.utils import MetricValueWriter, save_metric_value_to_database
+
+logger = logging.getLogger(__name__)
+
+target_time_freq = pd.Timedelta(minutes=30)
+
+
+@dataclass
+class GSPForecastArray:
+    """
+    Dense forecasts and truth for all gsps
+
+    forecast: float32 array (gsp, target_time, forecast_horizon) in MW, nan if there is no forecast
+    truth: float32 array (gsp, target_time) in MW, nan if there is no yield
+    """
+
+    forecast: np.ndarray
+    truth: np.ndarray
+    gsp_ids: np.ndarray
+    target_times: pd.DatetimeIndex
+    forecast_horizons_minutes: np.ndarray
+
+
+def get_target_times(datetime_interval: DatetimeInterval) -> pd.DatetimeIndex:
+    """
+    Get the half hourly target times of a datetime interval, the start and end are both included
+
+    :param datetime_interval: datetime interval
+    :return: target times in UTC
+    """
+    return pd.date_range(
+        datetime_interval.start_datetime_utc.replace(tzinfo=timezone.utc),
+        datetime_interval.end_datetime_utc.replace(tzinfo=timezone.utc),
+        freq=target_time_freq,
+    ).astype("datetime64[ns, UTC]")
+
+
+def get_target_time_index(
+    timestamps: pd.Series, target_times: pd.DatetimeIndex
+) -> np.ndarray:
+    """
+    Get the position of each timestamp in the target times, -1 if it is not a target time
+
+    :param timestamps: timestamps in UTC
+    :param target_times: half hourly target times, from 'get_target_times'
+    :return: int64 array
+    """
+    offset = (pd.DatetimeIndex(timestamps) - target_times[0]) / target_time_freq
+    offset = np.asarray(offset, dtype="float64")
+
+    valid = (offset >= 0) & (offset < len(target_times)) & (offset == np.floor(offset))
+    return np.where(valid, offset, -1).astype("int64")
+
+
+def make_gsp_forecast_array(
+    gsp_forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    datetime_interval: DatetimeInterval,
+    forecast_horizons_minutes: list[int],
+    gsp_ids: list[int],
+    filename: Optional[str] = None,
+) -> GSPForecastArray:
+    """
+    Make the dense forecast and truth arrays for all gsps
+
+    A forecast value is used for a forecast horizon if it was made more than
+    forecast_horizon_minutes before the target time, the same as
+    'get_latest_forecast_values_for_forecast_horizons'.
+
+    :param gsp_forecast_values: forecast values with index target_time and columns gsp_id,
+        expected_power_generation_megawatts and created_utc, from 'get_gsp_forecast_values'
+    :param gsp_yields: yields with columns gsp_id, datetime_utc and solar_generation_kw,
+        from 'get_gsp_yields'
+    :param datetime_interval: datetime interval, the start and end are both included
+    :param forecast_horizons_minutes: the forecast horizons
+    :param gsp_ids: the gsp ids
+    :param filename: optional .npy file to memory map the forecast array to
+    :return: the dense arrays
+    """
+    gsp_ids = np.sort(np.asarray(gsp_ids, dtype="int64"))
+    target_times = get_target_times(datetime_interval)
+    forecast_horizons_minutes = np.sort(np.asarray(forecast_horizons_minutes, dtype="int64"))
+    shape = (len(gsp_ids), len(target_times), len(forecast_horizons_minutes))
+
+    logger.debug(
+        f"Making gsp forecast array of shape {shape} from {len(gsp_forecast_values)} values"
+    )
+
+    if filename is None:
+        forecast = np.full(shape, np.nan, dtype="float32")
+    else:
+        forecast = np.lib.format.open_memmap(filename, mode="w+", dtype="float32", shape=shape)
+        forecast[:] = np.nan
+
+    # 1. the position of each forecast value in the array
+    g = np.searchsorted(gsp_ids, gsp_forecast_values.gsp_id.to_numpy(dtype="int64"))
+    g_valid = g < len(gsp_ids)
+    g_valid[g_valid] = gsp_ids[g[g_valid]] == gsp_forecast_values.gsp_id.to_numpy()[g_valid]
+
+    t = get_target_time_index(gsp_forecast_values.index, target_times)
+
+    lead_time_minutes = np.asarray(
+        (gsp_forecast_values.index - pd.DatetimeIndex(gsp_forecast_values.created_utc))
+        / pd.Timedelta(minutes=1),
+        dtype="float64",
+    )
+    # the number of forecast horizons strictly below the lead time, the slot is the last of these
+    k = np.searchsorted(forecast_horizons_minutes, lead_time_minutes, side="left")
+
+    valid = g_valid & (t >= 0) & (k > 0)
+    values = gsp_forecast_values.expected_power_generation_megawatts.to_numpy(dtype="float32")
+    key = (g[valid] * shape[1] + t[valid]) * shape[2] + (k[valid] - 1)
+    lead_time_minutes = lead_time_minutes[valid]
+    values = values[valid]
+
+    # 2. the latest forecast value in each slot
+    order = np.lexsort((lead_time_minutes, key))
+    key, first = np.unique(key[order], return_index=True)
+    forecast.reshape(-1)[key] = values[order][first]
+
+    # 3. each forecast horizon uses the first filled slot at or above it
+    for j in range(shape[2] - 2, -1, -1):
+        missing = np.isnan(forecast[:, :, j])
+        forecast[:, :, j][missing] = forecast[:, :, j + 1][missing]
+
+    if filename is not None:
+        forecast.flush()
+
+    # the truth
+    truth = np.full(shape[:2], np.nan, dtype="float32")
+    g = np.searchsorted(gsp_ids, gsp_yields.gsp_id.to_numpy(dtype="int64"))
+    t = get_target_time_index(gsp_yields.datetime_utc, target_times)
+    valid = (g < len(gsp_ids)) & (t >= 0)
+    valid[valid] = gsp_ids[g[valid]] == gsp_yields.gsp_id.to_numpy()[valid]
+    solar_generation_mw = gsp_yields.solar_generation_kw.to_numpy(dtype="float64") / 1000
+    truth[g[valid], t[valid]] = solar_generation_mw[valid]
+
+    return GSPForecastArray(
+        forecast=forecast,
+        truth=truth,
+        gsp_ids=gsp_ids,
+        target_times=target_times,
+        forecast_horizons_minutes=forecast_horizons_minutes,
+    )
+
+
+def get_gsp_horizon_errors(
+    gsp_forecast_array: GSPForecastArray, gsp_chunk_size: int = 32
+) -> pd.DataFrame:
+    """
+    Get the MAE and ME for each gsp and forecast horizon
+
+    The reduction is done over the target time axis, for a chunk of gsps at a time, so a memory
+    mapped forecast array is not loaded all at once.
+
+    :param gsp_forecast_array: the dense arrays, from 'make_gsp_forecast_array'
+    :param gsp_chunk_size: the number of gsps to reduce at once
+    :return: dataframe with index (gsp_id, forecast_horizon_minutes) and columns
+        mae, me and number_of_data_points
+    """
+    n_gsps, _, n_forecast_horizons = gsp_forecast_array.forecast.shape
+
+    sum_error = np.zeros((n_gsps, n_forecast_horizons), dtype="float64")
+    sum_abs_error = np.zeros((n_gsps, n_forecast_horizons), dtype="float64")
+    count = np.zeros((n_gsps, n_forecast_horizons), dtype="int64")
+
+    for start in range(0, n_gsps, gsp_chunk_size):
+        end = start + gsp_chunk_size
+        error = (
+            gsp_forecast_array.forecast[start:end].astype("float64")
+            - gsp_forecast_array.truth[start:end, :, None]
+        )
+        sum_error[start:end] = np.nansum(error, axis=1)
+        sum_abs_error[start:end] = np.nansum(np.abs(error), axis=1)
+        count[start:end] = np.sum(~np.isnan(error), axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mae = np.where(count > 0, sum_abs_error / count, np.nan)
+        me = np.where(count > 0, sum_error / count, np.nan)
+
+    index = pd.MultiIndex.from_product(
+        [gsp_forecast_array.gsp_ids, gsp_forecast_array.forecast_horizons_minutes],
+        names=["gsp_id", "forecast_horizon_minutes"],
+    )
+    return pd.DataFrame(
+        {
+            "mae": mae.reshape(-1),
+            "me": me.reshape(-1),
+            "number_of_data_points": count.reshape(-1),
+        },
+        index=index,
+    )
+
+
+def make_gsp_horizon_mae(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    model_name: str,
+    gsp_horizon_errors: pd.DataFrame,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+):
+    """
+    Save the MAE for each gsp and forecast horizon
+
+    Only gsps and forecast horizons with data points are saved.
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param model_name: the model name
+    :param gsp_horizon_errors: the errors, from 'get_gsp_horizon_errors'
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    """
+    gsp_horizon_errors = gsp_horizon_errors[gsp_horizon_errors.number_of_data_points > 0]
+    locations = get_locations(
+        session=session, gsp_ids=gsp_horizon_errors.index.get_level_values("gsp_id").unique()
+    )
+
+    logger.debug(f"Saving {len(gsp_horizon_errors)} gsp horizon MAE values for {model_name=}")
+
+    for (gsp_id, forecast_horizon_minutes), result in gsp_horizon_errors.iterrows():
+        save_metric_value_to_database(
+            session=session,
+            value=float(result.mae),
+            number_of_data_points=int(result.number_of_data_points),
+            datetime_interval=datetime_interval,
+            metric=latest_mae,
+            location=locations[int(gsp_id)],
+            model_name=model_name,
+            forecast_horizon_minutes=int(forecast_horizon_minutes),
+            metric_value_writer=metric_value_writer,
+        )
+
+
+def make_gsp_horizon_metrics(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    all_gsp_forecast_values: dict,
+    gsp_yields: pd.DataFrame,
+    n_gsps: int,
+    max_forecast_horizon_minutes: Optional[dict] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    array_dir: Optional[str] = None,
+) -> dict:
+    """
+    Make the MAE for each gsp (not national), model and forecast horizon
+
+    National is done by 'make_mae', from the national forecast.
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param all_gsp_forecast_values: {model_name: forecast values}, from 'get_gsp_forecast_values'
+    :param gsp_yields: the day-after yields for all gsps, from 'get_gsp_yields'
+    :param n_gsps: the number of gsps, gsp ids 1 to n_gsps are used
+    :param max_forecast_horizon_minutes: the maximum forecast horizon for each model
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param array_dir: optional directory to memory map the forecast arrays in
+    :return: {model_name: errors}, from 'get_gsp_horizon_errors'
+    """
+    if max_forecast_horizon_minutes is None:
+        max_forecast_horizon_minutes = default_max_forecast_horizon_minutes
+
+    all_gsp_horizon_errors = {}
+    for model_name, gsp_forecast_values in all_gsp_forecast_values.items():
+        forecast_horizons_minutes = get_forecast_range(
+            max_forecast_horizon_minutes.get(model_name, 480)
+        )
+        filename = None if array_dir is None else f"{array_dir}/{model_name}.npy"
+
+        gsp_forecast_array = make_gsp_forecast_array(
+            gsp_forecast_values=gsp_forecast_values,
+            gsp_yields=gsp_yields,
+            datetime_interval=datetime_interval,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+            gsp_ids=list(range(1, n_gsps + 1)),
+            filename=filename,
+        )
+        gsp_horizon_errors = get_gsp_horizon_errors(gsp_forecast_array)
+
+        make_gsp_horizon_mae(
+            session=session,
+            datetime_interval=datetime_interval,
+            model_name=model_name,
+            gsp_horizon_errors=gsp_horizon_errors,
+            metric_value_writer=metric_value_writer,
+        )
+        all_gsp_horizon_errors[model_name] = gsp_horizon_errors
+
+    if metric_value_writer is None:
+        session.commit()
+
+    return all_gsp_horizon_errors
@@ -1,16 +1,17 @@
 """ Function to make MAE
 
 1. Calculate the Mean Absolute Error (MAE) for different forecast horizons. This is done for National
-2. Calculate the MAE for PVLive initial and updated estimates.
-3. Calculate the MAE for each GSPs (not national) for latest forecasts
+2. Calculate the MAE for PVLive initial and updated estimates. This is done for all GSPs in memory
+3. Calculate the MAE for each GSPs (not national) for latest forecasts. This can be done for all
+GSPs and models in one grouped query, see 'get_gsp_errors'
 4. Calculate the MAE for all GSPs (not national) for all forecasts
 
-1. has been optimized by only loading the data once, 2.-4. load the data from the database each time.
+1. has been optimized by only loading the data once, and all the forecast horizons are done in one
+pass. 2.-4. load the data from the database each time.
 
 """
 import logging
 import os
-from datetime import timezone
 from typing import Optional, Union
 
 import numpy as np
@@ -23,21 +24,25 @@ from nowcasting_datamodel.models import (
 from nowcasting_datamodel.models.gsp import GSPYieldSQL
 from nowcasting_datamodel.models.gsp import LocationSQL
 from nowcasting_datamodel.models.metric import DatetimeInterval
-from nowcasting_datamodel.read.read import get_location
 from nowcasting_datamodel.read.read_models import get_models
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql import func
 
+from nowcasting_metrics.database.lookup import get_location, get_locations
+from nowcasting_metrics.database.gsp_yield import get_pvlive_yields
 from nowcasting_metrics.metrics.utils import (
     default_gsp_models,
     filter_query_on_datetime_interval,
+    get_aligned_forecast_values,
     get_forecast_range,
+    get_pvlive_errors,
     make_pvlive_subquery,
+    select_forecast_horizons,
 )
 from nowcasting_metrics.metrics.utils import (
     default_max_forecast_horizon_minutes,
 )
-from nowcasting_metrics.utils import save_metric_value_to_database
+from nowcasting_metrics.utils import MetricValueWriter, save_metric_value_to_database
 
 logger = logging.getLogger(__name__)
 
@@ -71,7 +76,10 @@ pvlive_mae = Metric(
 
 
 def make_pvlive_mae(
-    session: Session, datetime_interval: DatetimeInterval, gsp_id: int
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    gsp_id: int,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ) -> (int, int):
     """
     Calculate MAE for the PV Live initial and updates estimate
@@ -79,6 +87,7 @@ def make_pvlive_mae(
     :param session: database sessions
     :param datetime_interval: datetime interval
     :param gsp_id: the gsp id
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return:  1. the MAE, 2. the number of data points
     """
 
@@ -119,11 +128,198 @@ def make_pvlive_mae(
         datetime_interval=datetime_interval,
         metric=pvlive_mae,
         location=get_location(gsp_id=gsp_id, session=session),
+        metric_value_writer=metric_value_writer,
     )
 
     return value, number_of_data_points
 
 
+def make_pvlive_mae_gsps(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    pvlive_yields: pd.DataFrame,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+) -> pd.DataFrame:
+    """
+    Calculate MAE for the PV Live initial and updates estimate, for all gsps at once
+
+    :param session: database sessions
+    :param datetime_interval: datetime interval
+    :param pvlive_yields: the in-day and day-after yields for all gsps, from 'get_pvlive_yields'
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :return: dataframe with index gsp_id and columns mae, rmse and number_of_data_points
+    """
+
+    pvlive_errors = get_pvlive_errors(pvlive_yields=pvlive_yields)
+    locations = get_locations(session=session, gsp_ids=pvlive_errors.index)
+
+    for gsp_id, pvlive_error in pvlive_errors.iterrows():
+        value = None if pd.isna(pvlive_error.mae) else float(pvlive_error.mae)
+        number_of_data_points = int(pvlive_error.number_of_data_points)
+
+        logger.debug(
+            f"Found PVlive MAE of {value} from {number_of_data_points} "
+            f"data points for {gsp_id=}."
+        )
+
+        save_metric_value_to_database(
+            session=session,
+            value=value,
+            number_of_data_points=number_of_data_points,
+            datetime_interval=datetime_interval,
+            metric=pvlive_mae,
+            location=locations[gsp_id],
+            metric_value_writer=metric_value_writer,
+        )
+
+    return pvlive_errors
+
+
+def get_mae_error_sums(aligned_forecast_values: pd.DataFrame) -> pd.DataFrame:
+    """
+    Get the sum and count of the absolute errors for each forecast horizon
+
+    :param aligned_forecast_values: aligned forecast values, from 'get_aligned_forecast_values'
+    :return: dataframe with index forecast_horizon_minutes and columns
+        error, error_count, error_adjuster and error_adjuster_count
+    """
+    # the errors are in float64, even though the forecast values are stored as float32
+    forecast = aligned_forecast_values.expected_power_generation_megawatts.astype("float64")
+    adjust_mw = aligned_forecast_values.adjust_mw.astype("float64")
+    truth = aligned_forecast_values.solar_generation_kw.astype("float64") / 1000
+    errors = pd.DataFrame(
+        {
+            "error": (forecast - truth).abs(),
+            "error_adjuster": (forecast - adjust_mw - truth).abs(),
+            "forecast_horizon_minutes": aligned_forecast_values.forecast_horizon_minutes,
+        }
+    )
+
+    errors = errors.groupby("forecast_horizon_minutes", dropna=False)
+    return pd.DataFrame(
+        {
+            "error": errors["error"].sum(),
+            "error_count": errors["error"].count(),
+            "error_adjuster": errors["error_adjuster"].sum(),
+            "error_adjuster_count": errors["error_adjuster"].count(),
+        }
+    )
+
+
+def make_mae_values_for_forecast_horizons(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    forecast_horizons_minutes: list[Optional[int]],
+    metric: Optional[Metric] = latest_mae,
+    model_name: Optional[str] = None,
+    use_adjuster: bool = True,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    aligned_forecast_values: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    Calculate the MAE for several forecast horizons in one pass, and save to database
+
+    The latest forecast value for each target time and forecast horizon is found once for all
+    the forecast horizons, rather than filtering and grouping the forecast values for each one.
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param forecast_values: the forecast values for the last seven days
+    :param gsp_yields: the GSP yields for the last seven days
+    :param forecast_horizons_minutes: the forecast horizons, None means no forecast horizon
+    :param metric: the metric to use
+    :param model_name: the model name of the forecast. This is optional.
+    :param use_adjuster: option to use the adjuster or not.
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param aligned_forecast_values: optional aligned forecast values, from
+        'get_aligned_forecast_values'. If given, these are used rather than forecast_values
+    :return: dataframe with index forecast_horizon_minutes and columns
+        value, value_adjuster and number_of_data_points
+    """
+
+    logger.debug(
+        f"Calculating MAE for last forecast for {model_name=} for"
+        f"start={datetime_interval.start_datetime_utc} "
+        f"and end-{datetime_interval.end_datetime_utc}"
+        f" and {len(forecast_horizons_minutes)} forecast horizons"
+    )
+
+    results_df = pd.DataFrame(
+        columns=["value", "value_adjuster", "number_of_data_points"],
+        index=pd.Index([], dtype="Int64", name="forecast_horizon_minutes"),
+    )
+
+    if aligned_forecast_values is not None:
+        aligned_forecast_values = select_forecast_horizons(
+            aligned_forecast_values, forecast_horizons_minutes
+        )
+    else:
+        aligned_forecast_values = get_aligned_forecast_values(
+            datetime_interval=datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+        )
+
+    if len(aligned_forecast_values) == 0:
+        logger.warning(f"Forecast values are empty for {model_name=}")
+        return results_df
+
+    error_sums = get_mae_error_sums(aligned_forecast_values)
+    results_df = pd.DataFrame(
+        {
+            "value": error_sums.error / error_sums.error_count.replace(0, np.nan),
+            "value_adjuster": error_sums.error_adjuster
+            / error_sums.error_adjuster_count.replace(0, np.nan),
+            "number_of_data_points": error_sums.error_count,
+        }
+    )
+
+    location = get_location(gsp_id=0, session=session)
+
+    for forecast_horizon_minutes, result in results_df.iterrows():
+        forecast_horizon_minutes = (
+            None if pd.isna(forecast_horizon_minutes) else int(forecast_horizon_minutes)
+        )
+        value = None if np.isnan(result.value) else float(result.value)
+        value_adjuster = None if np.isnan(result.value_adjuster) else float(result.value_adjuster)
+        number_of_data_points = int(result.number_of_data_points)
+
+        logger.debug(
+            f"Found MAE of {value} (adjuster {value_adjuster}) from {number_of_data_points} "
+            f"data points for {forecast_horizon_minutes=} for {model_name=}."
+        )
+
+        save_metric_value_to_database(
+            session=session,
+            value=value,
+            number_of_data_points=number_of_data_points,
+            datetime_interval=datetime_interval,
+            metric=metric,
+            location=location,
+            model_name=model_name,
+            forecast_horizon_minutes=forecast_horizon_minutes,
+            metric_value_writer=metric_value_writer,
+        )
+
+        if use_adjuster:
+            save_metric_value_to_database(
+                session=session,
+                value=value_adjuster,
+                number_of_data_points=number_of_data_points,
+                datetime_interval=datetime_interval,
+                metric=latest_mae_with_adjuster,
+                location=location,
+                model_name=model_name,
+                forecast_horizon_minutes=forecast_horizon_minutes,
+                metric_value_writer=metric_value_writer,
+            )
+
+    return results_df
+
+
 def make_mae_values(
     session: Session,
     datetime_interval: DatetimeInterval,
@@ -132,7 +328,8 @@ def make_mae_values(
     metric: Optional[Metric] = latest_mae,
     model_name: Optional[str] = None,
     use_adjuster: bool = True,
-    forecast_horizon_minutes: Optional[int] = None
+    forecast_horizon_minutes: Optional[int] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ) -> (int, int):
     """
     Calculate the MAE for one GSP, and save to database
@@ -147,95 +344,38 @@ def make_mae_values(
         made 60 minutes before target time
     :param forecast_values: the forecast values for the last seven days
     :param gsp_yields: the GSP yields for the last seven days
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return: 1. the MAE, 2. MAE with adjuster, 3. the number of data points
     """
 
-    logger.debug(
-        f"Calculating MAE for last forecast for {model_name=} for"
-        f"start={datetime_interval.start_datetime_utc} "
-        f"and end-{datetime_interval.end_datetime_utc}"
-        f" and {forecast_horizon_minutes=}"
-    )
-
     if len(forecast_values) == 0:
         logger.warning(
             f"Forecast values are empty for {model_name=}"
         )
         return ()
 
-    start_datetime_utc = datetime_interval.start_datetime_utc.replace(tzinfo=timezone.utc)
-    end_datetime_utc = datetime_interval.end_datetime_utc.replace(tzinfo=timezone.utc)
-
-    gsp_yields = gsp_yields[gsp_yields.index >= start_datetime_utc]
-    gsp_yields = gsp_yields[gsp_yields.index <= end_datetime_utc]
-
-    forecast_values = forecast_values.copy()
-    forecast_values = forecast_values[forecast_values.index >= start_datetime_utc]
-    forecast_values = forecast_values[forecast_values.index <= end_datetime_utc]
-    if forecast_horizon_minutes is not None:
-        forecast_values = forecast_values[
-            forecast_values.index
-            > forecast_values.created_utc + pd.Timedelta(minutes=forecast_horizon_minutes)
-            ]
-
-    # take first forecast value for each index, this is becasue they are order by created_utc descing.
-    # this means we get the latest forecast for a given forecast_horizon_minutes
-    forecast_values = forecast_values.groupby(forecast_values.index).first()
-    forecast_values = forecast_values.join(gsp_yields, how="inner", rsuffix="_forecast")
-
-    # calculate the MAE
-    forecast_values["error"] = (
-            forecast_values.expected_power_generation_megawatts
-            - forecast_values.solar_generation_kw / 1000
-    ).abs()
-
-    # calculate the MAE
-    forecast_values["error_adjuster"] = (
-            forecast_values.expected_power_generation_megawatts
-            - forecast_values.adjust_mw
-            - forecast_values.solar_generation_kw / 1000
-    ).abs()
-
-    value = float(forecast_values["error"].mean())
-    value_adjuster = float(forecast_values["error_adjuster"].mean())
-    number_of_data_points = int(forecast_values["error"].count())
-    if np.isnan(value):
-        value = None
-    if np.isnan(value_adjuster):
-        value_adjuster = None
-
-    logger.info(value)
-    logger.info(f"value_adjuster: {value_adjuster}")
-    logger.info(f"number_of_data_points: {number_of_data_points}")
-
-    logger.debug(f"Found MAE of {value} from {number_of_data_points} data points.")
-
-    location = get_location(gsp_id=0, session=session)
-
-    save_metric_value_to_database(
+    results_df = make_mae_values_for_forecast_horizons(
         session=session,
-        value=value,
-        number_of_data_points=number_of_data_points,
         datetime_interval=datetime_interval,
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields,
+        forecast_horizons_minutes=[forecast_horizon_minutes],
         metric=metric,
-        location=location,
         model_name=model_name,
-        forecast_horizon_minutes=forecast_horizon_minutes
+        use_adjuster=use_adjuster,
+        metric_value_writer=metric_value_writer,
     )
 
-    if use_adjuster:
-        save_metric_value_to_database(
-            session=session,
-            value=value_adjuster,
-            number_of_data_points=number_of_data_points,
-            datetime_interval=datetime_interval,
-            metric=latest_mae_with_adjuster,
-            location=location,
-            model_name=model_name,
-            forecast_horizon_minutes=forecast_horizon_minutes
-        )
+    if len(results_df) == 0:
+        logger.debug(f"Found no data points for MAE for {model_name=} {forecast_horizon_minutes=}")
+        return None, None, 0
+
+    result = results_df.iloc[0]
+    value = None if np.isnan(result.value) else float(result.value)
+    value_adjuster = None if np.isnan(result.value_adjuster) else float(result.value_adjuster)
+
+    return value, value_adjuster, int(result.number_of_data_points)
 
-    return value, value_adjuster, number_of_data_points
 
 def make_mae_one_gsp(
     session: Session,
@@ -244,6 +384,7 @@ def make_mae_one_gsp(
     metric: Optional[Metric] = latest_mae,
     model_name: Optional[str] = None,
     use_adjuster: bool = True,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ) -> (int, int):
     """
     Calculate the MAE for one GSP, and save to database
@@ -255,6 +396,7 @@ def make_mae_one_gsp(
     :param metric: the metric to use
     :param model_name: the model name of the forecast. This is optional.
     :param use_adjuster: option to use the adjuster or not.
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return: 1. the MAE, 2. MAE with adjuster, 3. the number of data points
     """
 
@@ -296,6 +438,7 @@ def make_mae_one_gsp(
         metric=metric,
         location=get_location(gsp_id=gsp_id, session=session),
         model_name=model_name,
+        metric_value_writer=metric_value_writer,
     )
 
     if use_adjuster:
@@ -307,15 +450,57 @@ def make_mae_one_gsp(
             metric=latest_mae_with_adjuster,
             location=get_location(gsp_id=gsp_id, session=session),
             model_name=model_name,
+            metric_value_writer=metric_value_writer,
         )
 
     return value, value_adjuster, number_of_data_points
 
 
+def make_mae_gsps(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    gsp_errors: pd.DataFrame,
+    metric: Optional[Metric] = latest_mae,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+):
+    """
+    Save the MAE for each GSP (not national) and model, from the grouped errors
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param gsp_errors: the errors for each gsp and model, from 'get_gsp_errors'
+    :param metric: the metric to use
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    """
+
+    gsp_errors = gsp_errors[gsp_errors.gsp_id != 0]
+    locations = get_locations(session=session, gsp_ids=gsp_errors.gsp_id.unique())
+
+    for gsp_error in gsp_errors.itertuples():
+        value = None if pd.isna(gsp_error.mae) else float(gsp_error.mae)
+
+        logger.debug(
+            f"Found MAE of {value} from {gsp_error.number_of_data_points} data points "
+            f"for gsp_id={gsp_error.gsp_id} for model_name={gsp_error.model_name}."
+        )
+
+        save_metric_value_to_database(
+            session=session,
+            value=value,
+            number_of_data_points=int(gsp_error.number_of_data_points),
+            datetime_interval=datetime_interval,
+            metric=metric,
+            location=locations[gsp_error.gsp_id],
+            model_name=gsp_error.model_name,
+            metric_value_writer=metric_value_writer,
+        )
+
+
 def make_mae_all_gsp(
     session: Session,
     datetime_interval: DatetimeInterval,
     model_name: Optional[str] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ) -> (int, int):
     """
     Calculate the MAE for all GSPs (not national), and save to database
@@ -323,6 +508,7 @@ def make_mae_all_gsp(
     :param session: database session
     :param datetime_interval: datetime interval
     :param model_name: the model name of the forecast. This is optional.
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return: 1. the MAE, 2. the number of data points
     """
 
@@ -370,6 +556,7 @@ def make_mae_all_gsp(
         metric=mae_all_gsps,
         location=None,
         model_name=model_name,
+        metric_value_writer=metric_value_writer,
     )
 
     return value, number_of_data_points
@@ -410,6 +597,10 @@ def make_mae(
     gsp_yields: pd.DataFrame,
     n_gsps: Optional[int] = N_GSP,
     max_forecast_horizon_minutes: Optional[dict] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    gsp_errors: Optional[pd.DataFrame] = None,
+    pvlive_yields: Optional[pd.DataFrame] = None,
+    all_aligned_forecast_values: Optional[dict] = None,
 ):
     """
     Calculate MAE for all GSPs
@@ -421,6 +612,13 @@ def make_mae(
         The maximum forecast horizon we should look at, default is set below
     :param all_forecast_values: all forecast values for the last seven days
     :param gsp_yields: the GSP yields for the last seven days
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param gsp_errors: optional errors for each gsp and model, from 'get_gsp_errors'.
+        If given, these are used for the MAE of each GSP, rather than one query for each GSP
+    :param pvlive_yields: optional PVLive yields for all gsps, from 'get_pvlive_yields'.
+        These are loaded from the database if not given.
+    :param all_aligned_forecast_values: optional aligned forecast values for each model,
+        from 'get_all_aligned_forecast_values'
     """
 
     if max_forecast_horizon_minutes is None:
@@ -436,6 +634,9 @@ def make_mae(
     if use_pvnet_gsp_sum and "pvnet_gsp_sum" not in models:
         models.append("pvnet_gsp_sum")
 
+    if all_aligned_forecast_values is None:
+        all_aligned_forecast_values = {}
+
     # make sure models in max_forecast_horizon_minutes
     for model in models:
         if model not in max_forecast_horizon_minutes:
@@ -450,38 +651,64 @@ def make_mae(
 
         forecast_values_df = all_forecast_values[model_name]
 
-        # loop over forecast horizons
-        # we want to run the MAE for no forecast horizon as well as each forecast horizon
-        for forecast_horizon_minutes in [None] + list(get_forecast_range(max_forecast_horizon_minutes[model_name])):
-            make_mae_values(
-                session=session,
-                datetime_interval=datetime_interval,
-                forecast_horizon_minutes=forecast_horizon_minutes,
-                model_name=model_name,
-                forecast_values=forecast_values_df,
-                gsp_yields=gsp_yields
-            )
+        # we want to run the MAE for no forecast horizon as well as each forecast horizon,
+        # these are all done together in one pass
+        forecast_horizons_minutes = [None] + list(
+            get_forecast_range(max_forecast_horizon_minutes[model_name])
+        )
+        make_mae_values_for_forecast_horizons(
+            session=session,
+            datetime_interval=datetime_interval,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+            model_name=model_name,
+            forecast_values=forecast_values_df,
+            gsp_yields=gsp_yields,
+            metric_value_writer=metric_value_writer,
+            aligned_forecast_values=all_aligned_forecast_values.get(model_name),
+        )
 
 
     # Below are metrics made by querying the database directly, rather than using forecast values
     # This can be a improvement in the future
 
-    # 2. pvlive
-    for gps_id in range(0, n_gsps + 1):
-        make_pvlive_mae(session=session, datetime_interval=datetime_interval, gsp_id=gps_id)
+    # 2. pvlive, all gsps in one go
+    if pvlive_yields is None:
+        pvlive_yields = get_pvlive_yields(
+            session=session, datetime_interval=datetime_interval, n_gsps=n_gsps
+        )
+    make_pvlive_mae_gsps(
+        session=session,
+        datetime_interval=datetime_interval,
+        pvlive_yields=pvlive_yields,
+        metric_value_writer=metric_value_writer,
+    )
+
+    # 3. for each gsps, all in one go
+    if gsp_errors is not None:
+        make_mae_gsps(
+            session=session,
+            datetime_interval=datetime_interval,
+            gsp_errors=gsp_errors[gsp_errors.model_name.isin(default_gsp_models)],
+            metric_value_writer=metric_value_writer,
+        )
 
     for model_name in default_gsp_models:
-        # 3. for ecah gsps
-        for gps_id in range(1, n_gsps + 1):
-            make_mae_one_gsp(
-                session=session,
-                datetime_interval=datetime_interval,
-                gsp_id=gps_id,
-                model_name=model_name,
-                use_adjuster=False,
-            )
+        # 3. for each gsps, one at a time
+        if gsp_errors is None:
+            for gps_id in range(1, n_gsps + 1):
+                make_mae_one_gsp(
+                    session=session,
+                    datetime_interval=datetime_interval,
+                    gsp_id=gps_id,
+                    model_name=model_name,
+                    use_adjuster=False,
+                    metric_value_writer=metric_value_writer,
+                )
 
         # 4. all gsps (not national)
         make_mae_all_gsp(
-            session=session, datetime_interval=datetime_interval, model_name=model_name
+            session=session,
+            datetime_interval=datetime_interval,
+            model_name=model_name,
+            metric_value_writer=metric_value_writer,
         )
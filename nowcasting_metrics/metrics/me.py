@@ -2,23 +2,26 @@
 import logging
 from typing import Optional, Union
 
-from datetime import timezone
-
 import pandas as pd
 from nowcasting_datamodel.models import ForecastValueLatestSQL, ForecastValueSevenDaysSQL, Metric
 from nowcasting_datamodel.models.gsp import GSPYieldSQL
 from nowcasting_datamodel.models.metric import DatetimeInterval
-from nowcasting_datamodel.read.read import get_location
 from sqlalchemy import Time, cast
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql import func
 
+from nowcasting_metrics.database.lookup import get_datetime_interval, get_location, get_metric
+from nowcasting_metrics.metrics.statistics import (
+    merge_error_statistics,
+    update_daily_error_statistics,
+)
 from nowcasting_metrics.metrics.utils import (
     default_max_forecast_horizon_minutes,
     default_national_models,
+    get_aligned_forecast_values,
+    select_forecast_horizons,
 )
-from nowcasting_metrics.utils import save_metric_value_to_database
-from nowcasting_datamodel.read.read_metric import get_datetime_interval, get_metric
+from nowcasting_metrics.utils import MetricValueWriter, save_metric_value_to_database
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +41,8 @@ def make_me_one_gsp_with_forecast_horizon_and_one_half_hour(
     gsp_yields: pd.DataFrame,
     model_name: str = None,
     save_to_database: bool = True,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    aligned_forecast_values: Optional[pd.DataFrame] = None,
 ) -> (int, int):
     """
     Calculate the ME for one GSP for a forecast horizon for one half hour, and save to database
@@ -51,6 +56,9 @@ def make_me_one_gsp_with_forecast_horizon_and_one_half_hour(
     :param gsp_yields: the gsp yields
     :param model_name: the model name of the forecast. This is optional.
     :param save_to_database: if True, save the results to the database
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param aligned_forecast_values: optional aligned forecast values, from
+        'get_aligned_forecast_values'. If given, these are used rather than forecast_values
     :return: 1. the MAE, 2. the number of data points
     """
 
@@ -60,34 +68,27 @@ def make_me_one_gsp_with_forecast_horizon_and_one_half_hour(
         )
         return []
 
-    start_datetime_utc = datetime_interval.start_datetime_utc.replace(tzinfo=timezone.utc)
-    end_datetime_utc = datetime_interval.end_datetime_utc.replace(tzinfo=timezone.utc)
-
-    gsp_yields = gsp_yields[gsp_yields.index >= start_datetime_utc]
-    gsp_yields = gsp_yields[gsp_yields.index <= end_datetime_utc]
-
+    # the latest forecast for each target time for the forecast horizon, with the truth
+    if aligned_forecast_values is not None:
+        forecast_values = select_forecast_horizons(
+            aligned_forecast_values, [forecast_horizon_minutes]
+        )
+    else:
+        forecast_values = get_aligned_forecast_values(
+            datetime_interval=datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=[forecast_horizon_minutes],
+        )
     forecast_values = forecast_values.copy()
-    forecast_values = forecast_values[forecast_values.index >= start_datetime_utc]
-    forecast_values = forecast_values[forecast_values.index <= end_datetime_utc]
-    forecast_values = forecast_values[
-        forecast_values.index
-        > forecast_values.created_utc + pd.Timedelta(minutes=forecast_horizon_minutes)
-    ]
-
-    # take first forecast value for each index, this is becasue they are order by created_utc descing.
-    # this means we get the latest forecast for a given forecast_horizon_minutes
-    forecast_values = forecast_values.groupby(forecast_values.index).first()
-
-    # join together with gsp_yields
-    forecast_values = forecast_values.join(gsp_yields, how="inner", rsuffix="_forecast")
 
     # create new columns of time
     forecast_values["time_of_day"] = forecast_values.index.time
 
     # calculate the ME
     forecast_values["error"] = (
-        forecast_values.expected_power_generation_megawatts
-        - forecast_values.solar_generation_kw / 1000
+        forecast_values.expected_power_generation_megawatts.astype("float64")
+        - forecast_values.solar_generation_kw.astype("float64") / 1000
     )
 
     # group by time_of_day
@@ -130,6 +131,7 @@ def make_me_one_gsp_with_forecast_horizon_and_one_half_hour(
                 location=location,
                 forecast_horizon_minutes=forecast_horizon_minutes,
                 model_name=model_name,
+                metric_value_writer=metric_value_writer,
             )
 
     session.commit()
@@ -137,6 +139,172 @@ def make_me_one_gsp_with_forecast_horizon_and_one_half_hour(
     return results
 
 
+def make_me_from_statistics(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    model_name: str,
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    forecast_horizons_minutes: list[int],
+    statistics_dir: str,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+) -> pd.DataFrame:
+    """
+    Calculate the ME for each forecast horizon and half hour from the daily error statistics
+
+    Only the days that are not already in 'statistics_dir' are worked out from the forecast values,
+    see 'update_daily_error_statistics'. The statistics of each day are then added up.
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param model_name: the model name of the forecast
+    :param forecast_values: the forecast values
+    :param gsp_yields: the gsp yields
+    :param forecast_horizons_minutes: the forecast horizons
+    :param statistics_dir: the directory of the daily error statistics
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :return: dataframe with index (forecast_horizon_minutes, time_of_day) and columns
+        me, mae, rmse and number_of_data_points
+    """
+    statistics = update_daily_error_statistics(
+        statistics_dir=statistics_dir,
+        model_name=model_name,
+        datetime_interval=datetime_interval,
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields,
+        forecast_horizons_minutes=forecast_horizons_minutes,
+    )
+    results_df = merge_error_statistics(statistics)
+
+    save_me_values(
+        session=session,
+        datetime_interval=datetime_interval,
+        model_name=model_name,
+        results_df=results_df,
+        metric_value_writer=metric_value_writer,
+    )
+
+    return results_df
+
+
+def make_me_values_for_forecast_horizons(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    model_name: str,
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    forecast_horizons_minutes: list[int],
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    aligned_forecast_values: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    Calculate the ME for each forecast horizon and half hour in one pass
+
+    The errors are grouped by forecast horizon and time of day together, rather than
+    grouping the forecast values again for each forecast horizon.
+    The session is not committed, so all the models can be saved together.
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param model_name: the model name of the forecast
+    :param forecast_values: the forecast values
+    :param gsp_yields: the gsp yields
+    :param forecast_horizons_minutes: the forecast horizons
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param aligned_forecast_values: optional aligned forecast values, from
+        'get_aligned_forecast_values'. If given, these are used rather than forecast_values
+    :return: dataframe with index (forecast_horizon_minutes, time_of_day) and columns
+        me and number_of_data_points
+    """
+    if aligned_forecast_values is not None:
+        aligned_forecast_values = select_forecast_horizons(
+            aligned_forecast_values, forecast_horizons_minutes
+        )
+    else:
+        aligned_forecast_values = get_aligned_forecast_values(
+            datetime_interval=datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+        )
+
+    if len(aligned_forecast_values) == 0:
+        logger.warning(f"Forecast values are empty for {model_name=}")
+        return pd.DataFrame(columns=["me", "number_of_data_points"])
+
+    error = (
+        aligned_forecast_values.expected_power_generation_megawatts.to_numpy(dtype="float64")
+        - aligned_forecast_values.solar_generation_kw.to_numpy(dtype="float64") / 1000
+    )
+    errors = pd.Series(
+        error,
+        index=pd.MultiIndex.from_arrays(
+            [
+                aligned_forecast_values.forecast_horizon_minutes.to_numpy(dtype="int64"),
+                aligned_forecast_values.index.time,
+            ],
+            names=["forecast_horizon_minutes", "time_of_day"],
+        ),
+    ).groupby(level=[0, 1])
+
+    results_df = pd.DataFrame({"me": errors.mean(), "number_of_data_points": errors.count()})
+    logger.debug(f"Found {len(results_df)} ME values for {model_name=}")
+
+    save_me_values(
+        session=session,
+        datetime_interval=datetime_interval,
+        model_name=model_name,
+        results_df=results_df,
+        metric_value_writer=metric_value_writer,
+    )
+
+    return results_df
+
+
+def save_me_values(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    model_name: str,
+    results_df: pd.DataFrame,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+):
+    """
+    Save the ME for each forecast horizon and half hour
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param model_name: the model name of the forecast
+    :param results_df: dataframe with index (forecast_horizon_minutes, time_of_day) and
+        columns me and number_of_data_points
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    """
+    location = get_location(gsp_id=0, session=session)
+    metric_sql = get_metric(session=session, name=me_hh.name)
+    datetime_interval_sql = get_datetime_interval(
+        session=session,
+        start_datetime_utc=datetime_interval.start_datetime_utc,
+        end_datetime_utc=datetime_interval.end_datetime_utc,
+    )
+
+    forecast_horizons_minutes = results_df.index.get_level_values(0)
+    times_of_day = results_df.index.get_level_values(1)
+    for forecast_horizon_minutes, time_of_day, value, number_of_data_points in zip(
+        forecast_horizons_minutes, times_of_day, results_df.me, results_df.number_of_data_points
+    ):
+        save_metric_value_to_database(
+            session=session,
+            value=float(value),
+            number_of_data_points=int(number_of_data_points),
+            datetime_interval=datetime_interval_sql,
+            time_of_day=time_of_day,
+            metric=metric_sql,
+            location=location,
+            forecast_horizon_minutes=int(forecast_horizon_minutes),
+            model_name=model_name,
+            metric_value_writer=metric_value_writer,
+        )
+
+
 def make_me_query(
     session,
     model: Union[ForecastValueSevenDaysSQL, ForecastValueLatestSQL] = ForecastValueLatestSQL,
@@ -164,6 +332,10 @@ def make_me(
     all_forecast_values: dict,
     gsp_yields: pd.DataFrame,
     max_forecast_horizon_minutes: Optional[dict] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    all_aligned_forecast_values: Optional[dict] = None,
+    statistics_dir: Optional[str] = None,
+    model_names: Optional[list[str]] = None,
 ):
     """
     Calculate MAE for all GSPs
@@ -174,15 +346,28 @@ def make_me(
     :param all_forecast_values: all forecast values for all models
         {model_name: forecast_values_df}
     :param gsp_yields: gsp yields
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :param: max_forecast_horizon_minutes.
         The maximum forecast horizon we should look at, default is 8 hours
+    :param all_aligned_forecast_values: optional aligned forecast values for each model,
+        from 'get_all_aligned_forecast_values'. These are made here if not given
+    :param statistics_dir: optional directory of daily error statistics. If given, the ME is
+        made by adding up the statistics of each day, and only new days are worked out
+    :param model_names: optional model names to make the ME for,
+        default is all the national models
     """
 
     if max_forecast_horizon_minutes is None:
         max_forecast_horizon_minutes = default_max_forecast_horizon_minutes
 
+    if all_aligned_forecast_values is None:
+        all_aligned_forecast_values = {}
+
+    if model_names is None:
+        model_names = default_national_models
+
     # loop over forecast horizons
-    for model_name in default_national_models:
+    for model_name in model_names:
 
         if model_name not in max_forecast_horizon_minutes:
             max_forecast_horizon_minutes[model_name] = default_max_forecast_horizon_minutes[
@@ -194,15 +379,32 @@ def make_me(
             continue
 
         forecast_values_df = all_forecast_values[model_name]
+        forecast_horizons_minutes = list(range(0, max_forecast_horizon_minutes[model_name], 30))
 
-        for forecast_horizon_minutes in range(0, max_forecast_horizon_minutes[model_name], 30):
-
-            make_me_one_gsp_with_forecast_horizon_and_one_half_hour(
+        if statistics_dir is not None:
+            make_me_from_statistics(
                 session=session,
                 datetime_interval=datetime_interval,
-                gsp_id=0,
-                forecast_horizon_minutes=forecast_horizon_minutes,
                 model_name=model_name,
                 forecast_values=forecast_values_df,
                 gsp_yields=gsp_yields,
+                forecast_horizons_minutes=forecast_horizons_minutes,
+                statistics_dir=statistics_dir,
+                metric_value_writer=metric_value_writer,
             )
+            continue
+
+        # all the forecast horizons and half hours in one pass
+        make_me_values_for_forecast_horizons(
+            session=session,
+            datetime_interval=datetime_interval,
+            model_name=model_name,
+            forecast_values=forecast_values_df,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+            metric_value_writer=metric_value_writer,
+            aligned_forecast_values=all_aligned_forecast_values.get(model_name),
+        )
+
+    # one commit for all the models
+    session.commit()
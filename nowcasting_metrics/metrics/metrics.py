@@ -1,12 +1,16 @@
 """ General metric functions """
 
-from nowcasting_datamodel.read.read_metric import get_metric
-
+from nowcasting_metrics.database.lookup import get_metric
 from nowcasting_metrics.metrics.mae import latest_mae, mae_all_gsps, pvlive_mae, latest_mae_with_adjuster
 from nowcasting_metrics.metrics.me import me_hh
 from nowcasting_metrics.metrics.rmse import latest_rmse, pvlive_rmse, rmse_all_gsps, latest_rmse_with_adjuster
 from nowcasting_metrics.metrics.ramp_rate import ramp_rate
-from nowcasting_metrics.metrics.probablistic import exceedance, pinball
+from nowcasting_metrics.metrics.probablistic import (
+    exceedance,
+    interval_coverage,
+    interval_width,
+    pinball,
+)
 
 all_metrics = [
     latest_mae,
@@ -20,7 +24,9 @@ all_metrics = [
     exceedance,
     pinball,
     latest_mae_with_adjuster,
-    latest_rmse_with_adjuster
+    latest_rmse_with_adjuster,
+    interval_coverage,
+    interval_width,
 ]
 
 
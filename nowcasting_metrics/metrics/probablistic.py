@@ -1,14 +1,14 @@
 """ Look at probabilistic metrics for nowcasting models
 
- We will look at
- - exceedence, the amount of times the values it over the plevel. We would expect 90% of valyes to be over the 10% plevel
- - pinball loss
-
- We will look at p levels 10 and 90
- for different forecast horizons
-
- """
-
+We will look at
+- exceedence, the amount of times the values it over the plevel. We would expect 90% of valyes
+  to be over the 10% plevel
+- pinball loss
+
+We will look at all the p levels in the forecast, e.g 10 and 90,
+for different forecast horizons.
+For pairs of p levels, e.g 10 and 90, we also look at the interval coverage and width
+"""
 from datetime import timezone
 import logging
 import pandas as pd
@@ -18,15 +18,17 @@ from nowcasting_datamodel.models import (
     DatetimeInterval,
     Metric,
 )
-from nowcasting_datamodel.read.read import get_location
 from sqlalchemy.orm.session import Session
 
+from nowcasting_metrics.database.lookup import get_location
 from nowcasting_metrics.metrics.utils import (
     default_max_forecast_horizon_minutes,
     default_probabilistic_models,
+    get_aligned_forecast_values,
     get_forecast_range,
+    select_forecast_horizons,
 )
-from nowcasting_metrics.utils import save_metric_value_to_database
+from nowcasting_metrics.utils import MetricValueWriter, save_metric_value_to_database
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +42,273 @@ exceedance = Metric(
     description="The percentage of times the forecast is over the p level. This is for one p level value",
 )
 
+interval_coverage = Metric(
+    name="Interval coverage",
+    description="The fraction of times the truth is inside the interval between two p levels, "
+    "e.g 10 and 90. The p level saved is the size of the interval, e.g 80",
+)
+
+interval_width = Metric(
+    name="Interval width",
+    description="The average width (MW) of the interval between two p levels, "
+    "e.g 10 and 90. The p level saved is the size of the interval, e.g 80",
+)
+
+
+def get_plevels(forecast_values: pd.DataFrame) -> list[str]:
+    """
+    Get the p levels in the forecast values
+
+    These are the columns that are numbers, e.g '10' and '90'. If the p levels have not been
+    expanded when loading the forecast values, the keys of the 'properties' column are used.
+
+    :param forecast_values: forecast values
+    :return: sorted list of p levels
+    """
+    columns = list(forecast_values.columns)
+    if "properties" in forecast_values.columns:
+        for properties in forecast_values.properties:
+            if isinstance(properties, dict):
+                columns += [key for key in properties.keys() if key not in columns]
+
+    plevels = []
+    for column in columns:
+        try:
+            float(column)
+        except (TypeError, ValueError):
+            continue
+        plevels.append(column)
+
+    return sorted(plevels, key=float)
+
+
+def expand_plevels(forecast_values: pd.DataFrame, plevels: list[str]) -> pd.DataFrame:
+    """
+    Make sure there is a float column for each p level
+
+    The json column 'properties' is decoded in one go for the p levels that are missing.
+
+    :param forecast_values: forecast values
+    :param plevels: the p levels needed
+    :return: forecast values with a column for each p level
+    """
+    missing_plevels = [plevel for plevel in plevels if plevel not in forecast_values.columns]
+    if len(missing_plevels) == 0 or "properties" not in forecast_values.columns:
+        return forecast_values
+
+    properties = [p if isinstance(p, dict) else {} for p in forecast_values.properties]
+    properties = pd.DataFrame(properties).reindex(columns=missing_plevels).astype("float64")
+
+    # the index has repeated target times, so add the columns by position, not with a join
+    forecast_values = forecast_values.copy()
+    for plevel in missing_plevels:
+        forecast_values[plevel] = properties[plevel].to_numpy()
+
+    return forecast_values
+
+
+def get_quantile_scores(
+    forecast_horizons_minutes: np.ndarray,
+    truth: np.ndarray,
+    plevel_values: np.ndarray,
+    plevels: list[str],
+) -> pd.DataFrame:
+    """
+    Get the pinball loss and exceedance for all p levels and forecast horizons
+
+    The scores for each data point are calculated as one (data points x p levels) array,
+    and then averaged for each forecast horizon.
+
+    :param forecast_horizons_minutes: the forecast horizon of each data point
+    :param truth: the truth of each data point
+    :param plevel_values: array of the p level forecasts, one column for each p level
+    :param plevels: the p levels
+    :return: dataframe with index (forecast_horizon_minutes, plevel) and columns
+        pinball, exceedance and number_of_data_points
+    """
+    tau = np.array([float(plevel) / 100 for plevel in plevels])
+
+    # positive when the p level is under the truth. Missing p levels are neither under nor over
+    error = truth[:, None] - plevel_values
+    under = error > 0
+    over = error < 0
+    loss = np.where(under, error * (1 - tau), 0) + np.where(over, -error * tau, 0)
+
+    # to take account for night where the truth and prediction are both 0
+    # for plevels above 50, we want to include these,
+    # for plevels below 50, we want to exclude these
+    exceed = np.where(tau < 0.5, ~under, over)
+
+    groups = pd.Index(forecast_horizons_minutes, name="forecast_horizon_minutes")
+    pinball_value = pd.DataFrame(loss, index=groups, columns=plevels).groupby(level=0).mean()
+    exceedance_value = pd.DataFrame(exceed, index=groups, columns=plevels).groupby(level=0).mean()
+    number_of_data_points = groups.value_counts()
+
+    quantile_scores = pd.DataFrame(
+        {
+            "pinball": pinball_value.stack(),
+            "exceedance": exceedance_value.stack(),
+        }
+    )
+    quantile_scores.index.names = ["forecast_horizon_minutes", "plevel"]
+    quantile_scores["number_of_data_points"] = number_of_data_points.reindex(
+        quantile_scores.index.get_level_values(0)
+    ).to_numpy()
+
+    return quantile_scores
+
+
+def get_interval_scores(
+    forecast_horizons_minutes: np.ndarray,
+    truth: np.ndarray,
+    plevel_values: np.ndarray,
+    plevels: list[str],
+) -> pd.DataFrame:
+    """
+    Get the interval coverage and width for all p level pairs and forecast horizons
+
+    The p levels are paired up symmetrically, e.g 10 and 90 make an 80% interval.
+
+    :param forecast_horizons_minutes: the forecast horizon of each data point
+    :param truth: the truth of each data point
+    :param plevel_values: array of the p level forecasts, one column for each p level
+    :param plevels: the p levels
+    :return: dataframe with index (forecast_horizon_minutes, interval) and columns
+        coverage, width and number_of_data_points
+    """
+    lower, upper, intervals = [], [], []
+    for i, plevel in enumerate(plevels):
+        for j, other_plevel in enumerate(plevels):
+            if float(plevel) < 50 and float(plevel) + float(other_plevel) == 100:
+                lower.append(i)
+                upper.append(j)
+                intervals.append(f"{100 - 2 * float(plevel):g}")
+
+    lower_values = plevel_values[:, lower]
+    upper_values = plevel_values[:, upper]
+    covered = (lower_values <= truth[:, None]) & (truth[:, None] <= upper_values)
+    width = upper_values - lower_values
+
+    groups = pd.Index(forecast_horizons_minutes, name="forecast_horizon_minutes")
+    coverage_value = pd.DataFrame(covered, index=groups, columns=intervals).groupby(level=0).mean()
+    width_value = pd.DataFrame(width, index=groups, columns=intervals).groupby(level=0).mean()
+    number_of_data_points = groups.value_counts()
+
+    interval_scores = pd.DataFrame(
+        {
+            "coverage": coverage_value.stack(),
+            "width": width_value.stack(),
+        }
+    )
+    interval_scores.index.names = ["forecast_horizon_minutes", "interval"]
+    interval_scores["number_of_data_points"] = number_of_data_points.reindex(
+        interval_scores.index.get_level_values(0)
+    ).to_numpy()
+
+    return interval_scores
+
+
+def make_probabilistic_metrics_for_forecast_horizons(
+    session,
+    model_name: str,
+    datetime_interval: DatetimeInterval,
+    forecast_horizons_minutes: list[int],
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    plevels: Optional[list[str]] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    aligned_forecast_values: Optional[pd.DataFrame] = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Make probabilistic metrics for all p levels and forecast horizons in one pass
+
+    The latest forecast for each target time and forecast horizon is found once, and then the
+    pinball loss, exceedance, interval coverage and interval width are calculated for all
+    p levels together. This means the run time does not grow with the number of p levels.
+
+    :param session: database session
+    :param model_name: name of the model
+    :param datetime_interval: datetime interval to look at
+    :param forecast_horizons_minutes: forecast horizons to look at
+    :param forecast_values: forecast values for the model
+    :param gsp_yields: the national gsp yields
+    :param plevels: the p levels to look at. If None, all the p levels in the forecast are used
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param aligned_forecast_values: optional aligned forecast values, from
+        'get_aligned_forecast_values'. If given, these are used rather than forecast_values
+    :return: quantile scores and interval scores,
+        see 'get_quantile_scores' and 'get_interval_scores'
+    """
+    logger.info(
+        f"Making probabilistic metrics for {model_name=}, "
+        f"{len(forecast_horizons_minutes)} forecast horizons"
+    )
+
+    empty_scores = pd.DataFrame(), pd.DataFrame()
+
+    if plevels is None:
+        plevels = get_plevels(forecast_values)
+    if len(forecast_values) == 0 or len(plevels) == 0:
+        logger.warning(
+            f"No forecast values or p levels for {model_name=}, "
+            f"so cannot make probabilistic metrics. "
+        )
+        return empty_scores
+
+    # the latest forecast for each target time and forecast horizon, with the truth
+    if aligned_forecast_values is not None:
+        forecast_values = select_forecast_horizons(
+            aligned_forecast_values, forecast_horizons_minutes
+        )
+    else:
+        forecast_values = get_aligned_forecast_values(
+            datetime_interval=datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+        )
+    forecast_values = expand_plevels(forecast_values, plevels=plevels)
+
+    if len(forecast_values) == 0:
+        logger.warning(
+            f"No overlapping forecast values and gsp yields for {model_name=}, "
+            f"so cannot make probabilistic metrics. "
+        )
+        return empty_scores
+
+    horizons = forecast_values.forecast_horizon_minutes.to_numpy(dtype="int64")
+    truth = forecast_values.solar_generation_kw.to_numpy(dtype="float64") / 1000
+    plevel_values = forecast_values[plevels].to_numpy(dtype="float64")
+
+    quantile_scores = get_quantile_scores(horizons, truth, plevel_values, plevels)
+    interval_scores = get_interval_scores(horizons, truth, plevel_values, plevels)
+
+    # save to database
+    location = get_location(gsp_id=0, session=session)
+    scores_to_save = [
+        (quantile_scores, "pinball", pinball),
+        (quantile_scores, "exceedance", exceedance),
+        (interval_scores, "coverage", interval_coverage),
+        (interval_scores, "width", interval_width),
+    ]
+    for scores, column, metric in scores_to_save:
+        for (forecast_horizon_minutes, plevel), row in scores.iterrows():
+            value = None if np.isnan(row[column]) else float(row[column])
+            save_metric_value_to_database(
+                session=session,
+                value=value,
+                number_of_data_points=int(row.number_of_data_points),
+                datetime_interval=datetime_interval,
+                metric=metric,
+                location=location,
+                model_name=model_name,
+                plevel=float(plevel),
+                forecast_horizon_minutes=int(forecast_horizon_minutes),
+                metric_value_writer=metric_value_writer,
+            )
+
+    return quantile_scores, interval_scores
+
 
 def make_probabilistic_metrics_one_forecast_horizon_minutes(
     session,
@@ -49,6 +318,7 @@ def make_probabilistic_metrics_one_forecast_horizon_minutes(
     p_level: str,
     forecast_values: pd.DataFrame,
     gsp_yields: pd.DataFrame,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ):
     """Make probabilistic metrics for one forecast horizon minutes
 
@@ -58,6 +328,7 @@ def make_probabilistic_metrics_one_forecast_horizon_minutes(
     datetime_interval: datetime interval to look at
     forecast_horizon_minutes: forecast horizon minutes to look at
     p_level: p levels to look at
+    metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     """
 
     logger.info(
@@ -111,23 +382,32 @@ def make_probabilistic_metrics_one_forecast_horizon_minutes(
         )
         return []
 
-    # change json column 'properties' to seperate columns
-    forecast_values = forecast_values.copy()
-    forecast_values = forecast_values.join(
-        forecast_values.properties.apply(pd.Series),
-        rsuffix="_properties",
-    )
+    # change json column 'properties' to seperate columns,
+    # unless the plevels have already been expanded when loading the forecast values
+    if p_level not in forecast_values.columns:
+        forecast_values = forecast_values.copy()
+        forecast_values = forecast_values.join(
+            forecast_values.properties.apply(pd.Series),
+            rsuffix="_properties",
+        )
 
-    forecast_values_under = forecast_values[
-            forecast_values[p_level]
-            <forecast_values.solar_generation_kw / 1000
-    ]
-    forecast_values_over = forecast_values[
-            forecast_values[p_level]
-            > forecast_values.solar_generation_kw / 1000
-    ]
-    under_average =  (forecast_values_under.solar_generation_kw / 1000 - forecast_values_under[p_level]).mean()
-    over_average = (forecast_values_over[p_level] - forecast_values_over.solar_generation_kw / 1000).mean()
+    if p_level not in forecast_values.columns:
+        logger.warning(
+            f"No {p_level=} in forecast values for {model_name=} {forecast_horizon_minutes=}, "
+            f"so cannot make pinball and exceedance metrics. "
+        )
+        return []
+
+    # the errors are in float64, even though the forecast values are stored as float32
+    forecast = forecast_values[p_level].astype("float64")
+    truth = forecast_values.solar_generation_kw.astype("float64") / 1000
+
+    under = forecast < truth
+    over = forecast > truth
+    forecast_values_under = forecast_values[under]
+    forecast_values_over = forecast_values[over]
+    under_average = (truth[under] - forecast[under]).mean()
+    over_average = (forecast[over] - truth[over]).mean()
 
     if np.isnan(under_average):
         under_average = 0
@@ -187,6 +467,7 @@ def make_probabilistic_metrics_one_forecast_horizon_minutes(
         model_name=model_name,
         plevel=float(p_level),
         forecast_horizon_minutes=forecast_horizon_minutes,
+        metric_value_writer=metric_value_writer,
     )
 
     # save to database
@@ -200,6 +481,7 @@ def make_probabilistic_metrics_one_forecast_horizon_minutes(
         model_name=model_name,
         plevel=float(p_level),
         forecast_horizon_minutes=forecast_horizon_minutes,
+        metric_value_writer=metric_value_writer,
     )
 
     return exceedance_value, pinball_value, number_of_data_points
@@ -211,37 +493,49 @@ def make_probabilistic(
     all_forecast_values: dict,
     gsp_yields: pd.DataFrame,
     max_forecast_horizon_minutes: Optional[Dict[str, int]] = None,
+    plevels: Optional[list[str]] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    all_aligned_forecast_values: Optional[dict] = None,
+    model_names: Optional[list[str]] = None,
 ):
     """
-    Make make_probabilistic for all models and forecast horizons
+    Make make_probabilistic for all models, forecast horizons and p levels
 
     :param session: database session
     :param datetime_interval: datetime interval
     :param max_forecast_horizon_minutes: max forecast horizon minutes for each model.
+    :param plevels: the p levels to look at. If None, all the p levels in the forecast are used
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param all_aligned_forecast_values: optional aligned forecast values for each model,
+        from 'get_all_aligned_forecast_values'
+    :param model_names: optional model names to make the metrics for,
+        default is all the probabilistic models
     :return: None
     """
 
     if max_forecast_horizon_minutes is None:
         max_forecast_horizon_minutes = default_max_forecast_horizon_minutes
 
-    for model_name in default_probabilistic_models:
+    if all_aligned_forecast_values is None:
+        all_aligned_forecast_values = {}
+
+    if model_names is None:
+        model_names = default_probabilistic_models
+
+    for model_name in model_names:
 
         if model_name not in all_forecast_values:
             logger.warning(f"No forecast values for model {model_name} for pinball and exceedance, skipping...")
             continue
 
-        for forecast_horizon_minute in get_forecast_range(max_forecast_horizon_minutes[model_name]):
-
-            forecast_values_df = all_forecast_values[model_name]
-
-            for p_level in ["10", "90"]:
-
-                make_probabilistic_metrics_one_forecast_horizon_minutes(
-                    session=session,
-                    model_name=model_name,
-                    datetime_interval=datetime_interval,
-                    forecast_horizon_minutes=forecast_horizon_minute,
-                    p_level=p_level,
-                    forecast_values=forecast_values_df,
-                    gsp_yields=gsp_yields,
-                )
+        make_probabilistic_metrics_for_forecast_horizons(
+            session=session,
+            model_name=model_name,
+            datetime_interval=datetime_interval,
+            forecast_horizons_minutes=get_forecast_range(max_forecast_horizon_minutes[model_name]),
+            forecast_values=all_forecast_values[model_name],
+            gsp_yields=gsp_yields,
+            plevels=plevels,
+            metric_value_writer=metric_value_writer,
+            aligned_forecast_values=all_aligned_forecast_values.get(model_name),
+        )
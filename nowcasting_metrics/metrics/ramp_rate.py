@@ -1,5 +1,6 @@
 import logging
 from datetime import timezone
+from typing import Optional
 
 import pandas as pd
 import numpy as np
@@ -7,11 +8,14 @@ from nowcasting_datamodel.models import (
     DatetimeInterval,
     Metric,
 )
-from nowcasting_datamodel.read.read import get_location
 from sqlalchemy.orm.session import Session
 
-from nowcasting_metrics.metrics.utils import default_national_models
-from nowcasting_metrics.utils import save_metric_value_to_database
+from nowcasting_metrics.database.lookup import get_location
+from nowcasting_metrics.metrics.utils import (
+    default_national_models,
+    get_latest_forecast_values_for_forecast_horizons,
+)
+from nowcasting_metrics.utils import MetricValueWriter, save_metric_value_to_database
 
 logger = logging.getLogger(__name__)
 
@@ -24,42 +28,61 @@ ramp_rate = Metric(
 )
 
 
-def make_ramp_rate_one_forecast_horizon_minutes(
+def make_ramp_rate_values_for_forecast_horizons(
     session,
     model_name: str,
     datetime_interval: DatetimeInterval,
-    forecast_horizon_minutes: int,
+    forecast_horizons_minutes: list[int],
     ramp_rate_minutes: int,
     forecast_values: pd.DataFrame,
     gsp_yields: pd.DataFrame,
-):
-    """Calculate one ramp rate metric for a given forecast horizon"""
+    metric_value_writer: Optional[MetricValueWriter] = None,
+) -> pd.DataFrame:
+    """
+    Calculate the ramp rate metric for several forecast horizons in one pass, and save to database
+
+    Each forecast value at t is paired with the forecast value at t + ramp_rate_minutes from the
+    same forecast run (the same created_utc). This is a one-to-one merge, so the memory used is
+    bounded by the size of the forecast values. The latest forecast run for each target time
+    and forecast horizon is then found for all the forecast horizons together.
+
+    :param session: database session
+    :param model_name: the model name of the forecast
+    :param datetime_interval: datetime interval
+    :param forecast_horizons_minutes: the forecast horizons
+    :param ramp_rate_minutes: the ramp rate period, normally 60 minutes
+    :param forecast_values: the forecast values for the last seven days
+    :param gsp_yields: the GSP yields for the last seven days
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :return: dataframe with index forecast_horizon_minutes and columns
+        value and number_of_data_points
+    """
 
     start_datetime_utc = datetime_interval.start_datetime_utc.replace(tzinfo=timezone.utc)
     end_datetime_utc = datetime_interval.end_datetime_utc.replace(tzinfo=timezone.utc)
 
-    if len(forecast_values) == 0:
-        logger.warning(
-            f"Forecast values are empty for {model_name=}"
-        )
-        return ()
-
     gsp_yields = gsp_yields[gsp_yields.index >= start_datetime_utc]
     gsp_yields = gsp_yields[gsp_yields.index <= end_datetime_utc]
 
-    forecast_values = forecast_values.copy()
     forecast_values = forecast_values[forecast_values.index >= start_datetime_utc]
     forecast_values = forecast_values[forecast_values.index <= end_datetime_utc]
+    forecast_values = forecast_values[["created_utc", "expected_power_generation_megawatts"]]
 
-    # using ramp_rate_minutes, lets shift the index back by ramp_rate_minutes, and then join
+    # pair each forecast value with the value ramp_rate_minutes later from the same forecast run
+    index_name = forecast_values.index.name or "target_time"
+    forecast_values = forecast_values.rename_axis(index_name).reset_index()
     forecast_values_ramp = forecast_values.copy()
-    forecast_values_ramp.index = forecast_values_ramp.index - pd.Timedelta(minutes=ramp_rate_minutes)
-    forecast_values = forecast_values.join(
+    forecast_values_ramp[index_name] = forecast_values_ramp[index_name] - pd.Timedelta(
+        minutes=ramp_rate_minutes
+    )
+    forecast_values = forecast_values.merge(
         forecast_values_ramp,
+        on=[index_name, "created_utc"],
         how="inner",
-        rsuffix="_ramp",
-    )
-    # and lets do the same for gsp_yields
+        suffixes=("", "_ramp"),
+    ).set_index(index_name)
+
+    # and lets do the same for gsp_yields, these only have one value per timestamp
     gsp_yields_ramp = gsp_yields.copy()
     gsp_yields_ramp.index = gsp_yields_ramp.index - pd.Timedelta(minutes=ramp_rate_minutes)
     gsp_yields = gsp_yields.join(
@@ -68,49 +91,92 @@ def make_ramp_rate_one_forecast_horizon_minutes(
         rsuffix="_ramp",
     )
 
-    if forecast_horizon_minutes is not None:
-        forecast_values = forecast_values[
-            forecast_values.index
-            > forecast_values.created_utc + pd.Timedelta(minutes=forecast_horizon_minutes)
-            ]
-
-    # take first forecast value for each index, this is becasue they are order by created_utc descing.
-    # this means we get the latest forecast for a given forecast_horizon_minutes
-    forecast_values = forecast_values.groupby(forecast_values.index).first()
+    # get the latest forecast run for each target time and forecast horizon
+    forecast_values = get_latest_forecast_values_for_forecast_horizons(
+        forecast_values=forecast_values, forecast_horizons_minutes=forecast_horizons_minutes
+    )
     forecast_values = forecast_values.join(gsp_yields, how="inner", rsuffix="_forecast")
 
     # calculate the ramp rate
     forecast_values["ramp_rate"] = (
-            forecast_values.expected_power_generation_megawatts
-            - forecast_values.expected_power_generation_megawatts_ramp
-            - forecast_values.solar_generation_kw / 1000
-            + forecast_values.solar_generation_kw_ramp / 1000
+        forecast_values.expected_power_generation_megawatts.astype("float64")
+        - forecast_values.expected_power_generation_megawatts_ramp.astype("float64")
+        - forecast_values.solar_generation_kw.astype("float64") / 1000
+        + forecast_values.solar_generation_kw_ramp.astype("float64") / 1000
     ).abs()
 
-    value = float(forecast_values["ramp_rate"].mean())
-    number_of_data_points = len(forecast_values)
+    ramp_rates = forecast_values.groupby("forecast_horizon_minutes")["ramp_rate"]
+    results_df = pd.DataFrame(
+        {"value": ramp_rates.mean(), "number_of_data_points": ramp_rates.size()}
+    )
+    results_df = results_df.reindex(
+        pd.Index(forecast_horizons_minutes, name="forecast_horizon_minutes")
+    )
+    results_df["number_of_data_points"] = results_df["number_of_data_points"].fillna(0)
 
-    if np.isnan(value):
-        value = None
+    location = get_location(gsp_id=0, session=session)
 
-    logger.debug(
-        f"Found Ramp Rate of {value} from {number_of_data_points} data points"
-        f" for {forecast_horizon_minutes=} for gsp_id=0. {model_name=}"
-    )
+    for forecast_horizon_minutes, result in results_df.iterrows():
+        value = None if np.isnan(result.value) else float(result.value)
+        number_of_data_points = int(result.number_of_data_points)
+
+        logger.debug(
+            f"Found Ramp Rate of {value} from {number_of_data_points} data points"
+            f" for {forecast_horizon_minutes=} for gsp_id=0. {model_name=}"
+        )
 
-    # save to database
-    save_metric_value_to_database(
+        # save to database
+        save_metric_value_to_database(
+            session=session,
+            value=value,
+            number_of_data_points=number_of_data_points,
+            datetime_interval=datetime_interval,
+            metric=ramp_rate,
+            location=location,
+            model_name=model_name,
+            forecast_horizon_minutes=int(forecast_horizon_minutes),
+            metric_value_writer=metric_value_writer,
+        )
+
+    return results_df
+
+
+def make_ramp_rate_one_forecast_horizon_minutes(
+    session,
+    model_name: str,
+    datetime_interval: DatetimeInterval,
+    forecast_horizon_minutes: int,
+    ramp_rate_minutes: int,
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+):
+    """Calculate one ramp rate metric for a given forecast horizon
+
+    Set metric_value_writer to collect the metric value, so it is saved in one bulk insert.
+    """
+
+    if len(forecast_values) == 0:
+        logger.warning(
+            f"Forecast values are empty for {model_name=}"
+        )
+        return ()
+
+    results_df = make_ramp_rate_values_for_forecast_horizons(
         session=session,
-        value=value,
-        number_of_data_points=number_of_data_points,
-        datetime_interval=datetime_interval,
-        metric=ramp_rate,
-        location=get_location(gsp_id=0, session=session),
         model_name=model_name,
-        forecast_horizon_minutes=forecast_horizon_minutes,
+        datetime_interval=datetime_interval,
+        forecast_horizons_minutes=[forecast_horizon_minutes],
+        ramp_rate_minutes=ramp_rate_minutes,
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields,
+        metric_value_writer=metric_value_writer,
     )
 
-    return value, number_of_data_points
+    result = results_df.iloc[0]
+    value = None if np.isnan(result.value) else float(result.value)
+
+    return value, int(result.number_of_data_points)
 
 
 def make_ramp_rate(
@@ -118,6 +184,8 @@ def make_ramp_rate(
     datetime_interval: DatetimeInterval,
     all_forecast_values: dict,
     gsp_yields: pd.DataFrame,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    model_names: Optional[list[str]] = None,
 ):
     """
     Make ramp rate for all models and forecast horizons
@@ -126,24 +194,37 @@ def make_ramp_rate(
     :param datetime_interval: datetime interval
     :param all_forecast_values: all forecast values for the last seven days
     :param gsp_yields: the GSP yields for the last seven days
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param model_names: optional model names to make the ramp rate for,
+        default is all the national models
     :return: None
     """
+    if model_names is None:
+        model_names = default_national_models
+
     forecast_horizon_hours = [0, 1, 2]
-    for forecast_horizon_hour in forecast_horizon_hours:
-        for model_name in default_national_models:
-
-            if model_name not in all_forecast_values:
-                logger.warning(f"No forecast values for model {model_name} for me, skipping...")
-                continue
-
-            forecast_values_df = all_forecast_values[model_name]
-
-            make_ramp_rate_one_forecast_horizon_minutes(
-                session=session,
-                model_name=model_name,
-                datetime_interval=datetime_interval,
-                forecast_horizon_minutes=forecast_horizon_hour*60,
-                ramp_rate_minutes=60,
-                forecast_values=forecast_values_df,
-                gsp_yields=gsp_yields,
-            )
+    for model_name in model_names:
+
+        if model_name not in all_forecast_values:
+            logger.warning(f"No forecast values for model {model_name} for me, skipping...")
+            continue
+
+        forecast_values_df = all_forecast_values[model_name]
+
+        if len(forecast_values_df) == 0:
+            logger.warning(f"Forecast values are empty for {model_name=}")
+            continue
+
+        # all the forecast horizons are done together
+        make_ramp_rate_values_for_forecast_horizons(
+            session=session,
+            model_name=model_name,
+            datetime_interval=datetime_interval,
+            forecast_horizons_minutes=[
+                forecast_horizon_hour * 60 for forecast_horizon_hour in forecast_horizon_hours
+            ],
+            ramp_rate_minutes=60,
+            forecast_values=forecast_values_df,
+            gsp_yields=gsp_yields,
+            metric_value_writer=metric_value_writer,
+        )
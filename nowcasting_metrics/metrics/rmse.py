@@ -3,24 +3,31 @@ import logging
 import os
 from typing import Optional, Union
 
+import numpy as np
+import pandas as pd
 from nowcasting_datamodel import N_GSP
 from nowcasting_datamodel.models import ForecastValueLatestSQL, ForecastValueSevenDaysSQL, Metric, MLModelSQL
 from nowcasting_datamodel.models.gsp import GSPYieldSQL, LocationSQL
 from nowcasting_datamodel.models.metric import DatetimeInterval
-from nowcasting_datamodel.read.read import get_location
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql import func
 
+from nowcasting_metrics.database.lookup import get_location, get_locations
+from nowcasting_metrics.database.gsp_yield import get_pvlive_yields
 from nowcasting_metrics.metrics.utils import (
     default_max_forecast_horizon_minutes,
     default_gsp_models,
     default_national_models,
     filter_query_on_datetime_interval,
     make_forecast_sub_query,
+    get_aligned_forecast_values,
+    get_forecast_range,
+    get_pvlive_errors,
     make_gsp_sub_query,
     make_pvlive_subquery,
+    select_forecast_horizons,
 )
-from nowcasting_metrics.utils import save_metric_value_to_database
+from nowcasting_metrics.utils import MetricValueWriter, save_metric_value_to_database
 
 logger = logging.getLogger(__name__)
 
@@ -55,7 +62,10 @@ pvlive_rmse = Metric(
 
 
 def make_pvlive_rmse(
-    session: Session, datetime_interval: DatetimeInterval, gsp_id: int
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    gsp_id: int,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ) -> (int, int):
     """
     Calculate RMSE for the PV Live initial and updates estimate
@@ -63,6 +73,7 @@ def make_pvlive_rmse(
     :param session: database sessions
     :param datetime_interval: datetime interval
     :param gsp_id: the gsp id
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return:  1. the RMSE, 2. the number of data points
     """
 
@@ -106,11 +117,166 @@ def make_pvlive_rmse(
         datetime_interval=datetime_interval,
         metric=pvlive_rmse,
         location=get_location(gsp_id=gsp_id, session=session),
+        metric_value_writer=metric_value_writer,
     )
 
     return value, number_of_data_points
 
 
+def make_pvlive_rmse_gsps(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    pvlive_yields: pd.DataFrame,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+) -> pd.DataFrame:
+    """
+    Calculate RMSE for the PV Live initial and updates estimate, for all gsps at once
+
+    :param session: database sessions
+    :param datetime_interval: datetime interval
+    :param pvlive_yields: the in-day and day-after yields for all gsps, from 'get_pvlive_yields'
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :return: dataframe with index gsp_id and columns mae, rmse and number_of_data_points
+    """
+
+    pvlive_errors = get_pvlive_errors(pvlive_yields=pvlive_yields)
+    locations = get_locations(session=session, gsp_ids=pvlive_errors.index)
+
+    for gsp_id, pvlive_error in pvlive_errors.iterrows():
+        value = None if pd.isna(pvlive_error.rmse) else float(pvlive_error.rmse)
+        number_of_data_points = int(pvlive_error.number_of_data_points)
+
+        logger.debug(
+            f"Found PVlive RMSE of {value} from {number_of_data_points} "
+            f"data points for {gsp_id=}."
+        )
+
+        save_metric_value_to_database(
+            session=session,
+            value=value,
+            number_of_data_points=number_of_data_points,
+            datetime_interval=datetime_interval,
+            metric=pvlive_rmse,
+            location=locations[gsp_id],
+            metric_value_writer=metric_value_writer,
+        )
+
+    return pvlive_errors
+
+
+def make_rmse_values_for_forecast_horizons(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    forecast_horizons_minutes: list[Optional[int]],
+    metric: Optional[Metric] = latest_rmse,
+    model_name: Optional[str] = None,
+    use_adjuster: bool = True,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    aligned_forecast_values: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    Calculate the RMSE for several forecast horizons from the loaded forecast values
+
+    This is the in memory version of 'make_rmse_one_gsp_with_forecast_horizon', for the national
+    forecast. All the forecast horizons are done in one pass.
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param forecast_values: the forecast values for the last seven days
+    :param gsp_yields: the national GSP yields for the last seven days
+    :param forecast_horizons_minutes: the forecast horizons, None means no forecast horizon
+    :param metric: the metric to use. If None, only the RMSE with adjuster is saved
+    :param model_name: the model name of the forecast. This is optional.
+    :param use_adjuster: option to save the RMSE with adjuster too
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param aligned_forecast_values: optional aligned forecast values, from
+        'get_aligned_forecast_values'. If given, these are used rather than forecast_values
+    :return: dataframe with index forecast_horizon_minutes and columns
+        value, value_adjuster and number_of_data_points
+    """
+
+    logger.debug(
+        f"Calculating RMSE for {model_name=} for {len(forecast_horizons_minutes)} forecast horizons"
+    )
+
+    if aligned_forecast_values is not None:
+        aligned_forecast_values = select_forecast_horizons(
+            aligned_forecast_values, forecast_horizons_minutes
+        )
+    else:
+        aligned_forecast_values = get_aligned_forecast_values(
+            datetime_interval=datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+        )
+
+    # the errors are in float64, even though the forecast values are stored as float32
+    forecast = aligned_forecast_values.expected_power_generation_megawatts.astype("float64")
+    adjust_mw = aligned_forecast_values.adjust_mw.astype("float64")
+    truth = aligned_forecast_values.solar_generation_kw.astype("float64") / 1000
+    errors = pd.DataFrame(
+        {
+            "squared_error": (forecast - truth) ** 2,
+            "squared_error_adjuster": (forecast - adjust_mw - truth) ** 2,
+            "forecast_horizon_minutes": aligned_forecast_values.forecast_horizon_minutes,
+        }
+    )
+    errors = errors.groupby("forecast_horizon_minutes", dropna=False)
+    results_df = pd.DataFrame(
+        {
+            "value": np.sqrt(errors["squared_error"].mean()),
+            "value_adjuster": np.sqrt(errors["squared_error_adjuster"].mean()),
+            "number_of_data_points": errors["squared_error"].count(),
+        }
+    )
+
+    location = get_location(gsp_id=0, session=session)
+
+    for forecast_horizon_minutes, result in results_df.iterrows():
+        forecast_horizon_minutes = (
+            None if pd.isna(forecast_horizon_minutes) else int(forecast_horizon_minutes)
+        )
+        value = None if np.isnan(result.value) else float(result.value)
+        value_adjuster = None if np.isnan(result.value_adjuster) else float(result.value_adjuster)
+        number_of_data_points = int(result.number_of_data_points)
+
+        logger.debug(
+            f"Found RMSE of {value} (adjuster {value_adjuster}) from {number_of_data_points} "
+            f"data points for {forecast_horizon_minutes=} for {model_name=}."
+        )
+
+        if metric is not None:
+            save_metric_value_to_database(
+                session=session,
+                value=value,
+                number_of_data_points=number_of_data_points,
+                datetime_interval=datetime_interval,
+                metric=metric,
+                location=location,
+                forecast_horizon_minutes=forecast_horizon_minutes,
+                model_name=model_name,
+                metric_value_writer=metric_value_writer,
+            )
+
+        if use_adjuster:
+            save_metric_value_to_database(
+                session=session,
+                value=value_adjuster,
+                number_of_data_points=number_of_data_points,
+                datetime_interval=datetime_interval,
+                metric=latest_rmse_with_adjuster,
+                location=location,
+                forecast_horizon_minutes=forecast_horizon_minutes,
+                model_name=model_name,
+                metric_value_writer=metric_value_writer,
+            )
+
+    return results_df
+
+
 def make_rmse_one_gsp_with_forecast_horizon(
     session: Session,
     datetime_interval: DatetimeInterval,
@@ -119,6 +285,7 @@ def make_rmse_one_gsp_with_forecast_horizon(
     use_adjuster: Optional[bool] = False,
     metric: Optional[Metric] = latest_rmse,
     model_name: Optional[str] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ) -> (int, int):
     """
     Calculate the RMSE for one GSP for a forecast horizon, and save to database
@@ -129,6 +296,7 @@ def make_rmse_one_gsp_with_forecast_horizon(
     :param forecast_horizon_minutes: the forecast horizon ie. Use results from forecast that are
         made 60 minutes before target time
     :param model_name: the model name of the forecast. This is optional.
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return: 1. the MAE, 2. the number of data points
     """
 
@@ -164,7 +332,8 @@ def make_rmse_one_gsp_with_forecast_horizon(
         metric=metric,
         location=get_location(gsp_id=gsp_id, session=session),
         forecast_horizon_minutes=forecast_horizon_minutes,
-        model_name=model_name
+        model_name=model_name,
+        metric_value_writer=metric_value_writer,
     )
 
     return value, number_of_data_points
@@ -177,6 +346,7 @@ def make_rmse_one_gsp(
     use_adjuster: Optional[bool] = False,
     metric: Optional[Metric] = latest_rmse,
     model_name: Optional[str] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ) -> ():
     """
     Calculate the RMSE for one GSP, and save to database
@@ -187,6 +357,7 @@ def make_rmse_one_gsp(
     :param use_adjuster: whether to use the adjuster or not
     :param metric: the metric to use
     :param model_name: the model name of the forecast. This is optional.
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return: 1. the MAE, 2. the number of data points
     """
 
@@ -226,19 +397,65 @@ def make_rmse_one_gsp(
         datetime_interval=datetime_interval,
         metric=metric,
         location=get_location(gsp_id=gsp_id, session=session),
-        model_name=model_name
+        model_name=model_name,
+        metric_value_writer=metric_value_writer,
     )
 
     return value, number_of_data_points
 
 
-def make_rmse_all_gsp(session: Session, datetime_interval: DatetimeInterval, model_name: Optional[str] = None,):
+def make_rmse_gsps(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    gsp_errors: pd.DataFrame,
+    metric: Optional[Metric] = latest_rmse,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+):
+    """
+    Save the RMSE for each GSP and model, from the grouped errors
+
+    :param session: database session
+    :param datetime_interval: datetime interval
+    :param gsp_errors: the errors for each gsp and model, from 'get_gsp_errors'
+    :param metric: the metric to use
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    """
+
+    locations = get_locations(session=session, gsp_ids=gsp_errors.gsp_id.unique())
+
+    for gsp_error in gsp_errors.itertuples():
+        value = None if pd.isna(gsp_error.rmse) else float(gsp_error.rmse)
+
+        logger.debug(
+            f"Found RMSE of {value} from {gsp_error.number_of_data_points} data points "
+            f"for gsp_id={gsp_error.gsp_id} for model_name={gsp_error.model_name}."
+        )
+
+        save_metric_value_to_database(
+            session=session,
+            value=value,
+            number_of_data_points=int(gsp_error.number_of_data_points),
+            datetime_interval=datetime_interval,
+            metric=metric,
+            location=locations[gsp_error.gsp_id],
+            model_name=gsp_error.model_name,
+            metric_value_writer=metric_value_writer,
+        )
+
+
+def make_rmse_all_gsp(
+    session: Session,
+    datetime_interval: DatetimeInterval,
+    model_name: Optional[str] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+):
     """
     Calculate the RMSE for all GSP (not national), and save to database
 
     :param session: database session
     :param datetime_interval: datetime interbal
     :param model_name: the model name of the forecast. This is optional.
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
     :return: 1. the MAE, 2. the number of data points
     """
 
@@ -281,7 +498,8 @@ def make_rmse_all_gsp(session: Session, datetime_interval: DatetimeInterval, mod
         number_of_data_points=number_of_data_points,
         datetime_interval=datetime_interval,
         metric=rmse_all_gsps,
-        model_name=model_name
+        model_name=model_name,
+        metric_value_writer=metric_value_writer,
     )
 
     return value, number_of_data_points
@@ -323,6 +541,12 @@ def make_rmse(
     datetime_interval: DatetimeInterval,
     n_gsps: Optional[int] = N_GSP,
     max_forecast_horizon_minutes: Optional[dict] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
+    gsp_errors: Optional[pd.DataFrame] = None,
+    pvlive_yields: Optional[pd.DataFrame] = None,
+    all_forecast_values: Optional[dict] = None,
+    gsp_yields: Optional[pd.DataFrame] = None,
+    all_aligned_forecast_values: Optional[dict] = None,
 ):
     """
     Calculate RMSE for all GSPs
@@ -330,6 +554,17 @@ def make_rmse(
     :param session: database session
     :param datetime_interval: datetime interval
     :param n_gsps: The number of gsps (+1 for national)
+    :param metric_value_writer: optional metric value writer, see 'MetricValueWriter'
+    :param gsp_errors: optional errors for each gsp and model, from 'get_gsp_errors'.
+        If given, these are used for the RMSE of each GSP, rather than one query for each GSP
+    :param pvlive_yields: optional PVLive yields for all gsps, from 'get_pvlive_yields'.
+        These are loaded from the database if not given.
+    :param all_forecast_values: optional forecast values for the last seven days for each model.
+        If given with gsp_yields, the national RMSE is made from these, rather than one
+        query for each forecast horizon
+    :param gsp_yields: optional national GSP yields for the last seven days
+    :param all_aligned_forecast_values: optional aligned forecast values for each model,
+        from 'get_all_aligned_forecast_values'
     :param: max_forecast_horizon_minutes.
         The maximum forecast horizon we should look at, default is set below
     """
@@ -337,23 +572,77 @@ def make_rmse(
     if max_forecast_horizon_minutes is None:
         max_forecast_horizon_minutes = default_max_forecast_horizon_minutes
 
+    if all_aligned_forecast_values is None:
+        all_aligned_forecast_values = {}
+
     models = default_national_models
     if use_pvnet_gsp_sum:
         models.append("pvnet_gsp_sum")
 
     # national
     for model_name in default_national_models:
+
+        make_rmse_all_gsp(
+            session=session,
+            datetime_interval=datetime_interval,
+            model_name=model_name,
+            metric_value_writer=metric_value_writer,
+        )
+
+        # in memory, all forecast horizons in one pass
+        if all_forecast_values is not None and gsp_yields is not None:
+            if model_name not in all_forecast_values:
+                logger.warning(f"No forecast values for model {model_name} for rmse, skipping...")
+                continue
+
+            forecast_horizons_minutes = get_forecast_range(
+                max_forecast_horizon_minutes[model_name]
+            )
+            aligned_forecast_values = all_aligned_forecast_values.get(model_name)
+            if aligned_forecast_values is None:
+                aligned_forecast_values = get_aligned_forecast_values(
+                    datetime_interval=datetime_interval,
+                    forecast_values=all_forecast_values[model_name],
+                    gsp_yields=gsp_yields,
+                    forecast_horizons_minutes=[None] + forecast_horizons_minutes,
+                )
+
+            # the latest forecast, only with the adjuster
+            make_rmse_values_for_forecast_horizons(
+                session=session,
+                datetime_interval=datetime_interval,
+                forecast_values=all_forecast_values[model_name],
+                gsp_yields=gsp_yields,
+                forecast_horizons_minutes=[None],
+                metric=None,
+                model_name=model_name,
+                metric_value_writer=metric_value_writer,
+                aligned_forecast_values=aligned_forecast_values,
+            )
+
+            make_rmse_values_for_forecast_horizons(
+                session=session,
+                datetime_interval=datetime_interval,
+                forecast_values=all_forecast_values[model_name],
+                gsp_yields=gsp_yields,
+                forecast_horizons_minutes=forecast_horizons_minutes,
+                model_name=model_name,
+                metric_value_writer=metric_value_writer,
+                aligned_forecast_values=aligned_forecast_values,
+            )
+            continue
+
+        # with queries, one for each forecast horizon
         make_rmse_one_gsp(
             session=session,
             datetime_interval=datetime_interval,
             gsp_id=0,
             use_adjuster=True,
             metric=latest_rmse_with_adjuster,
-            model_name=model_name
+            model_name=model_name,
+            metric_value_writer=metric_value_writer,
         )
 
-        make_rmse_all_gsp(session=session, datetime_interval=datetime_interval, model_name=model_name)
-
         # loop over forecast horizons
         for forecast_horizon_minutes in range(0, max_forecast_horizon_minutes[model_name], 30):
             make_rmse_one_gsp_with_forecast_horizon(
@@ -362,6 +651,7 @@ def make_rmse(
                 gsp_id=0,
                 forecast_horizon_minutes=forecast_horizon_minutes,
                 model_name=model_name,
+                metric_value_writer=metric_value_writer,
             )
 
             make_rmse_one_gsp_with_forecast_horizon(
@@ -372,13 +662,38 @@ def make_rmse(
                 use_adjuster=True,
                 metric=latest_rmse_with_adjuster,
                 model_name=model_name,
+                metric_value_writer=metric_value_writer,
             )
 
-    # loop over gsps
-    for model_name in default_gsp_models:
-        for gps_id in range(0, n_gsps + 1):
-            make_rmse_one_gsp(session=session, datetime_interval=datetime_interval, gsp_id=gps_id, model_name=model_name)
+    # all gsps in one go
+    if gsp_errors is not None:
+        make_rmse_gsps(
+            session=session,
+            datetime_interval=datetime_interval,
+            gsp_errors=gsp_errors[gsp_errors.model_name.isin(default_gsp_models)],
+            metric_value_writer=metric_value_writer,
+        )
+
+    # loop over gsps, one at a time
+    else:
+        for model_name in default_gsp_models:
+            for gps_id in range(0, n_gsps + 1):
+                make_rmse_one_gsp(
+                    session=session,
+                    datetime_interval=datetime_interval,
+                    gsp_id=gps_id,
+                    model_name=model_name,
+                    metric_value_writer=metric_value_writer,
+                )
 
-    # pvlive
-    for gps_id in range(0, n_gsps + 1):
-        make_pvlive_rmse(session=session, datetime_interval=datetime_interval, gsp_id=gps_id)
+    # pvlive, all gsps in one go
+    if pvlive_yields is None:
+        pvlive_yields = get_pvlive_yields(
+            session=session, datetime_interval=datetime_interval, n_gsps=n_gsps
+        )
+    make_pvlive_rmse_gsps(
+        session=session,
+        datetime_interval=datetime_interval,
+        pvlive_yields=pvlive_yields,
+        metric_value_writer=metric_value_writer,
+    )
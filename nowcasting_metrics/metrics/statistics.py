@@ -0,0 +1,315 @@
+""" Daily error statistics, which can be merged to make metrics over any window
+
+For each day, model, forecast horizon and time of day we keep
+- the sum of the errors
+- the sum of the absolute errors
+- the sum of the squared errors
+- the number of data points
+
+These are saved to one csv file for each model and day. The ME, MAE and RMSE for a window of days
+are then made by adding up the statistics of each day, rather than loading and grouping all the
+forecast values again. A day is only worked out again if it is missing or is one of the last
+'refresh_days' days of the window, which might still get new data, e.g. the PVLive day-after
+updates. Days without data are saved as empty files, so they are not worked out again.
+
+The first line of each file is a comment with the forecast horizons the day was made for. A day
+that was made for other forecast horizons is worked out again.
+
+The days are half-open, so the sample at midnight at the end of a day belongs to the next day.
+The part of the window on its last day, e.g. the sample at midnight at the end of the window, is
+worked out each time and not saved, so the window is closed, the same as without the statistics.
+Only the weekly ME uses these statistics. The daily MAE and RMSE are over one day, so there is
+nothing to merge for them.
+"""
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from nowcasting_datamodel.models.metric import DatetimeInterval
+
+from nowcasting_metrics.metrics.utils import get_aligned_forecast_values
+
+logger = logging.getLogger(__name__)
+
+statistics_columns = ["sum_error", "sum_abs_error", "sum_squared_error", "count"]
+statistics_index = ["date", "forecast_horizon_minutes", "time_of_day"]
+
+# the number of days at the end of the window that are always worked out again
+refresh_days = 2
+
+# the start of the first line of each file, followed by the forecast horizons
+forecast_horizons_header = "# forecast_horizons_minutes="
+
+
+def get_daily_error_statistics(aligned_forecast_values: pd.DataFrame) -> pd.DataFrame:
+    """
+    Get the error statistics for each day, forecast horizon and time of day
+
+    :param aligned_forecast_values: aligned forecast values, from 'get_aligned_forecast_values'
+    :return: dataframe with columns date, forecast_horizon_minutes, time_of_day,
+        sum_error, sum_abs_error, sum_squared_error and count
+    """
+    target_times = aligned_forecast_values.index
+    error = (
+        aligned_forecast_values.expected_power_generation_megawatts.to_numpy(dtype="float64")
+        - aligned_forecast_values.solar_generation_kw.to_numpy(dtype="float64") / 1000
+    )
+
+    errors = pd.DataFrame(
+        {
+            "date": target_times.date,
+            "forecast_horizon_minutes": aligned_forecast_values.forecast_horizon_minutes.to_numpy(),
+            "time_of_day": target_times.time,
+            "sum_error": error,
+            "sum_abs_error": np.abs(error),
+            "sum_squared_error": error**2,
+            "count": np.ones(len(error), dtype="int64"),
+        }
+    )
+
+    return errors.groupby(statistics_index, dropna=False, as_index=False).sum()
+
+
+def get_statistics_filename(statistics_dir: str, model_name: str, day: date) -> str:
+    """
+    Get the filename of the error statistics for one model and day
+
+    :param statistics_dir: the directory of the statistics
+    :param model_name: the model name
+    :param day: the day
+    :return: filename
+    """
+    return os.path.join(statistics_dir, model_name, f"{day.isoformat()}.csv")
+
+
+def format_forecast_horizons(forecast_horizons_minutes: list[Optional[int]]) -> str:
+    """
+    Format the forecast horizons for the first line of a statistics file
+
+    :param forecast_horizons_minutes: the forecast horizons
+    :return: the forecast horizons, separated by commas
+    """
+    return ",".join(str(forecast_horizon) for forecast_horizon in forecast_horizons_minutes)
+
+
+def get_saved_forecast_horizons(
+    statistics_dir: str, model_name: str, day: date
+) -> Optional[str]:
+    """
+    Get the forecast horizons that the error statistics for one model and day were made for
+
+    :param statistics_dir: the directory of the statistics
+    :param model_name: the model name
+    :param day: the day
+    :return: the forecast horizons, from 'format_forecast_horizons'.
+        None if there is no file, or the file has no forecast horizons
+    """
+    filename = get_statistics_filename(statistics_dir, model_name, day)
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename) as f:
+        first_line = f.readline().strip()
+
+    if not first_line.startswith(forecast_horizons_header):
+        return None
+
+    return first_line[len(forecast_horizons_header) :]
+
+
+def save_daily_error_statistics(
+    statistics: pd.DataFrame,
+    statistics_dir: str,
+    model_name: str,
+    days: Optional[list[date]] = None,
+    forecast_horizons_minutes: Optional[list[Optional[int]]] = None,
+) -> list[date]:
+    """
+    Save the error statistics, one file for each day. Files for the same day are overwritten
+
+    :param statistics: error statistics, from 'get_daily_error_statistics'
+    :param statistics_dir: the directory of the statistics
+    :param model_name: the model name
+    :param days: optional days to save. Days without statistics are saved as empty files.
+        Default is the days in the statistics
+    :param forecast_horizons_minutes: optional forecast horizons the statistics were made for,
+        saved in the first line of each file
+    :return: the days that were saved
+    """
+    os.makedirs(os.path.join(statistics_dir, model_name), exist_ok=True)
+
+    if days is None:
+        days = sorted(statistics.date.unique())
+
+    for day in days:
+        filename = get_statistics_filename(statistics_dir, model_name, day)
+        statistics_day = statistics[statistics.date == day]
+        with open(filename, "w") as f:
+            if forecast_horizons_minutes is not None:
+                f.write(
+                    f"{forecast_horizons_header}"
+                    f"{format_forecast_horizons(forecast_horizons_minutes)}\n"
+                )
+            statistics_day.drop(columns="date").to_csv(f, index=False)
+
+    logger.debug(f"Saved error statistics for {model_name=} for {len(days)} days")
+
+    return days
+
+
+def load_daily_error_statistics(
+    statistics_dir: str, model_name: str, days: list[date]
+) -> pd.DataFrame:
+    """
+    Load the error statistics for some days. Days without a file are skipped
+
+    :param statistics_dir: the directory of the statistics
+    :param model_name: the model name
+    :param days: the days to load
+    :return: error statistics, in the same format as 'get_daily_error_statistics'
+    """
+    all_statistics = []
+    for day in days:
+        filename = get_statistics_filename(statistics_dir, model_name, day)
+        if not os.path.exists(filename):
+            continue
+
+        statistics = pd.read_csv(
+            filename, comment="#", dtype={"forecast_horizon_minutes": "Int64"}
+        )
+        statistics["date"] = day
+        if len(statistics) == 0:
+            continue
+
+        statistics["time_of_day"] = [time.fromisoformat(t) for t in statistics.time_of_day]
+        all_statistics.append(statistics)
+
+    if len(all_statistics) == 0:
+        return pd.DataFrame(columns=statistics_index + statistics_columns)
+
+    return pd.concat(all_statistics, ignore_index=True)[statistics_index + statistics_columns]
+
+
+def merge_error_statistics(
+    statistics: pd.DataFrame, by: Optional[list[str]] = None
+) -> pd.DataFrame:
+    """
+    Merge error statistics, and make the ME, MAE and RMSE
+
+    :param statistics: error statistics, from 'get_daily_error_statistics'
+    :param by: the columns to keep, default is forecast_horizon_minutes and time_of_day
+    :return: dataframe with index 'by' and columns me, mae, rmse and number_of_data_points
+    """
+    if by is None:
+        by = ["forecast_horizon_minutes", "time_of_day"]
+
+    statistics = statistics.groupby(by, dropna=False)[statistics_columns].sum()
+    count = statistics["count"].replace(0, np.nan)
+
+    return pd.DataFrame(
+        {
+            "me": statistics.sum_error / count,
+            "mae": statistics.sum_abs_error / count,
+            "rmse": np.sqrt(statistics.sum_squared_error / count),
+            "number_of_data_points": statistics["count"],
+        }
+    )
+
+
+def update_daily_error_statistics(
+    statistics_dir: str,
+    model_name: str,
+    datetime_interval: DatetimeInterval,
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    forecast_horizons_minutes: list[Optional[int]],
+) -> pd.DataFrame:
+    """
+    Get the error statistics for each day in the datetime interval, only working out new days
+
+    Days that are already saved for the same forecast horizons are loaded, apart from the last
+    'refresh_days' days. The other days are worked out from the forecast values and saved,
+    including days without data. The part of the datetime interval on its last day is worked
+    out and not saved, as the day is not complete.
+
+    :param statistics_dir: the directory of the statistics
+    :param model_name: the model name
+    :param datetime_interval: datetime interval, the days are from the start to the end,
+        with the end included
+    :param forecast_values: the forecast values for the model
+    :param gsp_yields: the national gsp yields
+    :param forecast_horizons_minutes: the forecast horizons
+    :return: error statistics for each day, in the same format as 'get_daily_error_statistics'
+    """
+    start_day = datetime_interval.start_datetime_utc.date()
+    end_day = datetime_interval.end_datetime_utc.date()
+    days = [start_day + timedelta(days=i) for i in range((end_day - start_day).days)]
+
+    forecast_horizons = format_forecast_horizons(forecast_horizons_minutes)
+    new_days = []
+    for day in days:
+        filename = get_statistics_filename(statistics_dir, model_name, day)
+        if day in days[-refresh_days:] or not os.path.exists(filename):
+            new_days.append(day)
+            continue
+
+        saved_forecast_horizons = get_saved_forecast_horizons(statistics_dir, model_name, day)
+        if saved_forecast_horizons != forecast_horizons:
+            logger.warning(
+                f"Error statistics for {model_name=} on {day} were made for forecast horizons "
+                f"{saved_forecast_horizons}, not {forecast_horizons}, so will be worked out again"
+            )
+            new_days.append(day)
+    logger.debug(
+        f"Making error statistics for {model_name=} for {len(new_days)} of {len(days)} days"
+    )
+
+    if len(new_days) > 0:
+        new_datetime_interval = DatetimeInterval(
+            start_datetime_utc=datetime.combine(new_days[0], time.min),
+            end_datetime_utc=datetime.combine(new_days[-1], time.min) + timedelta(days=1),
+        )
+        aligned_forecast_values = get_aligned_forecast_values(
+            datetime_interval=new_datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+        )
+        statistics = get_daily_error_statistics(aligned_forecast_values)
+        statistics = statistics[statistics.date.isin(new_days)]
+        save_daily_error_statistics(
+            statistics=statistics,
+            statistics_dir=statistics_dir,
+            model_name=model_name,
+            days=new_days,
+            forecast_horizons_minutes=forecast_horizons_minutes,
+        )
+
+    statistics = load_daily_error_statistics(
+        statistics_dir=statistics_dir, model_name=model_name, days=days
+    )
+
+    # the part of the datetime interval on the last day, which is not saved
+    end_datetime_interval = DatetimeInterval(
+        start_datetime_utc=max(
+            datetime_interval.start_datetime_utc.replace(tzinfo=None),
+            datetime.combine(end_day, time.min),
+        ),
+        end_datetime_utc=datetime_interval.end_datetime_utc,
+    )
+    aligned_forecast_values = get_aligned_forecast_values(
+        datetime_interval=end_datetime_interval,
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields,
+        forecast_horizons_minutes=forecast_horizons_minutes,
+    )
+    end_statistics = get_daily_error_statistics(aligned_forecast_values)
+    if len(end_statistics) == 0:
+        return statistics
+    if len(statistics) == 0:
+        return end_statistics
+
+    return pd.concat([statistics, end_statistics], ignore_index=True)
@@ -1,4 +1,9 @@
 """ util functions for metrics"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+import pandas as pd
 from nowcasting_datamodel.models import (
     DatetimeInterval,
     ForecastSQL,
@@ -24,6 +29,52 @@ default_gsp_models = ["pvnet_v2", "pvnet_day_ahead"]
 default_national_models = ["pvnet_v2", "National_xg", "pvnet_day_ahead", "neso-solar-forecast"]
 default_probabilistic_models = ["pvnet_v2", "National_xg", "pvnet_day_ahead"]
 
+# the forecast value columns that each metric uses, as well as target_time.
+# 'properties' are the plevels, which only the probabilistic metrics use
+metric_forecast_value_columns = {
+    "mae": ["expected_power_generation_megawatts", "adjust_mw", "created_utc"],
+    "rmse": ["expected_power_generation_megawatts", "adjust_mw", "created_utc"],
+    "me": ["expected_power_generation_megawatts", "created_utc"],
+    "ramp_rate": ["expected_power_generation_megawatts", "created_utc"],
+    "probabilistic": ["expected_power_generation_megawatts", "created_utc", "properties"],
+}
+
+
+def get_forecast_value_columns(metric_names: list[str]) -> list[str]:
+    """
+    Get the forecast value columns that some metrics use
+
+    :param metric_names: the metric names, from 'metric_forecast_value_columns'
+    :return: list of columns
+    """
+    columns = []
+    for metric_name in metric_names:
+        columns += [c for c in metric_forecast_value_columns[metric_name] if c not in columns]
+
+    return columns
+
+
+def get_forecast_created_utc_start(
+    datetime_interval: DatetimeInterval, max_forecast_horizon_minutes: int
+) -> datetime:
+    """
+    Get the earliest created_utc of the forecasts that can be used for a datetime interval
+
+    A forecast made more than max_forecast_horizon_minutes before the start of the datetime
+    interval does not reach it. One day is added as a buffer, the same as
+    'make_forecast_sub_query'. This can be used to bound the forecast values queries, so the
+    created_utc index is used and old partitions are not scanned.
+
+    :param datetime_interval: datetime interval
+    :param max_forecast_horizon_minutes: the maximum forecast horizon of the model
+    :return: the earliest created_utc
+    """
+    return (
+        datetime_interval.start_datetime_utc
+        - timedelta(minutes=max_forecast_horizon_minutes)
+        - timedelta(days=1)
+    )
+
 
 def get_forecast_range(max_forecast_horizon_minutes) -> list[int]:
     """
@@ -43,6 +94,241 @@ def get_forecast_range(max_forecast_horizon_minutes) -> list[int]:
         return forecast_range_4 + forecast_range_ge_4
 
 
+def get_latest_forecast_values_for_forecast_horizons(
+    forecast_values: pd.DataFrame, forecast_horizons_minutes: list[Optional[int]]
+) -> pd.DataFrame:
+    """
+    Get the latest forecast value for each target time and forecast horizon
+
+    A forecast value is used for a forecast horizon if it was made more than
+    forecast_horizon_minutes before the target time. A forecast horizon of None uses
+    the latest forecast value regardless of when it was made.
+
+    The lead time (target_time - created_utc) of each forecast value is computed once, and then
+    one as-of merge finds, for every target time and forecast horizon, the forecast value with the
+    smallest lead time above the horizon, i.e. the latest forecast made before the horizon.
+    This means the cost grows with the number of forecast values, not forecast values x horizons.
+
+    :param forecast_values: forecast values with index target_time and column created_utc
+    :param forecast_horizons_minutes: list of forecast horizons, None means no forecast horizon
+    :return: dataframe with index target_time, the columns of forecast_values and
+        a 'forecast_horizon_minutes' column. This has one row for each target time and
+        forecast horizon where a forecast value was found
+    """
+
+    index_name = forecast_values.index.name or "target_time"
+    forecast_horizons_minutes = pd.array(forecast_horizons_minutes, dtype="Int64")
+
+    # the lead time of each forecast value, i.e. how long before the target time it was made
+    forecast_values = forecast_values.rename_axis(index_name).reset_index()
+    forecast_values["lead_time_minutes"] = (
+        forecast_values[index_name] - forecast_values.created_utc
+    ) / pd.Timedelta(minutes=1)
+    forecast_values = forecast_values.sort_values("lead_time_minutes", kind="stable")
+
+    # one row for each target time and forecast horizon
+    target_times = pd.Index(forecast_values[index_name].unique())
+    horizons = pd.DataFrame(
+        {
+            index_name: target_times.repeat(len(forecast_horizons_minutes)),
+            "forecast_horizon_minutes": forecast_horizons_minutes.take(
+                np.tile(np.arange(len(forecast_horizons_minutes)), len(target_times))
+            ),
+        }
+    )
+    # no forecast horizon means any lead time can be used
+    horizons["lead_time_minutes"] = (
+        horizons.forecast_horizon_minutes.astype("float64").fillna(-np.inf)
+    )
+    horizons = horizons.sort_values("lead_time_minutes", kind="stable")
+
+    # for each target time, take the forecast value with the smallest lead time
+    # that is strictly larger than the forecast horizon
+    latest_forecast_values = pd.merge_asof(
+        horizons,
+        forecast_values,
+        on="lead_time_minutes",
+        by=index_name,
+        direction="forward",
+        allow_exact_matches=False,
+    )
+    latest_forecast_values = latest_forecast_values[latest_forecast_values.created_utc.notna()]
+    latest_forecast_values = latest_forecast_values.drop(columns="lead_time_minutes")
+    latest_forecast_values = latest_forecast_values.sort_values(
+        [index_name, "forecast_horizon_minutes"], kind="stable"
+    )
+
+    return latest_forecast_values.set_index(index_name)
+
+
+def slice_on_datetime_interval(
+    df: pd.DataFrame, datetime_interval: DatetimeInterval
+) -> pd.DataFrame:
+    """
+    Get the rows of a dataframe, sorted by a datetime index, in a datetime interval
+
+    The start and end are both included, the same as 'get_aligned_forecast_values'.
+    This is a positional slice, so the rows are not copied.
+
+    :param df: dataframe with a sorted datetime index in UTC
+    :param datetime_interval: datetime interval
+    :return: the rows of df in the datetime interval
+    """
+    start_datetime_utc = datetime_interval.start_datetime_utc.replace(tzinfo=timezone.utc)
+    end_datetime_utc = datetime_interval.end_datetime_utc.replace(tzinfo=timezone.utc)
+
+    start = df.index.searchsorted(start_datetime_utc, side="left")
+    end = df.index.searchsorted(end_datetime_utc, side="right")
+
+    return df.iloc[start:end]
+
+
+def get_aligned_forecast_values(
+    datetime_interval: DatetimeInterval,
+    forecast_values: pd.DataFrame,
+    gsp_yields: pd.DataFrame,
+    forecast_horizons_minutes: list[Optional[int]],
+) -> pd.DataFrame:
+    """
+    Get the latest forecast for each target time and forecast horizon, joined with the truth
+
+    This is done once for each model, and then the metrics select the forecast horizons they need,
+    rather than each metric filtering, de-duplicating and joining the forecast values again.
+
+    :param datetime_interval: datetime interval, the target times are filtered on this
+    :param forecast_values: forecast values with index target_time and column created_utc
+    :param gsp_yields: gsp yields with index datetime_utc and column solar_generation_kw
+    :param forecast_horizons_minutes: list of forecast horizons, None means no forecast horizon
+    :return: dataframe with index target_time, the columns of forecast_values,
+        'forecast_horizon_minutes' and 'solar_generation_kw'. There is one row for each target
+        time and forecast horizon where a forecast value and a gsp yield were found. The forecast
+        horizons are kept in 'attrs', so 'select_forecast_horizons' can check them
+    """
+    start_datetime_utc = datetime_interval.start_datetime_utc.replace(tzinfo=timezone.utc)
+    end_datetime_utc = datetime_interval.end_datetime_utc.replace(tzinfo=timezone.utc)
+
+    gsp_yields = gsp_yields[gsp_yields.index >= start_datetime_utc]
+    gsp_yields = gsp_yields[gsp_yields.index <= end_datetime_utc]
+
+    forecast_values = forecast_values[forecast_values.index >= start_datetime_utc]
+    forecast_values = forecast_values[forecast_values.index <= end_datetime_utc]
+
+    aligned_forecast_values = get_latest_forecast_values_for_forecast_horizons(
+        forecast_values=forecast_values, forecast_horizons_minutes=forecast_horizons_minutes
+    )
+    aligned_forecast_values = aligned_forecast_values.join(
+        gsp_yields[["solar_generation_kw"]], how="inner"
+    )
+    aligned_forecast_values.attrs["forecast_horizons_minutes"] = list(forecast_horizons_minutes)
+
+    return aligned_forecast_values
+
+
+def get_all_aligned_forecast_values(
+    datetime_interval: DatetimeInterval,
+    all_forecast_values: dict,
+    gsp_yields: pd.DataFrame,
+    forecast_horizons_minutes: Optional[dict] = None,
+    max_forecast_horizon_minutes: Optional[dict] = None,
+) -> dict:
+    """
+    Get the aligned forecast values, see 'get_aligned_forecast_values', for all models
+
+    The metrics must be given the same max_forecast_horizon_minutes, otherwise
+    'select_forecast_horizons' raises an error for the forecast horizons that are missing.
+
+    :param datetime_interval: datetime interval
+    :param all_forecast_values: all forecast values, {model_name: forecast_values_df}
+    :param gsp_yields: gsp yields
+    :param forecast_horizons_minutes: the forecast horizons for each model,
+        {model_name: forecast_horizons_minutes}. The default is no forecast horizon and
+        the forecast range up to the maximum forecast horizon of the model.
+    :param max_forecast_horizon_minutes: the maximum forecast horizon for each model,
+        default is 'default_max_forecast_horizon_minutes'
+    :return: dictionary of {model_name: aligned_forecast_values}
+    """
+    if forecast_horizons_minutes is None:
+        forecast_horizons_minutes = {}
+
+    if max_forecast_horizon_minutes is None:
+        max_forecast_horizon_minutes = default_max_forecast_horizon_minutes
+
+    all_aligned_forecast_values = {}
+    for model_name, forecast_values in all_forecast_values.items():
+        model_forecast_horizons_minutes = forecast_horizons_minutes.get(model_name)
+        if model_forecast_horizons_minutes is None:
+            model_forecast_horizons_minutes = [None] + get_forecast_range(
+                max_forecast_horizon_minutes.get(model_name, 480)
+            )
+
+        all_aligned_forecast_values[model_name] = get_aligned_forecast_values(
+            datetime_interval=datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields,
+            forecast_horizons_minutes=model_forecast_horizons_minutes,
+        )
+
+    return all_aligned_forecast_values
+
+
+def select_forecast_horizons(
+    aligned_forecast_values: pd.DataFrame, forecast_horizons_minutes: list[Optional[int]]
+) -> pd.DataFrame:
+    """
+    Select some forecast horizons from the aligned forecast values
+
+    :param aligned_forecast_values: aligned forecast values, from 'get_aligned_forecast_values'
+    :param forecast_horizons_minutes: list of forecast horizons, None means no forecast horizon
+    :return: aligned forecast values for the forecast horizons
+    """
+    aligned_forecast_horizons_minutes = aligned_forecast_values.attrs.get(
+        "forecast_horizons_minutes"
+    )
+    if aligned_forecast_horizons_minutes is not None:
+        missing_forecast_horizons_minutes = [
+            h for h in forecast_horizons_minutes if h not in aligned_forecast_horizons_minutes
+        ]
+        if len(missing_forecast_horizons_minutes) > 0:
+            raise ValueError(
+                f"The aligned forecast values were not made for the forecast horizons "
+                f"{missing_forecast_horizons_minutes}, so these can not be selected. "
+                f"Use the same max_forecast_horizon_minutes for the aligned forecast values "
+                f"and the metrics"
+            )
+
+    horizons = aligned_forecast_values.forecast_horizon_minutes
+    mask = horizons.isin([h for h in forecast_horizons_minutes if h is not None])
+    if None in forecast_horizons_minutes:
+        mask = mask | horizons.isna()
+
+    return aligned_forecast_values[mask.to_numpy(dtype=bool)]
+
+
+def get_pvlive_errors(pvlive_yields: pd.DataFrame) -> pd.DataFrame:
+    """
+    Get the error between the PVLive in-day and day-after values, for each gsp
+
+    :param pvlive_yields: PVLive yields, from 'get_pvlive_yields'
+    :return: dataframe with index gsp_id and columns mae, rmse and number_of_data_points
+    """
+    error = (
+        pvlive_yields.day_after.to_numpy(dtype="float64") / 1000
+        - pvlive_yields.in_day.to_numpy(dtype="float64") / 1000
+    )
+    errors = pd.DataFrame(
+        {"abs_error": np.abs(error), "squared_error": error**2, "gsp_id": pvlive_yields.gsp_id}
+    ).groupby("gsp_id")
+
+    pvlive_errors = pd.DataFrame(
+        {
+            "mae": errors["abs_error"].mean(),
+            "rmse": np.sqrt(errors["squared_error"].mean()),
+            "number_of_data_points": errors["abs_error"].count(),
+        }
+    )
+    return pvlive_errors
+
+
 def filter_query_on_datetime_interval(datetime_interval: DatetimeInterval, query):
     """
     Filter the query on the datetime interval
@@ -87,20 +373,26 @@ def make_forecast_sub_query(datetime_interval, forecast_horizon_minutes, gsp_id,
         >= text(f"interval '{forecast_horizon_minutes} minute'")
     )
 
+    # The created_utc bounds are worked out here, and compared directly with the columns,
+    # so postgres can use the created_utc indexes, rather than working out an interval for each row
+    forecast_horizon = timedelta(minutes=forecast_horizon_minutes)
+
     # if the start date is 2023-02-01 and horizon is 60 minutes,
     # then we want any older forecast than 2023-01-31 23:00:00
     sub_query_forecast = sub_query_forecast.filter(
-        datetime_interval.start_datetime_utc - model.created_utc < text(f"interval '{forecast_horizon_minutes} minute'")
+        model.created_utc > datetime_interval.start_datetime_utc - forecast_horizon
+    )
+    # and the forecast must be made at least the forecast horizon before the end
+    sub_query_forecast = sub_query_forecast.filter(
+        model.created_utc <= datetime_interval.end_datetime_utc - forecast_horizon
     )
 
     # only load relative new forecasts, stops looking over all forecasts
     # if the start date is 2023-02-01 and horizon is 60 minutes,
     # then we want any forecast that is newer than 2023-02-01 00:00:00 - 60 minutes - 1 day (buffer)
-    # created_utc > start_datetime - forecast_horizon - 1 day
-    # forecast_horizon +  1 day > start_datetime - created_utc
     sub_query_forecast = sub_query_forecast.filter(
-        datetime_interval.start_datetime_utc - ForecastSQL.created_utc
-        < text(f"interval '{forecast_horizon_minutes} minute' + interval '1 day' ")
+        ForecastSQL.created_utc
+        > datetime_interval.start_datetime_utc - forecast_horizon - timedelta(days=1)
     )
     sub_query_forecast = sub_query_forecast.filter(
         model.target_time > datetime_interval.start_datetime_utc
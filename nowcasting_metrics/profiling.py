@@ -0,0 +1,155 @@
+""" Profiling of the stages of a metrics run
+
+Each stage, e.g. loading the forecast values for one model or running one metric family, records
+- the wall time
+- the number of rows in and out, set by the stage
+- the number of database queries issued
+- the peak memory (RSS) of the process so far
+
+Each stage is also a Sentry span, so the stages show up in the Sentry transaction of the run.
+The Sentry scope is not passed to worker threads, so stages in workers are given the span of
+the run as their parent.
+At the end of the run the stages can be saved to a JSON report.
+
+The queries are only counted for engines given to 'count_queries'.
+"""
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+import sentry_sdk
+from sentry_sdk.tracing import Span
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# the number of queries issued by each thread
+_query_counts = threading.local()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Engine event, to count the queries issued by the current thread"""
+    _query_counts.count = get_query_count() + 1
+
+
+def count_queries(engine: Engine):
+    """
+    Count the queries issued on an engine, for the query count of the stages
+
+    :param engine: the database engine, e.g. 'DatabaseConnection.engine'
+    """
+    if not event.contains(engine, "before_cursor_execute", _count_query):
+        event.listen(engine, "before_cursor_execute", _count_query)
+
+
+def get_query_count() -> int:
+    """Get the number of database queries issued by the current thread"""
+    return getattr(_query_counts, "count", 0)
+
+
+def get_peak_rss_mb() -> float:
+    """Get the peak resident memory of the process so far, in MB"""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # this is in bytes on mac, and kilobytes on linux
+    if sys.platform == "darwin":
+        return peak_rss / 1024**2
+    return peak_rss / 1024
+
+
+class StageProfiler:
+    """
+    Record the wall time, rows, queries and peak memory of the stages of a run
+
+    Stages can be run in several threads at once. The query count of a stage only counts the
+    queries issued by the thread the stage runs in.
+    """
+
+    def __init__(self):
+        """Make a stage profiler"""
+        self.started_utc = datetime.now(tz=timezone.utc)
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, parent_span: Optional[Span] = None, **tags):
+        """
+        Profile one stage, as a context manager
+
+        The stage is given a dictionary, where 'rows_in' and 'rows_out' can be set, e.g.
+
+            with profiler.stage("load_forecast_values", model_name=model_name) as stage:
+                forecast_values = get_forecast_values(...)
+                stage["rows_out"] = len(forecast_values)
+
+        :param name: the name of the stage
+        :param parent_span: optional parent span of the stage, e.g. for stages in worker threads.
+            Default is the current span
+        :param tags: other information about the stage, e.g. the model name
+        """
+        stage = {"name": name, **tags, "rows_in": None, "rows_out": None}
+
+        if parent_span is None:
+            span = sentry_sdk.start_span(op="metrics.stage", description=name)
+        else:
+            span = parent_span.start_child(op="metrics.stage", description=name)
+
+        with span:
+            for key, value in tags.items():
+                span.set_tag(key, value)
+
+            query_count = get_query_count()
+            start = time.perf_counter()
+            try:
+                yield stage
+            finally:
+                stage["seconds"] = time.perf_counter() - start
+                stage["queries"] = get_query_count() - query_count
+                stage["peak_rss_mb"] = get_peak_rss_mb()
+
+                for key in ["seconds", "queries", "peak_rss_mb", "rows_in", "rows_out"]:
+                    span.set_data(key, stage[key])
+
+                logger.debug(
+                    f"Stage {name} {tags} took {stage['seconds']:.2f} seconds, "
+                    f"{stage['queries']} queries, rows in {stage['rows_in']}, "
+                    f"rows out {stage['rows_out']}, peak memory {stage['peak_rss_mb']:.0f} MB"
+                )
+
+                with self._lock:
+                    self.stages.append(stage)
+
+    def report(self) -> dict:
+        """
+        Get the report of the run
+
+        :return: dictionary with the start of the run, the total time and the stages
+        """
+        with self._lock:
+            stages = list(self.stages)
+
+        return {
+            "started_utc": self.started_utc.isoformat(),
+            "seconds": (datetime.now(tz=timezone.utc) - self.started_utc).total_seconds(),
+            "peak_rss_mb": get_peak_rss_mb(),
+            "stages": stages,
+        }
+
+    def save_report(self, filename: Optional[str]):
+        """
+        Save the report of the run to a JSON file
+
+        :param filename: the filename, if None, nothing is saved
+        """
+        if filename is None:
+            return
+
+        logger.info(f"Saving profiling report to {filename}")
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2, default=str)
@@ -5,12 +5,155 @@ from typing import Optional
 
 from nowcasting_datamodel.models.gsp import LocationSQL
 from nowcasting_datamodel.models.metric import DatetimeInterval, DatetimeIntervalSQL, Metric, MetricSQL, MetricValueSQL
-from nowcasting_datamodel.read.read_metric import get_datetime_interval, get_metric
-from nowcasting_datamodel.read.read_models import get_model
+from sqlalchemy import insert
+
+from nowcasting_metrics.database.lookup import (
+    get_datetime_interval,
+    get_metric,
+    get_model,
+    get_object_id,
+)
 
 logger = logging.getLogger(__name__)
 
 
+class MetricValueWriter:
+    """
+    Collect metric values in memory and save them to the database in one bulk insert
+
+    The metric, datetime interval and model of each metric value are only looked up in the
+    database once, and then the ids are reused for all the other metric values.
+
+    The 'make_*' metric functions take an optional 'metric_value_writer'. If one is given, the
+    metric values are collected in it, otherwise each one is added to the session,
+    see 'save_metric_value_to_database'.
+    """
+
+    def __init__(self, session):
+        """
+        Make a metric value writer
+
+        :param session: database session, used for the lookups and the bulk insert
+        """
+        self.session = session
+        self.metric_values = []
+
+        self._metric_ids = {}
+        self._datetime_interval_ids = {}
+        self._model_ids = {}
+
+    def __len__(self):
+        """The number of metric values waiting to be saved"""
+        return len(self.metric_values)
+
+    def add(
+        self,
+        value: float,
+        number_of_data_points: int,
+        metric: Metric | MetricSQL,
+        datetime_interval: DatetimeInterval | DatetimeIntervalSQL,
+        location: Optional[LocationSQL] = None,
+        forecast_horizon_minutes: Optional[int] = None,
+        time_of_day: Optional[datetime.time] = None,
+        model_name: Optional[str] = None,
+        plevel: Optional[float] = None,
+    ):
+        """
+        Add one metric value, this is saved to the database when 'flush' is called
+
+        :param value: metric value
+        :param number_of_data_points: how many data points went into the metric
+        :param metric: the metric object
+        :param datetime_interval: datetime interval for the metric
+        :param location: location object of the metric value
+        :param forecast_horizon_minutes: the forecast horizon of the forecast. This is optional.
+        :param time_of_day: the time of day of the forecast. This is optional.
+        :param model_name: the model name of the forecast. This is optional.
+        :param plevel: the plevel of the forecast. This is optional.
+        """
+
+        self.metric_values.append(
+            dict(
+                value=value,
+                number_of_data_points=number_of_data_points,
+                metric_id=self.get_metric_id(metric),
+                datetime_interval_id=self.get_datetime_interval_id(datetime_interval),
+                location_id=(
+                    get_object_id(session=self.session, orm_object=location)
+                    if location is not None
+                    else None
+                ),
+                forecast_horizon_minutes=forecast_horizon_minutes,
+                time_of_day=time_of_day,
+                model_id=self.get_model_id(model_name) if model_name is not None else None,
+                p_level=plevel,
+            )
+        )
+
+    def extend(self, metric_value_writer: "MetricValueWriter"):
+        """
+        Take the metric values from another writer, so they are saved with this one
+
+        :param metric_value_writer: the other metric value writer, this is emptied
+        """
+        self.metric_values.extend(metric_value_writer.metric_values)
+        metric_value_writer.metric_values = []
+
+    def flush(self) -> int:
+        """
+        Save all the collected metric values to the database in one bulk insert
+
+        The session still needs to be committed afterwards.
+
+        :return: the number of metric values saved
+        """
+        number_of_metric_values = len(self.metric_values)
+        if number_of_metric_values == 0:
+            return 0
+
+        logger.debug(f"Saving {number_of_metric_values} metric values to the database")
+
+        # sqlalchemy batches these rows into multi-row inserts
+        self.session.execute(insert(MetricValueSQL), self.metric_values)
+        self.metric_values = []
+
+        return number_of_metric_values
+
+    def get_metric_id(self, metric: Metric | MetricSQL) -> int:
+        """Get the metric id, this is only looked up once for each metric name"""
+        if type(metric) is not Metric:
+            return get_object_id(session=self.session, orm_object=metric)
+
+        if metric.name not in self._metric_ids:
+            metric_sql = get_metric(session=self.session, name=metric.name)
+            self._metric_ids[metric.name] = metric_sql.id
+        return self._metric_ids[metric.name]
+
+    def get_datetime_interval_id(
+        self, datetime_interval: DatetimeInterval | DatetimeIntervalSQL
+    ) -> int:
+        """Get the datetime interval id, this is only looked up once for each interval"""
+        if type(datetime_interval) is not DatetimeInterval:
+            return get_object_id(session=self.session, orm_object=datetime_interval)
+
+        key = (datetime_interval.start_datetime_utc, datetime_interval.end_datetime_utc)
+        if key not in self._datetime_interval_ids:
+            datetime_interval_sql = get_datetime_interval(
+                session=self.session,
+                start_datetime_utc=datetime_interval.start_datetime_utc,
+                end_datetime_utc=datetime_interval.end_datetime_utc,
+            )
+            self._datetime_interval_ids[key] = datetime_interval_sql.id
+        return self._datetime_interval_ids[key]
+
+    def get_model_id(self, model_name: str) -> int:
+        """Get the model id, this is only looked up once for each model name"""
+        if model_name not in self._model_ids:
+            model = get_model(session=self.session, name=model_name)
+            self._model_ids[model_name] = model.id
+        return self._model_ids[model_name]
+
+
 def save_metric_value_to_database(
     session,
     value: float,
@@ -22,6 +165,7 @@ def save_metric_value_to_database(
     time_of_day: Optional[datetime.time] = None,
     model_name: Optional[str] = None,
     plevel: Optional[float] = None,
+    metric_value_writer: Optional[MetricValueWriter] = None,
 ):
     """
     Save one metric value to the database
@@ -35,6 +179,10 @@ def save_metric_value_to_database(
     :param forecast_horizon_minutes: the forecast horizon of the forecast. This is optional.
     :param time_of_day: the time of day of the forecast. This is optional.
     :param model_name: the model name of the forecast. This is optional.
+    :param plevel: the plevel of the forecast. This is optional.
+    :param metric_value_writer: optional writer to collect the metric value in, so it is saved
+        with all the others in one bulk insert when the writer is flushed. If None, the metric
+        value is added to the session
     """
 
     if value is None:
@@ -47,6 +195,19 @@ def save_metric_value_to_database(
         if location is not None:
             logger.warning(f"{location.gsp_id=}")
 
+    elif metric_value_writer is not None:
+        metric_value_writer.add(
+            value=value,
+            number_of_data_points=number_of_data_points,
+            metric=metric,
+            datetime_interval=datetime_interval,
+            location=location,
+            forecast_horizon_minutes=forecast_horizon_minutes,
+            time_of_day=time_of_day,
+            model_name=model_name,
+            plevel=plevel,
+        )
+
     else:
 
         if type(metric) is Metric:
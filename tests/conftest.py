@@ -3,13 +3,20 @@ from datetime import datetime, timedelta
 
 import pytest
 from nowcasting_datamodel.connection import DatabaseConnection
-from nowcasting_datamodel.models import ForecastSQL, ForecastValueLatestSQL, ForecastValueSevenDaysSQL, MLModelSQL
+from nowcasting_datamodel.models import (
+    ForecastSQL,
+    ForecastValueLatestSQL,
+    ForecastValueSevenDaysSQL,
+    ForecastValueSQL,
+    MLModelSQL,
+)
 from nowcasting_datamodel.models.base import Base_Forecast, Base_PV
 from nowcasting_datamodel.models.forecast import make_partitions
 from nowcasting_datamodel.models.gsp import GSPYield
 from nowcasting_datamodel.models.metric import DatetimeInterval
 from nowcasting_datamodel.read.read import get_location
 from nowcasting_datamodel.read.read_models import get_model
+from sqlalchemy import text
 
 
 @pytest.fixture
@@ -23,6 +30,15 @@ def db_connection():
     Base_PV.metadata.create_all(connection.engine)
     make_partitions(2022, 1, 2022)
 
+    # the partitions start in 2022-08, so the forecast values before then go in a default partition
+    with connection.engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS forecast_value_default "
+                "PARTITION OF forecast_value DEFAULT"
+            )
+        )
+
     yield connection
 
     connection.drop_all()
@@ -97,6 +113,38 @@ def forecast_values(db_session):
 
 
 
+@pytest.fixture
+def forecast_values_history(db_session):
+    """The national forecast values in the full history table, ForecastValueSQL"""
+    dt1 = datetime(2022, 1, 1, 0, 30)
+    dt2 = datetime(2022, 1, 1, 1)
+
+    for model_name in ["National_xg", "pvnet_v2"]:
+        model = get_model(name=model_name, session=db_session, version='0.0.1')
+        location = get_location(gsp_id=0, session=db_session)
+
+        for forecast_horizon_minutes in range(0, 240, 30):
+            forecast_values_1 = ForecastValueSQL(
+                target_time=dt1,
+                expected_power_generation_megawatts=1 + forecast_horizon_minutes,
+                created_utc=dt1 - timedelta(minutes=forecast_horizon_minutes + 15),
+            )
+            forecast_values_2 = ForecastValueSQL(
+                target_time=dt2,
+                expected_power_generation_megawatts=4 + forecast_horizon_minutes,
+                created_utc=dt2 - timedelta(minutes=forecast_horizon_minutes + 15),
+            )
+
+            forecast = ForecastSQL(
+                location=location,
+                forecast_values=[forecast_values_1, forecast_values_2],
+                model=model,
+                created_utc=dt1 - timedelta(minutes=forecast_horizon_minutes + 15),
+            )
+
+            db_session.add(forecast)
+
+
 @pytest.fixture
 def forecast_values_same_creation(db_session):
     dt1 = datetime(2022, 1, 1, 0, 30)
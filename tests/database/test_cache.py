@@ -0,0 +1,170 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+from freezegun import freeze_time
+from nowcasting_datamodel.models import ForecastSQL, ForecastValueSevenDaysSQL
+from nowcasting_datamodel.models.metric import DatetimeInterval
+from nowcasting_datamodel.read.read import get_location
+from nowcasting_datamodel.read.read_models import get_model
+
+from nowcasting_metrics.database.cache import (
+    get_cached_forecast_values,
+    get_cached_gsp_yield,
+    get_high_water_mark,
+    update_partitions,
+)
+from nowcasting_metrics.database.forecast import get_forecast_values
+from nowcasting_metrics.database.gsp_yield import get_gsp_yield
+
+
+@freeze_time("2022-01-01 02:00:00")
+def test_get_cached_forecast_values(db_session, forecast_values, tmp_path):
+    """
+    Test the cache gives the same forecast values as the database, and only gets new rows
+    """
+    db_session.commit()
+    cache_dir = str(tmp_path)
+
+    forecast_values_df = get_cached_forecast_values(
+        session=db_session, model_name="pvnet_v2", cache_dir=cache_dir
+    )
+    pd.testing.assert_frame_equal(
+        forecast_values_df, get_forecast_values(session=db_session, model_name="pvnet_v2")
+    )
+
+    partition_dir = os.path.join(
+        cache_dir,
+        "forecast_values",
+        "pvnet_v2",
+        "expected_power_generation_megawatts-adjust_mw-created_utc-properties",
+    )
+    assert sorted(os.listdir(partition_dir)) == [
+        "2021-12-31.csv",
+        "2022-01-01.csv",
+        "high_water_mark.txt",
+    ]
+    assert get_high_water_mark(partition_dir) == pd.Timestamp("2022-01-01 00:45", tz="UTC")
+
+    # add a new forecast
+    forecast_value = ForecastValueSevenDaysSQL(
+        target_time=datetime(2022, 1, 1, 1, 30),
+        expected_power_generation_megawatts=10,
+        created_utc=datetime(2022, 1, 1, 1),
+        properties={"10": 9, "90": 11},
+    )
+    db_session.add(
+        ForecastSQL(
+            location=get_location(gsp_id=0, session=db_session),
+            forecast_values_last_seven_days=[forecast_value],
+            model=get_model(name="pvnet_v2", session=db_session, version="0.0.1"),
+        )
+    )
+    db_session.commit()
+
+    forecast_values_df = get_cached_forecast_values(
+        session=db_session, model_name="pvnet_v2", cache_dir=cache_dir
+    )
+    pd.testing.assert_frame_equal(
+        forecast_values_df, get_forecast_values(session=db_session, model_name="pvnet_v2")
+    )
+    assert get_high_water_mark(partition_dir) == pd.Timestamp("2022-01-01 01:00", tz="UTC")
+
+    # only the rows made at or after the old high-water mark are loaded from the database
+    new_forecast_values = get_forecast_values(
+        session=db_session, model_name="pvnet_v2", created_utc_start=datetime(2022, 1, 1, 0, 45)
+    )
+    assert len(new_forecast_values) == 2
+
+
+@freeze_time("2022-01-03 02:00:00")
+def test_get_cached_forecast_values_columns(db_session, forecast_values, tmp_path):
+    """
+    Test the cache gives the same forecast values as the database for some columns
+
+    Only the target times in the datetime interval are given, and the lookback is from the
+    reference time of the run
+    """
+    db_session.commit()
+    kwargs = dict(
+        columns=["expected_power_generation_megawatts", "created_utc"],
+        datetime_interval=DatetimeInterval(
+            start_datetime_utc=datetime(2022, 1, 1, 1), end_datetime_utc=datetime(2022, 1, 2)
+        ),
+        max_forecast_horizon_minutes=60,
+    )
+
+    forecast_values_df = get_cached_forecast_values(
+        session=db_session,
+        model_name="pvnet_v2",
+        cache_dir=str(tmp_path),
+        lookback_days=1,
+        datetime_now=datetime(2022, 1, 1, 12),
+        **kwargs,
+    )
+    pd.testing.assert_frame_equal(
+        forecast_values_df,
+        get_forecast_values(session=db_session, model_name="pvnet_v2", **kwargs),
+    )
+    assert list(forecast_values_df.columns) == [
+        "expected_power_generation_megawatts",
+        "created_utc",
+    ]
+
+    # the cache is kept for the columns, and the lookback is from the reference time. A lookback
+    # from the wall clock would have evicted these forecast values
+    partition_dir = tmp_path / "forecast_values" / "pvnet_v2"
+    partition_dir = partition_dir / "expected_power_generation_megawatts-created_utc"
+    assert (partition_dir / "2022-01-01.csv").exists()
+
+
+@freeze_time("2022-01-01 02:00:00")
+def test_get_cached_gsp_yield(db_session, gsp_yields, tmp_path):
+    """
+    Test the cache gives the same gsp yields as the database
+    """
+    db_session.commit()
+
+    for _ in range(2):
+        gsp_yields_df = get_cached_gsp_yield(session=db_session, gsp_id=0, cache_dir=str(tmp_path))
+        pd.testing.assert_frame_equal(gsp_yields_df, get_gsp_yield(session=db_session, gsp_id=0))
+
+
+def test_update_partitions_evicts_old_partitions(tmp_path):
+    """
+    Test new rows are merged into the partitions, and partitions past the lookback are removed
+    """
+    partition_dir = str(tmp_path)
+    new_rows = pd.DataFrame(
+        {
+            "datetime_utc": pd.to_datetime(["2022-01-01 12:00", "2022-01-02 12:00"], utc=True),
+            "solar_generation_kw": [1.0, 2.0],
+            "created_utc": pd.to_datetime(["2022-01-01 13:00", "2022-01-02 13:00"], utc=True),
+        }
+    )
+    kwargs = dict(
+        partition_column="datetime_utc",
+        key_columns=["datetime_utc"],
+        timestamp_columns=["datetime_utc", "created_utc"],
+    )
+    update_partitions(partition_dir, new_rows, lookback_start=datetime(2022, 1, 1), **kwargs)
+    assert sorted(os.listdir(partition_dir)) == [
+        "2022-01-01.csv",
+        "2022-01-02.csv",
+        "high_water_mark.txt",
+    ]
+
+    # an update to a yield, a day later
+    new_rows = pd.DataFrame(
+        {
+            "datetime_utc": pd.to_datetime(["2022-01-02 12:00"], utc=True),
+            "solar_generation_kw": [3.0],
+            "created_utc": pd.to_datetime(["2022-01-03 13:00"], utc=True),
+        }
+    )
+    update_partitions(partition_dir, new_rows, lookback_start=datetime(2022, 1, 2), **kwargs)
+    assert sorted(os.listdir(partition_dir)) == ["2022-01-02.csv", "high_water_mark.txt"]
+
+    partition = pd.read_csv(os.path.join(partition_dir, "2022-01-02.csv"))
+    assert list(partition.solar_generation_kw) == [3.0]
+    assert get_high_water_mark(partition_dir) == pd.Timestamp("2022-01-03 13:00", tz="UTC")
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import numpy as np
+from freezegun import freeze_time
+from nowcasting_datamodel.models.metric import DatetimeInterval
+
+from nowcasting_metrics.database.data_plan import (
+    get_union_datetime_interval,
+    iterate_data_plan,
+    load_data_plan,
+)
+
+
+def test_get_union_datetime_interval():
+    datetime_interval = get_union_datetime_interval(
+        [
+            DatetimeInterval(
+                start_datetime_utc=datetime(2022, 1, 6), end_datetime_utc=datetime(2022, 1, 7)
+            ),
+            DatetimeInterval(
+                start_datetime_utc=datetime(2022, 1, 1), end_datetime_utc=datetime(2022, 1, 7)
+            ),
+        ]
+    )
+
+    assert datetime_interval.start_datetime_utc.date() == datetime(2022, 1, 1).date()
+    assert datetime_interval.end_datetime_utc.date() == datetime(2022, 1, 7).date()
+
+
+@freeze_time("2022-01-01 02:00:00")
+def test_load_data_plan(db_session, forecast_values, gsp_yields, datetime_interval):
+    """
+    Test the data is loaded once, and each part of the plan gets a slice of it
+    """
+    db_session.commit()
+
+    first_target_time = DatetimeInterval(
+        start_datetime_utc=datetime(2022, 1, 1), end_datetime_utc=datetime(2022, 1, 1, 0, 30)
+    )
+    data = load_data_plan(
+        session=db_session,
+        data_plan={
+            "daily": (first_target_time, None),
+            "me": (datetime_interval, None),
+        },
+    )
+
+    assert set(data) == {"daily", "me"}
+    daily_forecast_values, daily_gsp_yields = data["daily"]
+    me_forecast_values, me_gsp_yields = data["me"]
+
+    assert set(me_forecast_values) == {"National_xg", "pvnet_v2"}
+    assert len(me_forecast_values["pvnet_v2"]) == 16
+    assert len(me_gsp_yields) == 2
+
+    # only the first target time
+    assert len(daily_forecast_values["pvnet_v2"]) == 8
+    assert len(daily_gsp_yields) == 1
+
+    # the slices share the same loaded data
+    assert np.shares_memory(
+        daily_forecast_values["pvnet_v2"].expected_power_generation_megawatts.to_numpy(),
+        me_forecast_values["pvnet_v2"].expected_power_generation_megawatts.to_numpy(),
+    )
+
+
+@freeze_time("2022-01-01 02:00:00")
+def test_iterate_data_plan(db_session, forecast_values, gsp_yields, datetime_interval):
+    """
+    Test the data is loaded one model at a time, the same as loading it all at once
+    """
+    db_session.commit()
+
+    data_plan = {"me": (datetime_interval, None)}
+    data = load_data_plan(session=db_session, data_plan=data_plan)
+
+    model_names = []
+    for model_name, model_data in iterate_data_plan(
+        session=db_session, data_plan=data_plan, chunksize=5
+    ):
+        model_names.append(model_name)
+        forecast_values, gsp_yields = model_data["me"]
+
+        # only this model is loaded
+        assert list(forecast_values) == [model_name]
+        assert forecast_values[model_name].equals(data["me"][0][model_name])
+        assert gsp_yields.equals(data["me"][1])
+
+    assert sorted(model_names) == ["National_xg", "pvnet_v2"]
@@ -1,5 +1,21 @@
-from nowcasting_metrics.database.forecast import get_forecast_values, get_all_forecast_values
+from datetime import datetime
+
+import numpy as np
 from freezegun import freeze_time
+from nowcasting_datamodel.models import ForecastValueSQL
+from nowcasting_datamodel.models.metric import DatetimeInterval
+from sqlalchemy import select
+
+from nowcasting_metrics.database.forecast import (
+    get_all_forecast_values,
+    get_forecast_values,
+    get_forecast_values_chunks,
+    get_gsp_errors,
+    get_gsp_forecast_values,
+    get_plevels,
+    make_forecast_values_query,
+)
+from nowcasting_metrics.metrics.utils import get_forecast_value_columns, make_forecast_sub_query
 
 @freeze_time("2022-01-01 00:00:00")
 def test_get_forecast_values(db_session, forecast_values):
@@ -14,3 +30,228 @@ def test_get_forecast_values(db_session, forecast_values):
     # Check that the forecast values are correct
     assert len(forecast_values) == 16
 
+
+@freeze_time("2022-01-01 00:00:00")
+def test_get_forecast_values_chunks(db_session, forecast_values):
+    """
+    Test that no chunk is bigger than the chunksize, and the chunks make all the forecast values
+    """
+    db_session.commit()
+
+    chunks = list(
+        get_forecast_values_chunks(session=db_session, model_name="pvnet_v2", chunksize=5)
+    )
+
+    # 16 forecast values, in chunks of at most 5
+    assert [len(chunk) for chunk in chunks] == [5, 5, 5, 1]
+    for chunk in chunks:
+        assert chunk.expected_power_generation_megawatts.dtype == "float32"
+
+    forecast_values = get_forecast_values(session=db_session, model_name="pvnet_v2")
+    forecast_values_chunked = get_forecast_values(
+        session=db_session, model_name="pvnet_v2", chunksize=5
+    )
+    assert forecast_values_chunked.equals(forecast_values)
+
+
+def test_get_forecast_values_history(db_session, forecast_values_history):
+    """
+    Test the forecast values are loaded from the full history table, which is not
+    filtered on the last 3 weeks
+    """
+    db_session.commit()
+
+    forecast_values = get_forecast_values(
+        session=db_session, model_name="pvnet_v2", model=ForecastValueSQL
+    )
+
+    assert len(forecast_values) == 16
+
+
+def test_make_forecast_values_query(db_session):
+    """
+    Test that the forecasts are joined in the query, rather than using a list of forecast ids
+    """
+    query, _ = make_forecast_values_query(session=db_session, model_name="pvnet_v2")
+    query = str(query)
+
+    assert "JOIN forecast " in query
+    assert " IN " not in query
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_get_forecast_values_expand_plevels(db_session, forecast_values):
+    """
+    Test that the plevels in 'properties' are expanded into float32 columns
+    """
+    db_session.commit()
+
+    forecast_values_json = get_forecast_values(
+        session=db_session, model_name="pvnet_v2", expand_plevels=False
+    )
+    forecast_values = get_forecast_values(
+        session=db_session, model_name="pvnet_v2", expand_plevels=True
+    )
+
+    assert len(forecast_values) == 16
+    assert "properties" not in forecast_values.columns
+    for plevel in ["10", "90"]:
+        assert forecast_values[plevel].dtype == "float32"
+        expected = forecast_values_json.properties.apply(lambda p: p[plevel])
+        assert np.allclose(np.sort(forecast_values[plevel].values), np.sort(expected.values))
+
+
+def test_get_gsp_errors(db_session, gsp_yields, forecast_values_latest, datetime_interval):
+    """
+    Test that the errors for all gsps and models come back from one query
+    """
+    db_session.commit()
+
+    gsp_errors = get_gsp_errors(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        model_names=["pvnet_v2", "National_xg"],
+        n_gsps=3,
+    )
+
+    # 2 models and gsp ids 0 to 3
+    assert len(gsp_errors) == 8
+    assert sorted(gsp_errors.model_name.unique()) == ["National_xg", "pvnet_v2"]
+    assert sorted(gsp_errors.gsp_id.unique()) == [0, 1, 2, 3]
+
+    gsp_error = gsp_errors[(gsp_errors.gsp_id == 1) & (gsp_errors.model_name == "pvnet_v2")]
+    assert gsp_error.mae.iloc[0] == 1.5  # (1-1)*0.5 + (4-1)*0.5
+    assert gsp_error.rmse.iloc[0] == 4.5**0.5
+    assert gsp_error.number_of_data_points.iloc[0] == 2
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_get_gsp_forecast_values(db_session, forecast_values, datetime_interval):
+    """
+    Test that the forecast values for all gsps (not national) come back from one query
+    """
+    db_session.commit()
+
+    gsp_forecast_values = get_gsp_forecast_values(
+        session=db_session, model_name="pvnet_v2", datetime_interval=datetime_interval, n_gsps=3
+    )
+
+    # gsp ids 1 to 3, 2 target times, 8 forecasts each
+    assert len(gsp_forecast_values) == 3 * 2 * 8
+    assert list(gsp_forecast_values.columns) == [
+        "gsp_id",
+        "expected_power_generation_megawatts",
+        "created_utc",
+    ]
+    assert sorted(gsp_forecast_values.gsp_id.unique()) == [1, 2, 3]
+    assert gsp_forecast_values.expected_power_generation_megawatts.dtype == np.float32
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_get_forecast_values_columns(db_session, forecast_values):
+    """
+    Test only the columns the metrics use are loaded
+    """
+    db_session.commit()
+
+    columns = get_forecast_value_columns(["me", "ramp_rate"])
+    assert columns == ["expected_power_generation_megawatts", "created_utc"]
+
+    forecast_values = get_forecast_values(session=db_session, model_name="pvnet_v2", columns=columns)
+    assert list(forecast_values.columns) == columns
+    assert len(forecast_values) == 16
+
+    # the plevels are only loaded for the probabilistic models
+    columns = get_forecast_value_columns(["mae", "probabilistic"])
+    all_forecast_values = get_all_forecast_values(
+        session=db_session, columns=columns, properties_model_names=["pvnet_v2"]
+    )
+    assert list(all_forecast_values["pvnet_v2"].columns) == [
+        "expected_power_generation_megawatts",
+        "adjust_mw",
+        "created_utc",
+        "10",
+        "90",
+    ]
+    assert list(all_forecast_values["National_xg"].columns) == [
+        "expected_power_generation_megawatts",
+        "adjust_mw",
+        "created_utc",
+    ]
+
+
+def explain(session, statement) -> str:
+    """Get the postgres query plan of a statement"""
+    compiled = statement.compile(dialect=session.bind.dialect)
+    rows = session.connection().exec_driver_sql(f"EXPLAIN {compiled}", compiled.params).all()
+    return "\n".join(row[0] for row in rows)
+
+
+def test_make_forecast_sub_query_partition_pruning(db_session):
+    """
+    Test only the forecast_value partition of the datetime interval is scanned
+    """
+    datetime_interval = DatetimeInterval(
+        start_datetime_utc=datetime(2022, 9, 1), end_datetime_utc=datetime(2022, 9, 2)
+    )
+    sub_query = make_forecast_sub_query(
+        datetime_interval=datetime_interval,
+        forecast_horizon_minutes=60,
+        gsp_id=1,
+        session=db_session,
+        model=ForecastValueSQL,
+        model_name="pvnet_v2",
+    )
+
+    plan = explain(db_session, select(sub_query))
+
+    assert "forecast_value_2022_09" in plan
+    assert "forecast_value_2022_08" not in plan
+    assert "forecast_value_2022_10" not in plan
+
+
+def test_make_forecast_values_query_bounds(db_session, datetime_interval):
+    """
+    Test the target_time and created_utc bounds are pushed into the forecast values query
+    """
+    query, _ = make_forecast_values_query(
+        session=db_session,
+        model_name="pvnet_v2",
+        columns=["expected_power_generation_megawatts", "created_utc"],
+        datetime_interval=datetime_interval,
+        max_forecast_horizon_minutes=480,
+    )
+
+    plan = explain(db_session, query)
+
+    assert "target_time >= '2022-01-01 00:00:00" in plan
+    assert "target_time <= '2022-01-02 00:00:00" in plan
+    # 8 hours and 1 day before the start
+    assert "created_utc >= '2021-12-30 16:00:00" in plan
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_get_plevels_bounds(db_session, forecast_values, datetime_interval):
+    """
+    Test the plevels are only looked for in the forecast values of the datetime interval
+    """
+    db_session.commit()
+
+    plevels = get_plevels(
+        session=db_session,
+        model_name="pvnet_v2",
+        datetime_interval=datetime_interval,
+        max_forecast_horizon_minutes=480,
+    )
+    assert plevels == ["10", "90"]
+
+    later_datetime_interval = DatetimeInterval(
+        start_datetime_utc=datetime(2022, 1, 2), end_datetime_utc=datetime(2022, 1, 3)
+    )
+    plevels = get_plevels(
+        session=db_session,
+        model_name="pvnet_v2",
+        datetime_interval=later_datetime_interval,
+        max_forecast_horizon_minutes=480,
+    )
+    assert plevels == []
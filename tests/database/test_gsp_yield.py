@@ -1,4 +1,18 @@
-from nowcasting_metrics.database.gsp_yield import get_gsp_yield
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from nowcasting_datamodel.models.gsp import GSPYield
+from nowcasting_datamodel.read.read import get_location
+
+from nowcasting_metrics.database.gsp_yield import (
+    get_all_gsp_yields,
+    get_gsp_yield,
+    get_gsp_yields,
+    get_pvlive_yields,
+    select_day_after_gsp_yields,
+    select_pvlive_yields,
+)
 from freezegun import freeze_time
 
 @freeze_time("2022-01-01 00:00:00")
@@ -12,3 +26,75 @@ def test_get_gsp_yield(db_session, gsp_yields):
 
     assert len(gsp_yields_df) == 2
 
+
+
+def test_get_pvlive_yields(db_session, gsp_yields, gsp_yields_inday, datetime_interval):
+    """
+    Test that the in-day and day-after yields for all gsps come back from one query
+    """
+    db_session.commit()
+    pvlive_yields_df = get_pvlive_yields(
+        session=db_session, datetime_interval=datetime_interval, n_gsps=3
+    )
+
+    # gsp ids 0 to 3, with 2 datetimes each
+    assert len(pvlive_yields_df) == 8
+    assert list(pvlive_yields_df.columns) == ["gsp_id", "datetime_utc", "in_day", "day_after"]
+    assert (pvlive_yields_df.in_day == 2000).all()
+    assert (pvlive_yields_df.day_after == 1000).all()
+
+
+def test_get_gsp_yields(db_session, gsp_yields, gsp_yields_inday, datetime_interval):
+    """
+    Test that the day-after yields for all gsps (not national) come back from one query
+    """
+    db_session.commit()
+    gsp_yields_df = get_gsp_yields(session=db_session, datetime_interval=datetime_interval, n_gsps=3)
+
+    # gsp ids 1 to 3, with 2 datetimes each
+    assert len(gsp_yields_df) == 6
+    assert list(gsp_yields_df.columns) == ["gsp_id", "datetime_utc", "solar_generation_kw"]
+    assert sorted(gsp_yields_df.gsp_id.unique()) == [1, 2, 3]
+    assert (gsp_yields_df.solar_generation_kw == 1000).all()
+
+
+def test_get_all_gsp_yields(db_session, gsp_yields, gsp_yields_inday, datetime_interval):
+    """
+    Test the yields for all gsps come back with one column for each regime
+    """
+    # a newer day-after yield for gsp 1, and an in-day yield with no day-after yield for gsp 2
+    gsp_yield_newer = GSPYield(
+        datetime_utc=datetime(2022, 1, 1, 0, 30), solar_generation_kw=1500, regime="day-after"
+    ).to_orm()
+    gsp_yield_newer.location = get_location(session=db_session, gsp_id=1)
+    gsp_yield_newer.created_utc = datetime.now(timezone.utc) + timedelta(hours=1)
+    gsp_yield_in_day = GSPYield(
+        datetime_utc=datetime(2022, 1, 1, 1, 30), solar_generation_kw=2000, regime="in-day"
+    ).to_orm()
+    gsp_yield_in_day.location = get_location(session=db_session, gsp_id=2)
+    db_session.add_all([gsp_yield_newer, gsp_yield_in_day])
+    db_session.commit()
+
+    all_gsp_yields_df = get_all_gsp_yields(
+        session=db_session, datetime_interval=datetime_interval, n_gsps=3
+    )
+
+    # gsp ids 0 to 3, with 2 datetimes each, and the extra in-day yield
+    assert len(all_gsp_yields_df) == 9
+    assert list(all_gsp_yields_df.index.names) == ["datetime_utc", "gsp_id"]
+    assert list(all_gsp_yields_df.columns) == ["in_day", "day_after"]
+    assert all_gsp_yields_df.day_after.dtype == np.float32
+    assert all_gsp_yields_df.index.get_level_values("gsp_id").dtype == np.int16
+
+    dt1 = pd.Timestamp("2022-01-01 00:30", tz="UTC")
+    assert all_gsp_yields_df.loc[(dt1, 1)].day_after == 1500
+    assert all_gsp_yields_df.loc[(dt1, 2)].day_after == 1000
+    assert np.isnan(all_gsp_yields_df.loc[(dt1 + pd.Timedelta("1h"), 2)].day_after)
+
+    # only the rows with both regimes are PVLive yields
+    pvlive_yields_df = select_pvlive_yields(all_gsp_yields_df, datetime_interval=datetime_interval)
+    assert len(pvlive_yields_df) == 8
+
+    # the day-after yields of gsps 1 to 3
+    gsp_yields_df = select_day_after_gsp_yields(all_gsp_yields_df)
+    assert len(gsp_yields_df) == 6
@@ -0,0 +1,79 @@
+from nowcasting_datamodel.models.gsp import LocationSQL
+from nowcasting_datamodel.models.metric import MetricSQL
+from sqlalchemy import event, text
+
+from nowcasting_metrics.database.lookup import (
+    get_location,
+    get_locations,
+    get_lookup_cache,
+    get_metric,
+    get_model,
+    get_object_id,
+)
+from nowcasting_metrics.metrics.mae import latest_mae
+
+
+def test_lookup_cache(db_session):
+    """
+    Test that each row is only looked up once
+    """
+    statements = []
+
+    def count_statements(*args):
+        statements.append(args)
+
+    event.listen(db_session, "do_orm_execute", count_statements)
+
+    location = get_location(session=db_session, gsp_id=0)
+    metric = get_metric(session=db_session, name=latest_mae.name)
+    model = get_model(session=db_session, name="pvnet_v2")
+    number_of_statements = len(statements)
+
+    assert get_location(session=db_session, gsp_id=0) is location
+    assert get_metric(session=db_session, name=latest_mae.name) is metric
+    assert get_model(session=db_session, name="pvnet_v2") is model
+    assert len(statements) == number_of_statements
+
+    event.remove(db_session, "do_orm_execute", count_statements)
+
+
+def test_get_locations(db_session):
+    for gsp_id in range(0, 3):
+        db_session.add(LocationSQL(gsp_id=gsp_id, label=f"GSP_{gsp_id}"))
+    db_session.flush()
+
+    location = get_location(session=db_session, gsp_id=0)
+    locations = get_locations(session=db_session, gsp_ids=[0, 1, 2, 3])
+
+    assert list(locations.keys()) == [0, 1, 2, 3]
+    assert locations[0] is location
+
+    # gsp 3 was not in the database, so its location is made
+    assert locations[3].id is not None
+    assert db_session.query(LocationSQL).filter(LocationSQL.gsp_id == 3).count() == 1
+
+
+def test_lookup_cache_rollback(db_session):
+    """
+    Test that the cache is cleared when the session is rolled back
+    """
+    get_location(session=db_session, gsp_id=0)
+    assert len(get_lookup_cache(db_session)) == 1
+
+    db_session.execute(text("SELECT 1"))
+    db_session.rollback()
+
+    assert len(get_lookup_cache(db_session)) == 0
+
+
+def test_get_object_id(db_session):
+    """
+    Test that an object that is not in the database is added to get its id
+    """
+    location = get_location(session=db_session, gsp_id=0)
+    assert get_object_id(session=db_session, orm_object=location) == location.id
+
+    metric = MetricSQL(name="test_metric", description="test metric")
+    metric_id = get_object_id(session=db_session, orm_object=metric)
+    assert metric_id is not None
+    assert db_session.query(MetricSQL).filter(MetricSQL.name == "test_metric").one().id == metric_id
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import pandas as pd
+
+from nowcasting_metrics.database.schema import (
+    to_compact_forecast_values,
+    to_compact_gsp_yields,
+)
+
+
+def test_to_compact_forecast_values():
+    """
+    Test that forecast values are changed to the compact schema
+    """
+    forecast_values = pd.DataFrame(
+        {
+            "expected_power_generation_megawatts": [1.0, 2.0],
+            "adjust_mw": [0.0, 0.5],
+            "created_utc": [datetime(2022, 1, 1), datetime(2022, 1, 1)],
+            "10": [0.9, 1.8],
+            "model_name": ["pvnet_v2", "pvnet_v2"],
+        },
+        index=pd.Index([datetime(2022, 1, 1, 0, 30), datetime(2022, 1, 1, 1)], name="target_time"),
+    )
+
+    forecast_values = to_compact_forecast_values(forecast_values, plevels=["10"])
+
+    assert forecast_values.expected_power_generation_megawatts.dtype == "float32"
+    assert forecast_values.adjust_mw.dtype == "float32"
+    assert forecast_values["10"].dtype == "float32"
+    assert forecast_values.created_utc.dtype == "datetime64[ns, UTC]"
+    assert forecast_values.index.dtype == "datetime64[ns, UTC]"
+    assert forecast_values.index.name == "target_time"
+    assert forecast_values.model_name.dtype == "category"
+
+
+def test_to_compact_gsp_yields():
+    """
+    Test that gsp yields are changed to the compact schema
+    """
+    gsp_yields = pd.DataFrame(
+        {"solar_generation_kw": [1000.0, 2000.0]},
+        index=pd.Index([datetime(2022, 1, 1, 0, 30), datetime(2022, 1, 1, 1)], name="datetime_utc"),
+    )
+
+    gsp_yields = to_compact_gsp_yields(gsp_yields)
+
+    assert gsp_yields.solar_generation_kw.dtype == "float32"
+    assert gsp_yields.index.dtype == "datetime64[ns, UTC]"
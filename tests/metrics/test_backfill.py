@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+
+from freezegun import freeze_time
+from nowcasting_datamodel.models import DatetimeInterval, MetricSQL, MetricValueSQL
+from nowcasting_datamodel.models.metric import DatetimeIntervalSQL
+from nowcasting_datamodel.models.models import MLModelSQL
+
+from nowcasting_metrics.database.forecast import get_all_forecast_values
+from nowcasting_metrics.database.gsp_yield import get_gsp_yield, get_pvlive_yields
+from nowcasting_metrics.metrics.backfill import (
+    get_daily_datetime_intervals,
+    make_backfill_metrics,
+)
+from nowcasting_metrics.metrics.mae import latest_mae, pvlive_mae
+from nowcasting_metrics.utils import MetricValueWriter
+
+
+def test_get_daily_datetime_intervals():
+    datetime_intervals = get_daily_datetime_intervals(
+        start_datetime=datetime(2022, 1, 1, 12), end_datetime=datetime(2022, 1, 3)
+    )
+
+    assert len(datetime_intervals) == 2
+    assert datetime_intervals[0].start_datetime_utc == datetime(2022, 1, 1, tzinfo=timezone.utc)
+    assert datetime_intervals[1].end_datetime_utc == datetime(2022, 1, 3, tzinfo=timezone.utc)
+
+
+@freeze_time("2022-01-01")
+def test_make_backfill_metrics(db_session, gsp_yields, gsp_yields_inday, forecast_values):
+    start_datetime = datetime(2021, 12, 30)
+    end_datetime = datetime(2022, 1, 3)
+
+    db_session.commit()
+    all_forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1, start_datetime=start_datetime)
+    pvlive_yields = get_pvlive_yields(
+        session=db_session,
+        datetime_interval=DatetimeInterval(
+            start_datetime_utc=start_datetime, end_datetime_utc=end_datetime
+        ),
+        n_gsps=5,
+    )
+
+    metric_value_writer = MetricValueWriter(session=db_session)
+    datetime_intervals = make_backfill_metrics(
+        session=db_session,
+        start_datetime=start_datetime,
+        end_datetime=end_datetime,
+        all_forecast_values=all_forecast_values,
+        gsp_yields=gsp_yields_df,
+        pvlive_yields=pvlive_yields,
+        metric_value_writer=metric_value_writer,
+    )
+    metric_value_writer.flush()
+
+    assert len(datetime_intervals) == 4
+
+    # all the data is on 2022-01-01
+    metric_values = (
+        db_session.query(MetricValueSQL)
+        .join(MetricSQL)
+        .join(DatetimeIntervalSQL)
+        .filter(MetricSQL.name == latest_mae.name)
+        .all()
+    )
+    assert len({m.datetime_interval.start_datetime_utc for m in metric_values}) == 1
+    assert metric_values[0].datetime_interval.start_datetime_utc == datetime(2022, 1, 1)
+
+    # the same as the MAE for one day
+    metric_value = (
+        db_session.query(MetricValueSQL)
+        .join(MetricSQL)
+        .join(MLModelSQL)
+        .filter(MetricSQL.name == latest_mae.name)
+        .filter(MLModelSQL.name == "pvnet_v2")
+        .filter(MetricValueSQL.forecast_horizon_minutes == 60)
+        .one()
+    )
+    assert metric_value.value == 1.5 + 60
+    assert metric_value.number_of_data_points == 2
+
+    # PVLive for each gsp, for one day
+    metric_values = (
+        db_session.query(MetricValueSQL).join(MetricSQL).filter(MetricSQL.name == pvlive_mae.name)
+    )
+    assert metric_values.count() == 6
@@ -0,0 +1,107 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from freezegun import freeze_time
+from nowcasting_datamodel.models.metric import DatetimeInterval, MetricValueSQL
+
+from nowcasting_metrics.benchmark import make_synthetic_forecast_values, make_synthetic_gsp_yields
+from nowcasting_metrics.database.forecast import get_gsp_forecast_values
+from nowcasting_metrics.database.gsp_yield import get_gsp_yields
+from nowcasting_metrics.metrics.gsp_horizons import (
+    get_gsp_horizon_errors,
+    make_gsp_forecast_array,
+    make_gsp_horizon_metrics,
+)
+from nowcasting_metrics.metrics.utils import get_aligned_forecast_values
+
+
+def test_gsp_forecast_array_matches_aligned_forecast_values(tmp_path):
+    """
+    Test the dense array gives the same MAE and ME as the aligned forecast values, for each gsp
+    """
+    datetime_interval = DatetimeInterval(
+        start_datetime_utc=datetime(2022, 1, 2), end_datetime_utc=datetime(2022, 1, 3)
+    )
+    forecast_horizons_minutes = list(range(0, 480, 30))
+
+    all_forecast_values, all_gsp_yields = [], []
+    for gsp_id in [1, 2]:
+        forecast_values = make_synthetic_forecast_values(
+            start_datetime=datetime(2022, 1, 1),
+            end_datetime=datetime(2022, 1, 3),
+            runs_per_hour=4,
+            seed=gsp_id,
+        )
+        gsp_yields = make_synthetic_gsp_yields(
+            start_datetime=datetime(2022, 1, 1), end_datetime=datetime(2022, 1, 3), seed=gsp_id
+        )
+        all_forecast_values.append(forecast_values.assign(gsp_id=gsp_id))
+        all_gsp_yields.append(gsp_yields.assign(gsp_id=gsp_id).reset_index())
+
+    gsp_forecast_array = make_gsp_forecast_array(
+        gsp_forecast_values=pd.concat(all_forecast_values),
+        gsp_yields=pd.concat(all_gsp_yields),
+        datetime_interval=datetime_interval,
+        forecast_horizons_minutes=forecast_horizons_minutes,
+        gsp_ids=[1, 2],
+        filename=str(tmp_path / "forecast.npy"),
+    )
+    assert gsp_forecast_array.forecast.shape == (2, 49, 16)
+    assert gsp_forecast_array.forecast.dtype == np.float32
+    assert np.load(tmp_path / "forecast.npy", mmap_mode="r").shape == (2, 49, 16)
+
+    gsp_horizon_errors = get_gsp_horizon_errors(gsp_forecast_array, gsp_chunk_size=1)
+
+    for gsp_id, forecast_values, gsp_yields in zip([1, 2], all_forecast_values, all_gsp_yields):
+        aligned_forecast_values = get_aligned_forecast_values(
+            datetime_interval=datetime_interval,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields.set_index("datetime_utc"),
+            forecast_horizons_minutes=forecast_horizons_minutes,
+        )
+        error = (
+            aligned_forecast_values.expected_power_generation_megawatts.astype("float64")
+            - aligned_forecast_values.solar_generation_kw.astype("float64") / 1000
+        )
+        by_horizon = error.groupby(aligned_forecast_values.forecast_horizon_minutes.astype(int))
+
+        expected = gsp_horizon_errors.loc[gsp_id]
+        assert (expected.number_of_data_points == by_horizon.count()).all()
+        np.testing.assert_allclose(expected.mae, by_horizon.apply(lambda e: e.abs().mean()), rtol=1e-5)
+        np.testing.assert_allclose(expected.me, by_horizon.mean(), rtol=1e-5, atol=1e-3)
+
+
+@freeze_time("2022-01-01 02:00:00")
+def test_make_gsp_horizon_metrics(db_session, forecast_values, gsp_yields, datetime_interval):
+    """
+    Test the MAE for each gsp and forecast horizon is saved
+    """
+    db_session.commit()
+
+    all_gsp_forecast_values = {
+        "pvnet_v2": get_gsp_forecast_values(
+            session=db_session, model_name="pvnet_v2", datetime_interval=datetime_interval, n_gsps=5
+        )
+    }
+    gsp_yields_df = get_gsp_yields(session=db_session, datetime_interval=datetime_interval, n_gsps=5)
+
+    all_gsp_horizon_errors = make_gsp_horizon_metrics(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        all_gsp_forecast_values=all_gsp_forecast_values,
+        gsp_yields=gsp_yields_df,
+        n_gsps=5,
+    )
+
+    gsp_horizon_errors = all_gsp_horizon_errors["pvnet_v2"]
+    # forecasts of 1 + h and 4 + h, made h + 15 minutes before, and a truth of 1 MW
+    assert gsp_horizon_errors.loc[(1, 60)].mae == 61.5
+    assert gsp_horizon_errors.loc[(1, 60)].me == 61.5
+    assert gsp_horizon_errors.loc[(1, 60)].number_of_data_points == 2
+    assert gsp_horizon_errors.loc[(5, 0)].mae == 1.5
+    assert gsp_horizon_errors.loc[(5, 240)].number_of_data_points == 0
+
+    # 5 gsps with 8 forecast horizons that have data
+    metric_values = db_session.query(MetricValueSQL).all()
+    assert len(metric_values) == 5 * 8
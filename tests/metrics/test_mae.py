@@ -3,12 +3,21 @@ from nowcasting_metrics.metrics.mae import (
     make_mae_all_gsp,
     make_mae_one_gsp,
     make_mae_values,
+    make_mae_values_for_forecast_horizons,
     make_pvlive_mae,
+    make_pvlive_mae_gsps,
 )
-from nowcasting_metrics.database.gsp_yield import get_gsp_yield
-from nowcasting_metrics.database.forecast import get_all_forecast_values
+from nowcasting_metrics.database.gsp_yield import get_gsp_yield, get_pvlive_yields
+from nowcasting_metrics.database.forecast import (
+    get_all_forecast_values,
+    get_gsp_errors,
+)
+from nowcasting_metrics.metrics.mae import latest_mae
+from nowcasting_metrics.metrics.utils import get_all_aligned_forecast_values
+from nowcasting_datamodel.models import MetricSQL, MetricValueSQL
 
 from freezegun import freeze_time
+import pytest
 
 
 def test_make_mae(db_session, gsp_yields, forecast_values_latest, datetime_interval):
@@ -41,6 +50,62 @@ def test_make_mae_forecast_horizon(db_session, gsp_yields, forecast_values, date
     assert n == 2
 
 
+@freeze_time("2022-01-01")
+def test_make_mae_forecast_horizons(db_session, gsp_yields, forecast_values, datetime_interval):
+
+    db_session.commit()
+    forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    results_df = make_mae_values_for_forecast_horizons(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        gsp_yields=gsp_yields_df,
+        forecast_values=forecast_values["pvnet_v2"],
+        forecast_horizons_minutes=[None, 0, 60, 180, 240],
+    )
+
+    # no forecast horizon uses the latest forecast, which is the same as a 0 minute horizon.
+    # There are no forecasts made more than 240 minutes before the target time
+    assert len(results_df) == 4
+    assert list(results_df["value"]) == [1.5, 1.5 + 60, 1.5 + 180, 1.5]
+    assert list(results_df["number_of_data_points"]) == [2, 2, 2, 2]
+
+
+@freeze_time("2022-01-01")
+def test_make_mae_forecast_horizons_aligned(
+    db_session, gsp_yields, forecast_values, datetime_interval
+):
+
+    db_session.commit()
+    forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    all_aligned_forecast_values = get_all_aligned_forecast_values(
+        datetime_interval=datetime_interval,
+        all_forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df,
+    )
+    aligned_forecast_values = all_aligned_forecast_values["pvnet_v2"]
+
+    # 2 target times, for no forecast horizon and forecast horizons 0 to 210
+    assert len(aligned_forecast_values) == 2 * 9
+    assert "solar_generation_kw" in aligned_forecast_values.columns
+
+    results_df = make_mae_values_for_forecast_horizons(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        gsp_yields=gsp_yields_df,
+        forecast_values=forecast_values["pvnet_v2"],
+        forecast_horizons_minutes=[None, 0, 60, 180, 240],
+        aligned_forecast_values=aligned_forecast_values,
+    )
+
+    # the same as aligning the forecast values in the function
+    assert list(results_df["value"]) == [1.5, 1.5 + 60, 1.5 + 180, 1.5]
+    assert list(results_df["number_of_data_points"]) == [2, 2, 2, 2]
+
+
 def test_make_mae_all_gsp(
     db_session, gsp_yields, forecast_values_latest, forecast_values, datetime_interval
 ):
@@ -66,8 +131,89 @@ def test_make_mae_five_gsp(
     )
 
 
+def test_make_mae_five_gsp_with_gsp_errors(
+    db_session, gsp_yields, forecast_values_latest, forecast_values, datetime_interval
+):
+    db_session.commit()
+    forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=0)
+    gsp_errors = get_gsp_errors(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        model_names=["pvnet_v2", "pvnet_day_ahead"],
+        n_gsps=5,
+    )
+
+    make_mae(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        n_gsps=5,
+        max_forecast_horizon_minutes={"National_xg": 240, "pvnet_v2": 240},
+        all_forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df,
+        gsp_errors=gsp_errors,
+    )
+
+    # 1 model at gsp level from 1-5
+    metric_values = (
+        db_session.query(MetricValueSQL)
+        .join(MetricSQL)
+        .filter(MetricSQL.name == latest_mae.name)
+        .filter(MetricValueSQL.location_id.isnot(None))
+        .filter(MetricValueSQL.forecast_horizon_minutes.is_(None))
+        .all()
+    )
+    gsp_metric_values = [m for m in metric_values if m.location.gsp_id != 0]
+    assert len(gsp_metric_values) == 5
+    assert all(m.value == 1.5 for m in gsp_metric_values)
+
+
 def test_make_pvlive_mae(db_session, gsp_yields, gsp_yields_inday, datetime_interval):
     value, n = make_pvlive_mae(session=db_session, datetime_interval=datetime_interval, gsp_id=0)
 
     assert n == 2
     assert value == 1.0  # (2-1)*0.5 + (2-1)*0.5
+
+
+def test_make_pvlive_mae_gsps(db_session, gsp_yields, gsp_yields_inday, datetime_interval):
+    db_session.commit()
+    pvlive_yields = get_pvlive_yields(
+        session=db_session, datetime_interval=datetime_interval, n_gsps=5
+    )
+
+    pvlive_errors = make_pvlive_mae_gsps(
+        session=db_session, datetime_interval=datetime_interval, pvlive_yields=pvlive_yields
+    )
+
+    assert list(pvlive_errors.index) == [0, 1, 2, 3, 4, 5]
+    assert (pvlive_errors.number_of_data_points == 2).all()
+    assert (pvlive_errors.mae == 1.0).all()  # (2-1)*0.5 + (2-1)*0.5
+    assert db_session.query(MetricValueSQL).count() == 6
+
+
+@freeze_time("2022-01-01")
+def test_make_mae_forecast_horizons_aligned_missing(
+    db_session, gsp_yields, forecast_values, datetime_interval
+):
+    """The aligned forecast values must have all the forecast horizons of the metric"""
+    db_session.commit()
+    forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    all_aligned_forecast_values = get_all_aligned_forecast_values(
+        datetime_interval=datetime_interval,
+        all_forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df,
+        max_forecast_horizon_minutes={"pvnet_v2": 120},
+    )
+
+    with pytest.raises(ValueError, match="forecast horizons"):
+        make_mae(
+            session=db_session,
+            datetime_interval=datetime_interval,
+            n_gsps=0,
+            all_forecast_values={"pvnet_v2": forecast_values["pvnet_v2"]},
+            gsp_yields=gsp_yields_df,
+            max_forecast_horizon_minutes={"pvnet_v2": 240},
+            all_aligned_forecast_values=all_aligned_forecast_values,
+        )
@@ -1,7 +1,9 @@
+import pytest
 from nowcasting_datamodel.models import MetricValueSQL
 from nowcasting_metrics.metrics.me import (
     make_me,
     make_me_one_gsp_with_forecast_horizon_and_one_half_hour,
+    make_me_values_for_forecast_horizons,
 )
 from nowcasting_metrics.database.gsp_yield import get_gsp_yield
 from nowcasting_metrics.database.forecast import get_forecast_values, get_all_forecast_values
@@ -24,7 +26,7 @@ def test_make_me_forecast_horizon(db_session, gsp_yields, forecast_values, datet
         forecast_values=forecast_values_df,
         gsp_yields=gsp_yields_df,
     )
-    value, n, time = results[0]
+    value, n, time_of_day = results[0]
 
     assert value == 60  # (61 - 1)
     assert n == 1
@@ -50,3 +52,40 @@ def test_make_me(
 
     # 3 models, 2 forecast horizon, 8 half hours
     assert db_session.query(MetricValueSQL).count() == 2 * 2 * 8
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_make_me_values_for_forecast_horizons(
+    db_session, gsp_yields, forecast_values, datetime_interval
+):
+    db_session.commit()
+    forecast_values_df = get_forecast_values(session=db_session, model_name="pvnet_v2")
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    results_df = make_me_values_for_forecast_horizons(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        model_name="pvnet_v2",
+        forecast_values=forecast_values_df,
+        gsp_yields=gsp_yields_df,
+        forecast_horizons_minutes=[0, 60, 120],
+    )
+
+    # 3 forecast horizons, 2 half hours
+    assert len(results_df) == 3 * 2
+
+    # the same as one forecast horizon at a time
+    for forecast_horizon_minutes in [0, 60, 120]:
+        results = make_me_one_gsp_with_forecast_horizon_and_one_half_hour(
+            session=db_session,
+            datetime_interval=datetime_interval,
+            gsp_id=0,
+            forecast_horizon_minutes=forecast_horizon_minutes,
+            forecast_values=forecast_values_df,
+            gsp_yields=gsp_yields_df,
+            save_to_database=False,
+        )
+        for value, n, time_of_day in results:
+            result = results_df.loc[(forecast_horizon_minutes, time_of_day)]
+            assert result.me == pytest.approx(value)
+            assert result.number_of_data_points == n
@@ -1,18 +1,22 @@
 from nowcasting_metrics.metrics.probablistic import (
-make_probabilistic_metrics_one_forecast_horizon_minutes
+make_probabilistic_metrics_for_forecast_horizons,
+make_probabilistic_metrics_one_forecast_horizon_minutes,
 )
 
 from nowcasting_metrics.database.gsp_yield import get_gsp_yield
 from nowcasting_metrics.database.forecast import get_forecast_values
 
 from freezegun import freeze_time
+import pytest
 
 @freeze_time("2022-01-01 00:00:00")
 def test_make_prob_one_forecast_horizon(
     db_session, gsp_yields, forecast_values, datetime_interval
 ):
     db_session.commit()
-    forecast_values = get_forecast_values(session=db_session, model_name="pvnet_v2" )
+    forecast_values = get_forecast_values(
+        session=db_session, model_name="pvnet_v2", expand_plevels=False
+    )
     gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
 
     value, pinball, n = make_probabilistic_metrics_one_forecast_horizon_minutes(
@@ -44,3 +48,70 @@ def test_make_prob_one_forecast_horizon(
     assert n == 2
 
 
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_make_prob_one_forecast_horizon_expand_plevels(
+    db_session, gsp_yields, forecast_values, datetime_interval
+):
+    db_session.commit()
+    forecast_values = get_forecast_values(
+        session=db_session, model_name="pvnet_v2", expand_plevels=True
+    )
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    value, pinball, n = make_probabilistic_metrics_one_forecast_horizon_minutes(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        model_name="pvnet_v2",
+        forecast_horizon_minutes=0,
+        p_level='10',
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df
+    )
+
+    assert value == 0.5
+    assert pinball == pytest.approx(((3.6-1)*0.1 + (1-0.9)*0.9)/2)
+    assert n == 2
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_make_prob_forecast_horizons(
+    db_session, gsp_yields, forecast_values, datetime_interval
+):
+    db_session.commit()
+    forecast_values = get_forecast_values(session=db_session, model_name="pvnet_v2")
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    quantile_scores, interval_scores = make_probabilistic_metrics_for_forecast_horizons(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        model_name="pvnet_v2",
+        forecast_horizons_minutes=[0, 60, 120],
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df,
+    )
+
+    # the same as one forecast horizon and p level at a time
+    for (forecast_horizon_minutes, p_level), row in quantile_scores.iterrows():
+        value, pinball, n = make_probabilistic_metrics_one_forecast_horizon_minutes(
+            session=db_session,
+            datetime_interval=datetime_interval,
+            model_name="pvnet_v2",
+            forecast_horizon_minutes=forecast_horizon_minutes,
+            p_level=p_level,
+            forecast_values=forecast_values,
+            gsp_yields=gsp_yields_df,
+        )
+        assert row.exceedance == pytest.approx(value)
+        assert row.pinball == pytest.approx(pinball)
+        assert row.number_of_data_points == n
+
+    assert list(quantile_scores.loc[0].index) == ["10", "90"]
+    assert quantile_scores.loc[(0, "10"), "pinball"] == pytest.approx(0.175)
+
+    # p10 and p90 make an 80% interval
+    assert list(interval_scores.index) == [(0, "80"), (60, "80"), (120, "80")]
+    assert interval_scores.loc[(0, "80"), "coverage"] == 0.5
+    assert interval_scores.loc[(0, "80"), "width"] == pytest.approx(((4.4 - 3.6) + (1.1 - 0.9)) / 2)
+    assert interval_scores.loc[(0, "80"), "number_of_data_points"] == 2
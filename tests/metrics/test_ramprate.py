@@ -1,5 +1,6 @@
 from nowcasting_metrics.metrics.ramp_rate import (
     make_ramp_rate_one_forecast_horizon_minutes,
+    make_ramp_rate_values_for_forecast_horizons,
     make_ramp_rate,
 )
 from nowcasting_metrics.database.gsp_yield import get_gsp_yield
@@ -31,6 +32,29 @@ def test_make_ramp_rate_one_forecast_horizon(
     assert n == 1
 
 
+@freeze_time("2022-01-01")
+def test_make_ramp_rate_forecast_horizons(
+    db_session, gsp_yields, forecast_values_same_creation, datetime_interval
+):
+    db_session.commit()
+    forecast_values = get_forecast_values(session=db_session, model_name="pvnet_v2")
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=0)
+
+    results_df = make_ramp_rate_values_for_forecast_horizons(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        model_name="pvnet_v2",
+        forecast_horizons_minutes=[0, 60, 120, 240],
+        ramp_rate_minutes=30,
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df,
+    )
+
+    # no forecast is made more than 240 minutes before the target time
+    assert list(results_df["value"].iloc[:3]) == [3, 3, 3]  # (3-1)-(1-1)
+    assert list(results_df["number_of_data_points"]) == [1, 1, 1, 0]
+
+
 @freeze_time("2022-01-01")
 def test_make_ramp_rate(db_session, gsp_yields, forecast_values_same_creation, datetime_interval):
 
@@ -1,4 +1,16 @@
-from nowcasting_metrics.metrics.rmse import make_rmse, make_rmse_all_gsp, make_rmse_one_gsp
+import pytest
+from freezegun import freeze_time
+from nowcasting_datamodel.models import MetricSQL, MetricValueSQL, MLModelSQL
+
+from nowcasting_metrics.database.forecast import get_all_forecast_values
+from nowcasting_metrics.database.gsp_yield import get_gsp_yield
+from nowcasting_metrics.metrics.rmse import (
+    latest_rmse,
+    make_rmse,
+    make_rmse_all_gsp,
+    make_rmse_one_gsp,
+    make_rmse_values_for_forecast_horizons,
+)
 
 
 def test_make_rmse(db_session, gsp_yields, forecast_values_latest, datetime_interval):
@@ -23,3 +35,64 @@ def test_make_rmse_all_gsp(db_session, gsp_yields, forecast_values_latest, datet
 
     assert value == 4.5**0.5  # ((1-1)*0.5 + (4-1)**2*0.5)^0.5 = 4.5^0.5
     assert n == 10
+
+
+@freeze_time("2022-01-01")
+def test_make_rmse_forecast_horizons(db_session, gsp_yields, forecast_values, datetime_interval):
+    db_session.commit()
+    forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    results_df = make_rmse_values_for_forecast_horizons(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        gsp_yields=gsp_yields_df,
+        forecast_values=forecast_values["pvnet_v2"],
+        forecast_horizons_minutes=[None, 0, 60, 240],
+        model_name="pvnet_v2",
+    )
+
+    # no forecast horizon uses the latest forecast, which is the same as a 0 minute horizon.
+    # There are no forecasts made more than 240 minutes before the target time
+    assert len(results_df) == 3
+    assert list(results_df["value"]) == pytest.approx(
+        [4.5**0.5, ((60**2 + 63**2) / 2) ** 0.5, 4.5**0.5]
+    )
+    assert list(results_df["number_of_data_points"]) == [2, 2, 2]
+
+
+@freeze_time("2022-01-01")
+def test_make_rmse_in_memory(
+    db_session, gsp_yields, forecast_values_latest, forecast_values, datetime_interval
+):
+    db_session.commit()
+    forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    make_rmse(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        n_gsps=5,
+        all_forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df,
+    )
+
+    # for each of the 2 models, the forecast horizons 0 to 210 with and without the adjuster (16),
+    # the latest forecast with the adjuster (1) and all gsps (1). Then the latest forecast for
+    # gsps 0 to 5 for pvnet_v2 (6). There are no in-day yields, so there is no PVLive RMSE
+    metric_values = db_session.query(MetricValueSQL).all()
+    assert len(metric_values) == 2 * (16 + 1 + 1) + 6
+
+    # forecasts made 75 minutes before the target times, with errors 60 and 63
+    metric_values = (
+        db_session.query(MetricValueSQL)
+        .join(MetricSQL)
+        .join(MLModelSQL)
+        .filter(MetricSQL.name == latest_rmse.name)
+        .filter(MLModelSQL.name == "pvnet_v2")
+        .filter(MetricValueSQL.forecast_horizon_minutes == 60)
+        .all()
+    )
+    assert len(metric_values) == 1
+    assert metric_values[0].value == pytest.approx(((60**2 + 63**2) / 2) ** 0.5)
+    assert metric_values[0].number_of_data_points == 2
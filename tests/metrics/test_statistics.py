@@ -0,0 +1,204 @@
+from datetime import date, datetime, time, timezone
+
+import pandas as pd
+from freezegun import freeze_time
+from nowcasting_datamodel.models import DatetimeInterval, MetricValueSQL
+
+from nowcasting_metrics.database.forecast import get_all_forecast_values, get_forecast_values
+from nowcasting_metrics.database.gsp_yield import get_gsp_yield
+from nowcasting_metrics.metrics.me import (
+    make_me,
+    make_me_from_statistics,
+    make_me_values_for_forecast_horizons,
+)
+from nowcasting_metrics.metrics.statistics import (
+    get_saved_forecast_horizons,
+    get_statistics_filename,
+    load_daily_error_statistics,
+    merge_error_statistics,
+    save_daily_error_statistics,
+    update_daily_error_statistics,
+)
+
+
+def test_merge_error_statistics(tmp_path):
+    statistics = pd.DataFrame(
+        {
+            "date": [date(2022, 1, 1), date(2022, 1, 2)],
+            "forecast_horizon_minutes": [0, 0],
+            "time_of_day": [time(12), time(12)],
+            "sum_error": [2.0, -4.0],
+            "sum_abs_error": [2.0, 4.0],
+            "sum_squared_error": [4.0, 8.0],
+            "count": [1, 2],
+        }
+    )
+
+    days = save_daily_error_statistics(statistics, statistics_dir=str(tmp_path), model_name="a")
+    assert days == [date(2022, 1, 1), date(2022, 1, 2)]
+
+    statistics = load_daily_error_statistics(statistics_dir=str(tmp_path), model_name="a", days=days)
+    results_df = merge_error_statistics(statistics)
+
+    assert len(results_df) == 1
+    result = results_df.loc[(0, time(12))]
+    assert result.me == -2 / 3
+    assert result.mae == 2
+    assert result.rmse == 2
+    assert result.number_of_data_points == 3
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_make_me_statistics(
+    db_session, gsp_yields, forecast_values_latest, forecast_values, tmp_path
+):
+    max_forecast_horizon_minutes = {"National_xg": 30 * 60, "pvnet_v2": 240}
+    datetime_interval = DatetimeInterval(
+        start_datetime_utc=datetime(2021, 12, 31), end_datetime_utc=datetime(2022, 1, 2)
+    )
+
+    db_session.commit()
+    forecast_values = get_all_forecast_values(session=db_session)
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    make_me(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        max_forecast_horizon_minutes=max_forecast_horizon_minutes,
+        all_forecast_values=forecast_values,
+        gsp_yields=gsp_yields_df,
+        statistics_dir=str(tmp_path),
+    )
+
+    # the same as without the statistics, 2 models, 2 half hours, 8 forecast horizons
+    assert db_session.query(MetricValueSQL).count() == 2 * 2 * 8
+
+    # the day without data is saved empty, so it is not worked out again
+    assert (tmp_path / "pvnet_v2" / "2022-01-01.csv").exists()
+    assert (tmp_path / "pvnet_v2" / "2021-12-31.csv").exists()
+    statistics = load_daily_error_statistics(
+        statistics_dir=str(tmp_path), model_name="pvnet_v2", days=[date(2021, 12, 31)]
+    )
+    assert len(statistics) == 0
+    assert get_statistics_filename(str(tmp_path), "pvnet_v2", date(2022, 1, 1)).endswith(
+        "2022-01-01.csv"
+    )
+
+
+def test_update_daily_error_statistics_refresh_days(tmp_path):
+    old_statistics = pd.DataFrame(
+        {
+            "date": [date(2022, 1, 1), date(2022, 1, 2), date(2022, 1, 3)],
+            "forecast_horizon_minutes": [0, 0, 0],
+            "time_of_day": [time(12), time(12), time(12)],
+            "sum_error": [1.0, 1.0, 1.0],
+            "sum_abs_error": [1.0, 1.0, 1.0],
+            "sum_squared_error": [1.0, 1.0, 1.0],
+            "count": [1, 1, 1],
+        }
+    )
+    save_daily_error_statistics(
+        old_statistics, statistics_dir=str(tmp_path), model_name="a", forecast_horizons_minutes=[0]
+    )
+
+    # new truth for the last two days, e.g. from the PVLive day-after updates
+    target_times = pd.DatetimeIndex(
+        [datetime(2022, 1, d, 12, tzinfo=timezone.utc) for d in [1, 2, 3]], name="target_time"
+    )
+    forecast_values = pd.DataFrame(
+        {
+            "expected_power_generation_megawatts": [3.0, 3.0, 3.0],
+            "created_utc": target_times - pd.Timedelta(minutes=15),
+        },
+        index=target_times,
+    )
+    gsp_yields = pd.DataFrame(
+        {"solar_generation_kw": [0.0, 0.0, 0.0]},
+        index=pd.DatetimeIndex(target_times, name="datetime_utc"),
+    )
+
+    statistics = update_daily_error_statistics(
+        statistics_dir=str(tmp_path),
+        model_name="a",
+        datetime_interval=DatetimeInterval(
+            start_datetime_utc=datetime(2022, 1, 1), end_datetime_utc=datetime(2022, 1, 4)
+        ),
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields,
+        forecast_horizons_minutes=[0],
+    )
+
+    assert list(statistics.sum_error) == [1.0, 3.0, 3.0]
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_make_me_from_statistics_closed_interval(db_session, gsp_yields, forecast_values, tmp_path):
+    db_session.commit()
+    forecast_values_df = get_forecast_values(session=db_session, model_name="pvnet_v2")
+    gsp_yields_df = get_gsp_yield(session=db_session, gsp_id=1)
+
+    # the 01:00 target time is at the end of the interval, on a day that is not saved
+    datetime_interval = DatetimeInterval(
+        start_datetime_utc=datetime(2021, 12, 31), end_datetime_utc=datetime(2022, 1, 1, 1)
+    )
+    kwargs = dict(
+        session=db_session,
+        datetime_interval=datetime_interval,
+        model_name="pvnet_v2",
+        forecast_values=forecast_values_df,
+        gsp_yields=gsp_yields_df,
+        forecast_horizons_minutes=[0, 60],
+    )
+
+    results_df = make_me_values_for_forecast_horizons(**kwargs)
+    results_statistics_df = make_me_from_statistics(statistics_dir=str(tmp_path), **kwargs)
+
+    assert len(results_df) == 2 * 2
+    assert list(results_statistics_df.me) == list(results_df.me)
+    assert list(results_statistics_df.number_of_data_points) == list(
+        results_df.number_of_data_points
+    )
+    assert not (tmp_path / "pvnet_v2" / "2022-01-01.csv").exists()
+
+
+def test_update_daily_error_statistics_forecast_horizons(tmp_path):
+    target_times = pd.DatetimeIndex(
+        [datetime(2022, 1, d, 12, tzinfo=timezone.utc) for d in [1, 2, 3, 4]], name="target_time"
+    )
+    forecast_values = pd.DataFrame(
+        {
+            "expected_power_generation_megawatts": [3.0, 3.0, 3.0, 3.0],
+            "created_utc": target_times - pd.Timedelta(minutes=90),
+        },
+        index=target_times,
+    )
+    gsp_yields = pd.DataFrame(
+        {"solar_generation_kw": [0.0, 0.0, 0.0, 0.0]},
+        index=pd.DatetimeIndex(target_times, name="datetime_utc"),
+    )
+    datetime_interval = DatetimeInterval(
+        start_datetime_utc=datetime(2022, 1, 1), end_datetime_utc=datetime(2022, 1, 5)
+    )
+
+    statistics = update_daily_error_statistics(
+        statistics_dir=str(tmp_path),
+        model_name="a",
+        datetime_interval=datetime_interval,
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields,
+        forecast_horizons_minutes=[0],
+    )
+    assert list(statistics.forecast_horizon_minutes) == [0, 0, 0, 0]
+    assert get_saved_forecast_horizons(str(tmp_path), "a", date(2022, 1, 1)) == "0"
+
+    # the saved days were made for other forecast horizons, so are worked out again
+    statistics = update_daily_error_statistics(
+        statistics_dir=str(tmp_path),
+        model_name="a",
+        datetime_interval=datetime_interval,
+        forecast_values=forecast_values,
+        gsp_yields=gsp_yields,
+        forecast_horizons_minutes=[0, 60],
+    )
+    assert list(statistics.forecast_horizon_minutes) == [0, 60, 0, 60, 0, 60, 0, 60]
+    assert get_saved_forecast_horizons(str(tmp_path), "a", date(2022, 1, 1)) == "0,60"
@@ -1,11 +1,26 @@
+import json
+
+import sentry_sdk
+from sentry_sdk.transport import Transport
+
 from click.testing import CliRunner
 from nowcasting_datamodel.models import ForecastValueLatestSQL
 from nowcasting_datamodel.models.gsp import GSPYieldSQL
-from nowcasting_datamodel.models.metric import MetricSQL, MetricValueSQL
+from nowcasting_datamodel.models.metric import DatetimeInterval, MetricSQL, MetricValueSQL
 
 from nowcasting_metrics.metrics.me import me_hh
-from nowcasting_metrics.metrics.mae import latest_mae
-from nowcasting_metrics.app import app
+from nowcasting_metrics.metrics.mae import latest_mae, pvlive_mae
+from nowcasting_metrics.app import (
+    app,
+    backfill,
+    cli,
+    get_worker_kwargs,
+    run_metric_tasks,
+    split_metric_tasks_by_model,
+)
+from nowcasting_metrics.utils import MetricValueWriter
+from nowcasting_metrics.metrics.mae import make_mae
+from nowcasting_metrics.metrics.me import make_me
 
 from freezegun import freeze_time
 
@@ -64,7 +79,7 @@ def test_app(
 
     # check all metrics
     metric_values = db_session.query(MetricValueSQL).all()
-    assert len(metric_values) == 144
+    assert len(metric_values) == 224
     # National
     # - with and without adjuster = 2
     # - 8 forecast horizons with and without adjuster = 16
@@ -74,13 +89,307 @@ def test_app(
     # - 5*GSPs + All GSPS = 6
     # GPS PVlive = 6
     # Total metrics 48
-    # RMSE has been removed
+    # RMSE
+    # - National, latest with adjuster and 8 forecast horizons with and without adjuster = 17
+    # - 2 models = 34
+    # - All GSPs 2 models = 2
+    # - 5*GSPs + National = 6
+    # - GSP PVlive = 6
+    # Total RMSE 48
     # + ME # 2 models * 8 forecast horizons * 2 half hours  = 32
     # + Ramp rate 2 models * 3 forecast horizons  = 6 # TODO, not working
     # Total is 80
     # Pinball 2 models * 8 forecast horizons* 2 p levels  = 32
     # Exceedance 2 models * 8 forecast horizons * 2 p levels  = 32
     # Total 144
+    # Interval coverage 2 models * 8 forecast horizons * 1 interval (p10 to p90) = 16
+    # Interval width 2 models * 8 forecast horizons * 1 interval (p10 to p90) = 16
+    # Total 176
+    # + RMSE 48
+    # Total 224
 
     metrics = db_session.query(MetricSQL).all()
-    assert len(metrics) == 12
+    assert len(metrics) == 14
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_app_workers(
+    db_connection,
+    db_session,
+    gsp_yields,
+    gsp_yields_inday,
+    forecast_values_latest,
+    forecast_values,
+    tmp_path,
+):
+    db_session.commit()
+
+    runner = CliRunner()
+    response = runner.invoke(
+        app,
+        [
+            "--db-url",
+            db_connection.url,
+            "--n-gsps",
+            5,
+            "--datetime-now",
+            "2022-01-02",
+            "--workers",
+            2,
+            "--profile-report",
+            str(tmp_path / "report.json"),
+        ],
+    )
+    if not response.exit_code == 0:
+        raise response.exception
+
+    # the same metric values as running the metrics one after another
+    metric_values = (
+        db_session.query(MetricValueSQL).join(MetricSQL).filter(MetricSQL.name == me_hh.name).all()
+    )
+    assert len(metric_values) == 32
+
+    metric_values = db_session.query(MetricValueSQL).all()
+    assert len(metric_values) == 224
+
+    # each metric task is profiled, and the report is saved
+    with open(tmp_path / "report.json") as f:
+        report = json.load(f)
+    stage_names = {stage["name"] for stage in report["stages"]}
+    assert {"get_forecast_values", "make_mae", "make_me", "save_metric_values"} <= stage_names
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_app_chunksize(
+    db_connection,
+    db_session,
+    gsp_yields,
+    gsp_yields_inday,
+    forecast_values_latest,
+    forecast_values,
+):
+    db_session.commit()
+
+    runner = CliRunner()
+    response = runner.invoke(
+        app,
+        [
+            "--db-url",
+            db_connection.url,
+            "--n-gsps",
+            5,
+            "--datetime-now",
+            "2022-01-02",
+            "--chunksize",
+            5,
+        ],
+    )
+    if not response.exit_code == 0:
+        raise response.exception
+
+    # the same metric values as loading all the models at once
+    metric_values = (
+        db_session.query(MetricValueSQL).join(MetricSQL).filter(MetricSQL.name == me_hh.name).all()
+    )
+    assert len(metric_values) == 32
+
+    metric_values = db_session.query(MetricValueSQL).all()
+    assert len(metric_values) == 224
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_app_profile_report_on_failure(db_connection, db_session, tmp_path, monkeypatch):
+    db_session.commit()
+
+    def fail(**kwargs):
+        raise RuntimeError("metric task failed")
+
+    monkeypatch.setattr("nowcasting_metrics.app.run_metric_tasks", fail)
+
+    runner = CliRunner()
+    response = runner.invoke(
+        app,
+        [
+            "--db-url",
+            db_connection.url,
+            "--datetime-now",
+            "2022-01-02",
+            "--profile-report",
+            str(tmp_path / "report.json"),
+        ],
+    )
+    assert isinstance(response.exception, RuntimeError)
+
+    # the report of the stages that ran is still saved
+    with open(tmp_path / "report.json") as f:
+        report = json.load(f)
+    stage_names = {stage["name"] for stage in report["stages"]}
+    assert "get_gsp_errors" in stage_names
+
+
+def test_split_metric_tasks_by_model(datetime_interval):
+    all_forecast_values = {"pvnet_v2": "pvnet_v2 values", "National_xg": "National_xg values"}
+    metric_tasks = [
+        (make_mae, dict(all_forecast_values=all_forecast_values)),
+        (make_me, dict(all_forecast_values=all_forecast_values, datetime_interval=datetime_interval)),
+    ]
+
+    metric_tasks = split_metric_tasks_by_model(metric_tasks)
+
+    # make_mae is not split, and make_me only gets tasks for the models with forecast values
+    assert [function for function, _ in metric_tasks] == [make_mae, make_me, make_me]
+    assert metric_tasks[1][1]["model_names"] == ["pvnet_v2"]
+    assert metric_tasks[1][1]["all_forecast_values"] == {"pvnet_v2": "pvnet_v2 values"}
+    assert metric_tasks[2][1]["model_names"] == ["National_xg"]
+
+    # the workers get a plain datetime interval
+    kwargs = get_worker_kwargs(metric_tasks[1][1])
+    assert isinstance(kwargs["datetime_interval"], DatetimeInterval)
+    assert kwargs["datetime_interval"].start_datetime_utc == datetime_interval.start_datetime_utc
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_app_gsp_horizon_metrics(
+    db_connection,
+    db_session,
+    gsp_yields,
+    gsp_yields_inday,
+    forecast_values_latest,
+    forecast_values,
+    monkeypatch,
+    tmp_path,
+):
+    db_session.commit()
+    monkeypatch.setenv("RUN_GSP_HORIZON_METRICS", "true")
+    monkeypatch.setenv("RUN_ME", "false")
+
+    runner = CliRunner()
+    response = runner.invoke(
+        app,
+        [
+            "--db-url",
+            db_connection.url,
+            "--n-gsps",
+            5,
+            "--datetime-now",
+            "2022-01-02",
+            "--gsp-array-dir",
+            str(tmp_path),
+        ],
+    )
+    if not response.exit_code == 0:
+        raise response.exception
+
+    # 23 as in test_app, and 1 model at gsp level from 1-5 with 8 forecast horizons = 40
+    metric_values = (
+        db_session.query(MetricValueSQL).join(MetricSQL).filter(MetricSQL.name == latest_mae.name).all()
+    )
+    assert len(metric_values) == 23 + 40
+    assert (tmp_path / "pvnet_v2.npy").exists()
+
+
+@freeze_time("2022-01-01 00:00:00")
+def test_backfill(
+    db_connection,
+    db_session,
+    gsp_yields,
+    gsp_yields_inday,
+    forecast_values_history,
+):
+    db_session.commit()
+
+    runner = CliRunner()
+    response = runner.invoke(
+        backfill,
+        [
+            "--db-url",
+            db_connection.url,
+            "--n-gsps",
+            5,
+            "--start",
+            "2021-12-30",
+            "--end",
+            "2022-01-03",
+        ],
+    )
+    if not response.exit_code == 0:
+        raise response.exception
+
+    # all the data is on one day
+    metric_values = (
+        db_session.query(MetricValueSQL)
+        .join(MetricSQL)
+        .filter(MetricSQL.name == latest_mae.name)
+        .all()
+    )
+    assert len(metric_values) > 0
+    assert len({m.datetime_interval_id for m in metric_values}) == 1
+
+    # PVLive for 6 gsps
+    metric_values = (
+        db_session.query(MetricValueSQL).join(MetricSQL).filter(MetricSQL.name == pvlive_mae.name)
+    )
+    assert metric_values.count() == 6
+
+
+def test_cli():
+    runner = CliRunner()
+
+    response = runner.invoke(cli, ["--help"])
+    assert response.exit_code == 0
+    assert "app" in response.output
+    assert "backfill" in response.output
+
+    response = runner.invoke(cli, ["backfill", "--help"])
+    assert response.exit_code == 0
+    assert "--start" in response.output
+
+
+class CaptureTransport(Transport):
+    """Sentry transport that keeps the envelopes, rather than sending them"""
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.envelopes = []
+
+    def capture_envelope(self, envelope):
+        self.envelopes.append(envelope)
+
+
+def test_run_metric_tasks_sentry_spans(db_connection, db_session):
+    def make_nothing(session, metric_value_writer, **kwargs):
+        pass
+
+    # without the threading integration, the sentry scope is not passed to the worker threads
+    transport = CaptureTransport()
+    sentry_sdk.init(
+        dsn="https://key@example.com/1",
+        transport=transport,
+        traces_sample_rate=1,
+        default_integrations=False,
+    )
+    try:
+        with sentry_sdk.start_transaction(op="metrics", name="test") as transaction:
+            run_metric_tasks(
+                connection=db_connection,
+                session=db_session,
+                metric_tasks=[(make_nothing, {}), (make_nothing, {})],
+                metric_value_writer=MetricValueWriter(session=db_session),
+                workers=2,
+            )
+        sentry_sdk.flush()
+    finally:
+        sentry_sdk.init()
+
+    events = [
+        item.payload.json
+        for envelope in transport.envelopes
+        for item in envelope.items
+        if item.type == "transaction"
+    ]
+    assert len(events) == 1
+
+    # the stages of the workers are in the transaction of the run
+    spans = [span for span in events[0]["spans"] if span["op"] == "metrics.stage"]
+    assert len(spans) == 2
+    assert all(span["parent_span_id"] == transaction.span_id for span in spans)
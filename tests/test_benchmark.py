@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from nowcasting_metrics.benchmark import make_synthetic_data, run_benchmark
+
+
+def test_make_synthetic_data():
+    all_forecast_values, gsp_yields = make_synthetic_data(
+        end_datetime=datetime(2024, 7, 1),
+        model_names=["pvnet_v2"],
+        days=1,
+        runs_per_hour=2,
+        max_forecast_horizon_minutes=240,
+        plevels=["10", "90"],
+    )
+
+    forecast_values = all_forecast_values["pvnet_v2"]
+
+    # 48 forecast runs, each with 8 forecast horizons
+    assert len(forecast_values) == 48 * 8
+    assert list(forecast_values.columns) == [
+        "expected_power_generation_megawatts",
+        "adjust_mw",
+        "created_utc",
+        "10",
+        "90",
+    ]
+    assert forecast_values.index.is_monotonic_increasing
+    assert (forecast_values["10"] <= forecast_values["90"]).all()
+
+    # every half hour, including the end
+    assert len(gsp_yields) == 49
+    assert (gsp_yields.solar_generation_kw >= 0).all()
+
+
+def test_run_benchmark():
+    end_datetime = datetime(2024, 7, 1)
+    all_forecast_values, gsp_yields = make_synthetic_data(
+        end_datetime=end_datetime,
+        model_names=["pvnet_v2"],
+        days=2,
+        runs_per_hour=1,
+    )
+
+    # this does not need a database
+    stages = run_benchmark(
+        all_forecast_values=all_forecast_values,
+        gsp_yields=gsp_yields,
+        end_datetime=end_datetime,
+        days=2,
+    )
+
+    stages = {stage["name"]: stage for stage in stages}
+    assert list(stages) == [
+        "get_all_aligned_forecast_values",
+        "make_mae",
+        "make_rmse",
+        "make_me",
+        "make_ramp_rate",
+        "make_probabilistic",
+    ]
+    # with and without the adjuster
+    assert stages["make_mae"]["rows_out"] > 0
+    assert stages["make_mae"]["rows_out"] % 2 == 0
+    assert stages["make_me"]["rows_out"] > 0
+    assert stages["make_probabilistic"]["rows_out"] > 0
+    for stage in stages.values():
+        assert stage["queries"] == 0
+        assert stage["peak_memory_mb"] > 0
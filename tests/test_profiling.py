@@ -0,0 +1,34 @@
+import json
+
+from sqlalchemy import text
+
+from nowcasting_metrics.profiling import StageProfiler, count_queries
+
+
+def test_stage_profiler(db_session, tmp_path):
+    count_queries(db_session.bind)
+    profiler = StageProfiler()
+
+    with profiler.stage("query", model_name="pvnet_v2") as stage:
+        db_session.execute(text("SELECT 1"))
+        db_session.execute(text("SELECT 2"))
+        stage["rows_out"] = 2
+
+    with profiler.stage("no_query"):
+        pass
+
+    query_stage, no_query_stage = profiler.stages
+    assert query_stage["name"] == "query"
+    assert query_stage["model_name"] == "pvnet_v2"
+    assert query_stage["queries"] == 2
+    assert query_stage["rows_out"] == 2
+    assert query_stage["seconds"] >= 0
+    assert query_stage["peak_rss_mb"] > 0
+    assert no_query_stage["queries"] == 0
+
+    filename = tmp_path / "report.json"
+    profiler.save_report(str(filename))
+    with open(filename) as f:
+        report = json.load(f)
+
+    assert [stage["name"] for stage in report["stages"]] == ["query", "no_query"]
@@ -1,5 +1,6 @@
-from nowcasting_metrics.utils import save_metric_value_to_database
-from nowcasting_datamodel.models import MetricSQL
+from nowcasting_metrics.utils import MetricValueWriter, save_metric_value_to_database
+from nowcasting_datamodel.models import Metric, MetricSQL, MetricValueSQL
+from nowcasting_datamodel.read.read import get_location
 
 
 def test_save_metric_value_to_database_location_none(db_session, datetime_interval):
@@ -14,3 +15,49 @@ def test_save_metric_value_to_database_location_none(db_session, datetime_interv
         metric=metric,
         datetime_interval=datetime_interval,
     )
+
+
+def test_metric_value_writer(db_session, datetime_interval):
+    """Collect metric values and save them to the database in one bulk insert"""
+
+    metric = Metric(name="test_model", description="test model")
+    location = get_location(session=db_session, gsp_id=0)
+    metric_value_writer = MetricValueWriter(session=db_session)
+
+    for forecast_horizon_minutes in range(0, 120, 30):
+        save_metric_value_to_database(
+            session=db_session,
+            value=forecast_horizon_minutes / 10,
+            number_of_data_points=2,
+            metric=metric,
+            datetime_interval=datetime_interval,
+            location=location,
+            forecast_horizon_minutes=forecast_horizon_minutes,
+            model_name="pvnet_v2",
+            metric_value_writer=metric_value_writer,
+        )
+
+    # values of None are not saved
+    save_metric_value_to_database(
+        session=db_session,
+        value=None,
+        number_of_data_points=0,
+        metric=metric,
+        datetime_interval=datetime_interval,
+        metric_value_writer=metric_value_writer,
+    )
+
+    assert len(metric_value_writer) == 4
+    assert db_session.query(MetricValueSQL).count() == 0
+
+    assert metric_value_writer.flush() == 4
+    assert len(metric_value_writer) == 0
+
+    metric_values = db_session.query(MetricValueSQL).order_by(MetricValueSQL.value).all()
+    assert len(metric_values) == 4
+    assert [m.forecast_horizon_minutes for m in metric_values] == [0, 30, 60, 90]
+    assert metric_values[3].value == 9
+    assert metric_values[3].metric.name == "test_model"
+    assert metric_values[3].location.gsp_id == 0
+    assert metric_values[3].model.name == "pvnet_v2"
+    assert len(db_session.query(MetricSQL).all()) == 1